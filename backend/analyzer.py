@@ -3,44 +3,66 @@ import re
 import requests
 import json
 import time
+import threading
 from bs4 import BeautifulSoup
 from urllib.parse import urlparse, quote_plus
-try:
-    import google.genai as genai
-    NEW_SDK = True
-except ImportError:
-    import google.generativeai as genai
-    NEW_SDK = False
-    
-# Check if the new SDK is properly available
-try:
-    if NEW_SDK:
-        genai.configure(api_key=GEMINI_API_KEY)
-except AttributeError:
-    # If configure doesn't exist, fall back to legacy SDK
-    NEW_SDK = False
-    import google.generativeai as genai
 from dotenv import load_dotenv
 from fake_news_detection import detect_fake_news, train_fake_news_detector
 import datetime
+import compaction
+import deadline
+import debug_log
+import evidence_index
+import gemini_quota
+import llm_batcher
+import media_upload
+import metrics
+import near_duplicate
+import page_cache
+import politeness
+import prescreen
+import search_cache
+
+logger = debug_log.get_logger("analyzer")
 
 # Load environment variables from .env file
 load_dotenv()
 
 # AI Configuration
-GEMINI_API_KEY = os.getenv("GEMINI_API_KEY", "")
+# One key, or a pool of keys whose quotas gemini_quota schedules calls over
+GEMINI_API_KEYS = [key.strip() for key in os.getenv("GEMINI_API_KEYS", "").split(",") if key.strip()]
+GEMINI_API_KEY = os.getenv("GEMINI_API_KEY", "") or (GEMINI_API_KEYS[0] if GEMINI_API_KEYS else "")
+GEMINI_MODEL_NAME = os.getenv("GEMINI_MODEL_NAME", "gemini-1.5-flash")
 AI_PLATFORM = os.getenv("AI_PLATFORM", "gemini").lower() # gemini or ollama
 OLLAMA_HOST = os.getenv("OLLAMA_HOST", "http://localhost:11434")
 OLLAMA_MODEL_TEXT = os.getenv("OLLAMA_MODEL_TEXT", "llama3.1:latest")
 OLLAMA_MODEL_VISION = os.getenv("OLLAMA_MODEL_VISION", "llava:latest")
+# Answer Ollama-platform news requests from the pre-trained model before asking the LLM
+LOCAL_MODEL_FIRST = os.getenv("LOCAL_MODEL_FIRST", "1") != "0"
 
-def call_ollama(prompt, model="llama3.1", images=None, timeout=60):
-    """Calls local Ollama API"""
-    print(f"DEBUG: call_ollama called with model: {model}, images: {bool(images)}, timeout: {timeout}")
+# Upstream endpoints (overridable so benchmarks can point them at local stand-ins)
+DUCKDUCKGO_HTML_URL = os.getenv("DUCKDUCKGO_HTML_URL", "https://html.duckduckgo.com/html/")
+NEWS_API_BASE_URL = os.getenv("NEWS_API_BASE_URL", "https://newsapi.org/v2")
+GEMINI_API_BASE = os.getenv("GEMINI_API_BASE", "https://generativelanguage.googleapis.com")
+
+# Hosts used as keys for per-hop latency tracking in the deadline budget
+OLLAMA_HOSTNAME = urlparse(OLLAMA_HOST).netloc or OLLAMA_HOST
+GEMINI_HOSTNAME = urlparse(GEMINI_API_BASE).netloc
+SEARCH_HOSTNAME = urlparse(DUCKDUCKGO_HTML_URL).netloc
+GEMINI_TIMEOUT = 30
+# Largest upload sent inline to Gemini (the request, base64 included, must stay under 20 MB)
+GEMINI_INLINE_MAX_BYTES = int(os.getenv("GEMINI_INLINE_MAX_BYTES", str(14 * 1024 * 1024)))
+
+def call_ollama(prompt, model="llama3.1", images=None, timeout=60, media=None):
+    """Calls local Ollama API; media is a MediaUpload sent as the image, streamed"""
+    timeout = deadline.hop_timeout(OLLAMA_HOSTNAME, timeout)
+    logger.debug("call_ollama called with model: %s, images: %s, timeout: %s", model, bool(images), timeout)
+    if not timeout:
+        deadline.mark_skipped("ollama")
+        return "Error: Request budget exhausted before Ollama call. Using faster local analysis."
+    started = time.monotonic()
     try:
-        with open("ai_debug_output.txt", "a", encoding="utf-8") as f:
-            f.write(f"\n--- {time.ctime()} --- OLLAMA REQ ({model}) ---\nPrompt: {prompt[:200]}...\n")
-            if images: f.write(f"Images attached: {len(images)}\n")
+        logger.debug("Ollama request", extra={"model": model, "prompt": prompt, "images": len(images) if images else 0})
 
         payload = {
             "model": model,
@@ -50,71 +72,108 @@ def call_ollama(prompt, model="llama3.1", images=None, timeout=60):
         }
         if images:
             payload["images"] = images
+        request_body = {"json": payload}
+        if media is not None:
+            # Base64-encoded while it is sent instead of held in memory
+            payload["images"] = [media_upload.media_placeholder()]
+            request_body = {"data": media_upload.streamed_json(payload, media), "headers": {"Content-Type": "application/json"}}
             
-        print(f"DEBUG: Calling Ollama ({model}) with payload...")
+        logger.debug("Calling Ollama (%s) with payload...", model)
         # Use specified timeout (default 60 seconds for better performance)
-        response = requests.post(f"{OLLAMA_HOST}/api/generate", json=payload, timeout=timeout)
+        with metrics.stage("ollama_call"):
+            response = requests.post(f"{OLLAMA_HOST}/api/generate", timeout=timeout, **request_body)
+        deadline.record_latency(OLLAMA_HOSTNAME, time.monotonic() - started)
         
-        with open("ai_debug_output.txt", "a", encoding="utf-8") as f:
-            f.write(f"Ollama Status: {response.status_code}\n")
+        logger.debug("Ollama status", extra={"model": model, "status_code": response.status_code})
 
         if response.status_code == 200:
             res_json = response.json()
-            print(f"DEBUG: Ollama response received: {res_json.keys() if isinstance(res_json, dict) else type(res_json)}")
+            logger.debug("Ollama response received: %s", res_json.keys() if isinstance(res_json, dict) else type(res_json))
             res_text = res_json.get("response", "")
-            with open("ai_debug_output.txt", "a", encoding="utf-8") as f:
-                f.write(f"Ollama Resp: {res_text[:500]}\n")
-            print(f"DEBUG: Returning response: {res_text[:100]}...")
+            logger.debug("Ollama response", extra={"model": model, "response": res_text})
             return res_text
         else:
             err_msg = f"Error: Ollama returned {response.status_code}"
-            with open("ai_debug_output.txt", "a", encoding="utf-8") as f:
-                f.write(f"{err_msg}\n")
-            print(f"DEBUG: Ollama returned error: {err_msg}")
+            metrics.record_provider_error("ollama", f"HTTP {response.status_code}")
+            logger.warning("Ollama returned error: %s", err_msg)
             return err_msg
-    except requests.exceptions.ConnectionError:
+    except requests.exceptions.ConnectionError as e:
+        metrics.record_provider_error("ollama", e)
         err_msg = "Error: Cannot connect to Ollama. Is the Ollama service running?"
-        print(f"DEBUG: Connection error to Ollama: {err_msg}")
+        logger.warning("Connection error to Ollama: %s", err_msg)
         return err_msg
-    except requests.exceptions.Timeout:
+    except requests.exceptions.Timeout as e:
+        metrics.record_provider_error("ollama", e)
+        deadline.record_latency(OLLAMA_HOSTNAME, time.monotonic() - started)
         err_msg = "Error: Ollama request timed out. Using faster local analysis."
-        print(f"DEBUG: Ollama request timed out: {err_msg}")
+        logger.warning("Ollama request timed out: %s", err_msg)
         return err_msg
     except Exception as e:
+        metrics.record_provider_error("ollama", e)
         err_msg = f"Error connecting to Ollama: {str(e)}"
-        with open("ai_debug_output.txt", "a", encoding="utf-8") as f:
-            f.write(f"{err_msg}\n")
-        print(f"DEBUG: General error in call_ollama: {err_msg}")
+        logger.warning("General error in call_ollama: %s", err_msg)
         return err_msg
 
-# Initialize the Gemini model with the google.genai/google.generativeai package
-model = None
-if GEMINI_API_KEY and GEMINI_API_KEY != "" and len(GEMINI_API_KEY) > 20:  # Check for a reasonably long API key
-    print(f"DEBUG: Key found (starts with: {GEMINI_API_KEY[:4]}...)")
+# The Gemini SDK is imported and the model initialized on first use, so that
+# importing this module stays fast and never touches the network
+NEW_SDK = False
+_gemini_model = None
+_gemini_initialized = False
+_gemini_lock = threading.Lock()
+
+def _import_genai():
+    """
+    Returns (genai module, is_new_sdk), preferring google.genai when it offers
+    the configure()/GenerativeModel API used here and falling back to the
+    legacy google.generativeai package otherwise.
+    """
     try:
-        if NEW_SDK:
-            # Configure the API key for new SDK
-            genai.configure(api_key=GEMINI_API_KEY)
-            # Initialize the model with new SDK
-            model = genai.GenerativeModel('gemini-1.5-flash')
+        import google.genai as genai
+        if hasattr(genai, "configure") and hasattr(genai, "GenerativeModel"):
+            return genai, True
+    except ImportError:
+        pass
+    import google.generativeai as genai
+    return genai, False
+
+def get_gemini_model():
+    """
+    Returns the shared Gemini model, initializing it on the first call; None
+    when no usable API key is configured or initialization failed. With quota
+    scheduling on (the default) this is a gemini_quota.PooledModel over
+    every configured key, else the SDK model for GEMINI_API_KEY.
+    """
+    global NEW_SDK, _gemini_model, _gemini_initialized
+    if _gemini_initialized:
+        return _gemini_model
+    with _gemini_lock:
+        if _gemini_initialized:
+            return _gemini_model
+        # Check for reasonably long API keys
+        keys = [key for key in (GEMINI_API_KEYS or [GEMINI_API_KEY]) if len(key) > 20]
+        if keys and gemini_quota.GEMINI_QUOTA_ENABLED:
+            logger.debug("Scheduling Gemini calls over %s key(s)", len(keys))
+            _gemini_model = gemini_quota.PooledModel(keys, GEMINI_MODEL_NAME, GEMINI_API_BASE)
+        elif GEMINI_API_KEY and len(GEMINI_API_KEY) > 20:
+            logger.debug("Key found (starts with: %s...)", GEMINI_API_KEY[:4])
+            try:
+                genai, NEW_SDK = _import_genai()
+                genai.configure(api_key=GEMINI_API_KEY)
+                _gemini_model = genai.GenerativeModel(GEMINI_MODEL_NAME)
+                logger.debug("Model initialized successfully")
+            except Exception as e:
+                logger.warning("Error initializing model: %s", e)
+                _gemini_model = None
         else:
-            # Configure the API key for legacy SDK
-            genai.configure(api_key=GEMINI_API_KEY)
-            # Initialize the model with legacy SDK
-            model = genai.GenerativeModel('gemini-1.5-flash')
-        print("DEBUG: Model initialized successfully")
-    except Exception as e:
-        print(f"DEBUG: Error initializing model: {e}")
-        model = None
-else:
-    print("DEBUG: No valid API key provided")
-    model = None
+            logger.debug("No valid API key provided")
+        _gemini_initialized = True
+    return _gemini_model
 
 def analyze_news(text, analysis_type="news", image_data=None, mime_type=None):
     """
     Analyzes news content, a URL, or media for authenticity and risks.
     """
-    print(f"DEBUG: analyze_news called with text type: {type(text)}, analysis_type: {analysis_type}, image_data: {bool(image_data)}")
+    logger.debug("analyze_news called with text type: %s, analysis_type: %s, image_data: %s", type(text), analysis_type, bool(image_data))
     
     # Check if input is a URL
     parsed_url = urlparse(text.strip()) if text else None
@@ -125,25 +184,53 @@ def analyze_news(text, analysis_type="news", image_data=None, mime_type=None):
         return analyze_deepfake(text, image_data=image_data, mime_type=mime_type)
     elif analysis_type == "privacy":
         # For privacy analysis, use our dedicated function
-        print(f"DEBUG: Calling privacy analysis for: {text[:50]}...")
+        logger.debug("Calling privacy analysis for: %s...", text[:50])
         return analyze_content(text, analysis_type="privacy")
     elif is_url:
         url = text.strip()
-        content = fetch_url_content(url)
+        with metrics.stage("url_fetch"):
+            content = fetch_url_content(url)
         if not content:
             # If scraping fails, don't just fail-fast with heuristics.
             # Use the URL itself as the 'content' for the AI, which will trigger a web search.
             content = f"News URL: {url}"
             is_url = True # Keep this flag
-            print(f"DEBUG: Scraping failed for {url}. Passing URL to AI for search-enhanced analysis.")
+            logger.warning("Scraping failed for %s. Passing URL to AI for search-enhanced analysis.", url)
         
-        return perform_ai_analysis(content, is_url=is_url, url=url, analysis_type=analysis_type)
+        if deadline.expired():
+            # Nothing left for an AI call: answer with what we have so far
+            deadline.mark_skipped("ai")
+            return prescreen_result(url) or heuristic_fallback(content, is_url, url, "Request budget exhausted", analysis_type)
+
+        return analyze_with_reuse(content, is_url=is_url, url=url, analysis_type=analysis_type)
     else:
         # For news_advanced analysis, use analyze_content directly
         if analysis_type == "news_advanced":
             return analyze_content(text, analysis_type=analysis_type)
         else:
-            return perform_ai_analysis(text, analysis_type=analysis_type)
+            return analyze_with_reuse(text, analysis_type=analysis_type)
+
+def extract_main_text(html):
+    """
+    Extracts the main article text from an HTML page.
+    """
+    soup = BeautifulSoup(html, 'html.parser')
+    # Prefer <article> content if available
+    article = soup.find('article')
+    if article:
+        text = article.get_text(separator='\n')
+    else:
+        # Fallback: join largest <p> blocks (heuristic)
+        p_texts = [p.get_text(separator=' ') for p in soup.find_all('p') if p.get_text(strip=True)]
+        # Choose longest contiguous set: take top 8 paragraphs by length
+        p_texts_sorted = sorted(p_texts, key=lambda s: len(s), reverse=True)
+        text = '\n\n'.join(p_texts_sorted[:8]) if p_texts_sorted else soup.get_text()
+
+    # Normalize whitespace and return a reasonable slice
+    lines = (line.strip() for line in text.splitlines())
+    chunks = (phrase.strip() for line in lines for phrase in line.split('  '))
+    text = '\n'.join(chunk for chunk in chunks if chunk)
+    return text[:12000]
 
 def fetch_url_content(url):
     """
@@ -152,97 +239,293 @@ def fetch_url_content(url):
     headers = {
         'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
     }
-    # Try a couple of times to fetch the page and extract main content
-    for attempt in range(2):
+    cached = page_cache.get(url)
+    metrics.record_cache("page", cached is not None)
+    if cached is not None:
+        return cached
+    host = urlparse(url).netloc
+    # Try a couple of times to fetch the page and extract main content,
+    # but only as many attempts as the request budget still allows
+    attempts = deadline.hop_attempts(host, 2, 7)
+    if not attempts:
+        deadline.mark_skipped("fetch")
+    for attempt in range(attempts):
+        timeout = deadline.hop_timeout(host, 7)
+        if not timeout:
+            deadline.mark_skipped("fetch")
+            break
+        started = time.monotonic()
         try:
-            response = requests.get(url, headers=headers, timeout=7)
+            with politeness.acquire(url) as slot:
+                started = time.monotonic()
+                response = requests.get(url, headers=headers, timeout=timeout)
+                throttled = slot.record(response.status_code, response.headers.get("Retry-After"))
+            deadline.record_latency(host, time.monotonic() - started)
+            if throttled:
+                # The host is backed off now; further attempts would be refused
+                logger.warning("Fetching %s throttled with HTTP %s", url, response.status_code)
+                return None
             response.raise_for_status()
-
-            soup = BeautifulSoup(response.text, 'html.parser')
-            # Prefer <article> content if available
-            article = soup.find('article')
-            if article:
-                text = article.get_text(separator='\n')
-            else:
-                # Fallback: join largest <p> blocks (heuristic)
-                p_texts = [p.get_text(separator=' ') for p in soup.find_all('p') if p.get_text(strip=True)]
-                # Choose longest contiguous set: take top 8 paragraphs by length
-                p_texts_sorted = sorted(p_texts, key=lambda s: len(s), reverse=True)
-                text = '\n\n'.join(p_texts_sorted[:8]) if p_texts_sorted else soup.get_text()
-
-            # Normalize whitespace and return a reasonable slice
-            lines = (line.strip() for line in text.splitlines())
-            chunks = (phrase.strip() for line in lines for phrase in line.split('  '))
-            text = '\n'.join(chunk for chunk in chunks if chunk)
-            return text[:12000]
+            content = extract_main_text(response.text)
+            page_cache.put(url, content)
+            evidence_index.add_async(url, content)
+            return content
+        except politeness.Refused as e:
+            logger.warning("Not fetching %s: %s", url, e)
+            return None
         except Exception as e:
+            metrics.record_provider_error("fetch", e)
             # Distinguish timeouts and retry once
             try:
                 from requests.exceptions import ReadTimeout
                 if isinstance(e, ReadTimeout):
-                    print(f"Timeout fetching URL (attempt {attempt+1}): {url}")
+                    deadline.record_latency(host, time.monotonic() - started)
+                    logger.warning("Timeout fetching URL (attempt %s): %s", attempt+1, url)
                 else:
-                    print(f"Error fetching URL (attempt {attempt+1}): {e}")
+                    logger.warning("Error fetching URL (attempt %s): %s", attempt+1, e)
             except:
-                print(f"Error fetching URL (attempt {attempt+1}): {e}")
-            time.sleep(1)
+                logger.warning("Error fetching URL (attempt %s): %s", attempt+1, e)
     return None
 
 
+def parse_search_results(html, max_results=3):
+    """
+    Extracts up to max_results external result links from a DuckDuckGo HTML page.
+    """
+    soup = BeautifulSoup(html, 'html.parser')
+    links = []
+    for a in soup.find_all('a', href=True):
+        href = a['href']
+        if href.startswith('http') and 'duckduckgo.com' not in href:
+            if href not in links:
+                links.append(href)
+        if len(links) >= max_results:
+            break
+    return links[:max_results]
+
 def web_search_duckduckgo(query, max_results=3):
     """
-    Perform a simple DuckDuckGo HTML search and return a list of result URLs (best-effort).
+    Return up to max_results result URLs for query (best-effort), through the
+    search cache; None when the search failed and nothing cached can stand in.
+    """
+    return search_cache.cached_search(query, max_results, fetch_search_results)
+
+def fetch_search_results(query, max_results=3):
+    """
+    Perform a simple DuckDuckGo HTML search and return a list of result URLs ([] for none, None on failure).
     This avoids JavaScript-heavy search pages and attempts to provide quick evidence links.
     """
     # Try twice to get search results (best-effort)
     headers = {
         'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
     }
-    for attempt in range(2):
+    attempts = deadline.hop_attempts(SEARCH_HOSTNAME, 2, 6)
+    if not attempts:
+        deadline.mark_skipped("search")
+    for attempt in range(attempts):
+        timeout = deadline.hop_timeout(SEARCH_HOSTNAME, 6)
+        if not timeout:
+            deadline.mark_skipped("search")
+            break
+        started = time.monotonic()
         try:
             q = quote_plus(query)
-            search_url = f"https://html.duckduckgo.com/html/?q={q}"
-            r = requests.get(search_url, headers=headers, timeout=6)
+            search_url = f"{DUCKDUCKGO_HTML_URL}?q={q}"
+            # A search API rather than a crawl: host limits apply, robots.txt does not
+            with politeness.acquire(search_url, robots=False) as slot:
+                started = time.monotonic()
+                r = requests.get(search_url, headers=headers, timeout=timeout)
+                throttled = slot.record(r.status_code, r.headers.get("Retry-After"), search_cache.THROTTLE_STATUSES)
+            deadline.record_latency(SEARCH_HOSTNAME, time.monotonic() - started)
+            if throttled:
+                # Retrying only prolongs the block; the cache serves stale results meanwhile
+                search_cache.throttled(r.headers.get("Retry-After"))
+                return None
             r.raise_for_status()
-            soup = BeautifulSoup(r.text, 'html.parser')
-            links = []
-            for a in soup.find_all('a', href=True):
-                href = a['href']
-                if href.startswith('http') and 'duckduckgo.com' not in href:
-                    if href not in links:
-                        links.append(href)
-                if len(links) >= max_results:
-                    break
-            return links[:max_results]
+            return parse_search_results(r.text, max_results)
+        except politeness.Refused as e:
+            logger.warning("web_search_duckduckgo skipped: %s", e)
+            if e.retry_after:
+                search_cache.throttled(e.retry_after)
+            return None
+        except Exception as e:
+            metrics.record_provider_error("duckduckgo", e)
+            logger.warning("web_search_duckduckgo attempt %s failed: %s", attempt+1, e)
+    return None
+
+def build_gemini_prompt(content, analysis_type="news"):
+    """Short structured-answer prompt for the Gemini news/privacy checks."""
+    if analysis_type == "privacy":
+        return f"Identify PII/privacy risks in this text. Respond ONLY as: Status: [Low/Med/High], Confidence: [0-100], Explanation: [Short summary]. TEXT: {content[:5000]}"
+    # news analysis: the most salient sentences rather than the first 5000 chars
+    content = compaction.compact(content, compaction.COMPACT_GEMINI_TOKENS)
+    return f"Verify news authenticity. Respond ONLY as: Status: [Likely Real/Fake/Uncertain], Confidence: [0-100], Explanation: [Brief assessment]. CONTENT: {content}"
+
+def build_ollama_prompt(content, analysis_type="news", search_context=""):
+    """Prompt for the local Ollama model; news prompts embed the search context."""
+    if analysis_type == "privacy":
+        # Reduce privacy context and use neutral data classification prompt
+        return (
+            "Task: Classify data sensitivity.\n"
+            f"Input: {content[:1500]}\n"
+            "Instructions: Determine if the input contains sensitive personal data (Names, Emails, IDs).\n"
+            "Do not write code.\n"
+            "Response Format:\n"
+            "Status: [High/Medium/Low]\n"
+            "Confidence: [0-100]\n"
+            "Explanation: [Brief reason]\n"
+        )
+    content = compaction.compact(content, compaction.COMPACT_OLLAMA_TOKENS)
+    return (
+        "You are an expert fact-checker. Verify the CONTENT below using 'REAL-TIME CONTEXT' as truth. "
+        "Respond ONLY as: Status: [Likely Real/Likely Fake/Uncertain], Confidence: [0-100], Explanation: [Assessment]. "
+        f"{search_context}\n\nCONTENT TO ANALYZE: {content}"
+    )
+
+def search_query_for(content):
+    """Extract a very concise search query (the first line, capped at 100 chars)."""
+    lines = content.split('\n')
+    first_line = lines[0].strip() if lines else content
+    return first_line[:100]
+
+def format_search_context(ref_content, query=None):
+    # Keep the reference sentences most relevant to the claim (query)
+    ref_content = compaction.compact(ref_content, compaction.COMPACT_CONTEXT_TOKENS, query=query)
+    return f"\n\nREAL-TIME CONTEXT FROM SEARCH:\n{ref_content}\n"
+
+def local_model_result(content):
+    """
+    Runs the pre-trained detector and shapes its verdict like an AI result.
+    """
+    detection_result = detect_fake_news(content)
+    metrics.record_fallback("local_model")
+    logger.debug("Pre-trained model result: %s", detection_result)
+
+    # Return the result in the expected format
+    result = {
+        "status": detection_result['status'],
+        "confidence": detection_result['confidence'],
+        "reason": detection_result['reason'],
+        "correction": detection_result.get('correction', ''),
+        "privacy_risk": "Not Applicable",
+        "privacy_explanation": "Privacy risk assessment not applicable to this function.",
+        "source": "local_model",
+    }
+    logger.debug("Returning pre-trained model result: %s with confidence %s", result['status'], result['confidence'])
+    return result
+
+def prescreen_result(url):
+    """
+    The full-text pre-screen verdict of a trending url (see prescreen.py)
+    shaped like an AI result, or None when this process has no fresh one.
+    """
+    verdict = prescreen.get_verdict(url)
+    if verdict is None or verdict["basis"] != "content":
+        return None
+    metrics.record_fallback("prescreen")
+    return {
+        "status": verdict["status"],
+        "confidence": verdict["confidence"],
+        "reason": f"Pre-screened on the full article text by the local model; source rated {verdict['source_status']}.",
+        "correction": "",
+        "privacy_risk": "Not Applicable",
+        "privacy_explanation": "Privacy risk assessment not applicable to this function.",
+        "credibility": verdict["credibility"],
+        "source": "prescreen",
+    }
+
+def reuse_near_duplicate(content, analysis_type="news"):
+    """
+    Returns a copy of the verdict of a recently analyzed near-identical text,
+    tagged with its similarity, or None.
+    """
+    match = near_duplicate.lookup(content, analysis_type)
+    metrics.record_cache("near_duplicate", match is not None)
+    if match is None:
+        return None
+    similarity, result = match
+    return dict(result, near_duplicate={"similarity": round(similarity, 3)})
+
+def is_degraded(result):
+    """
+    True for answers that did not come from an AI model: results of the
+    heuristics, the local model or the pre-screen carry a "source" tag.
+    """
+    return isinstance(result, dict) and "source" in result
+
+def remember_verdict(content, analysis_type, result):
+    # Only AI verdicts, and only those not cut short by the request budget, are worth reusing
+    current = deadline.current()
+    if not (current and current.skipped) and not is_degraded(result):
+        near_duplicate.remember(content, analysis_type, result)
+
+def analyze_with_reuse(content, is_url=False, url=None, analysis_type="news"):
+    """
+    perform_ai_analysis, except that reworded copies of a recently analyzed
+    text reuse its verdict (see near_duplicate.py).
+    """
+    reused = reuse_near_duplicate(content, analysis_type)
+    if reused is not None:
+        return reused
+    result = perform_ai_analysis(content, is_url=is_url, url=url, analysis_type=analysis_type)
+    remember_verdict(content, analysis_type, result)
+    return result
+
+def quota_overflow_result(content, analysis_type, overflow):
+    """
+    Answer for an analysis Gemini had no quota left for: the local model for
+    news when overflow is "local", else None (the caller goes on to Ollama or
+    the heuristics).
+    """
+    metrics.record_fallback(f"quota_{overflow}")
+    if overflow == "local" and analysis_type == "news":
+        try:
+            return local_model_result(content)
         except Exception as e:
-            print(f"DEBUG: web_search_duckduckgo attempt {attempt+1} failed: {e}")
-            time.sleep(1)
+            logger.warning("Local model unavailable for quota overflow: %s", e)
+    return None
 
 def perform_ai_analysis(content, is_url=False, url=None, analysis_type="news"):
     """
     Use the Gemini SDK to analyze content.
     """
     # Prioritize Gemini when available, regardless of AI_PLATFORM setting
-    if GEMINI_API_KEY and model:
+    model = get_gemini_model()
+    overflow = None
+    gemini_timeout = deadline.hop_timeout(GEMINI_HOSTNAME, GEMINI_TIMEOUT)
+    if GEMINI_API_KEY and model and not gemini_timeout:
+        deadline.mark_skipped("gemini")
+    elif GEMINI_API_KEY and model:
         try:
-            # Save request for debug
-            with open("ai_debug_output.txt", "a", encoding="utf-8") as f:
-                f.write(f"\n--- {time.ctime()} --- SDK CALL ---\nType: {analysis_type}\n")
+            # Short analyses share one Gemini request with their neighbours
+            future = llm_batcher.submit(content, analysis_type)
+            if future is not None:
+                try:
+                    return llm_batcher.result(future, gemini_timeout)
+                except llm_batcher.BatchError as e:
+                    logger.debug("Batched Gemini analysis unavailable (%s); sending it on its own", e)
+                gemini_timeout = deadline.hop_timeout(GEMINI_HOSTNAME, GEMINI_TIMEOUT)
+                if not gemini_timeout:
+                    deadline.mark_skipped("gemini")
+                    raise Exception("Request budget exhausted before single Gemini call")
 
-            if analysis_type == "privacy":
-                prompt_text = f"Identify PII/privacy risks in this text. Respond ONLY as: Status: [Low/Med/High], Confidence: [0-100], Explanation: [Short summary]. TEXT: {content[:5000]}"
-            else: # news analysis
-                prompt_text = f"Verify news authenticity. Respond ONLY as: Status: [Likely Real/Fake/Uncertain], Confidence: [0-100], Explanation: [Brief assessment]. CONTENT: {content[:5000]}"
+            logger.debug("Gemini SDK call", extra={"analysis_type": analysis_type})
+
+            prompt_text = build_gemini_prompt(content, analysis_type)
 
             # Use the SDK to call the model
             if model:
-                response = model.generate_content(
-                    prompt_text,
-                    generation_config={
-                        "temperature": 0.1,
-                        "max_output_tokens": 250
-                    }
-                )
+                started = time.monotonic()
+                with metrics.stage("gemini_call"):
+                    response = model.generate_content(
+                        prompt_text,
+                        generation_config={
+                            "temperature": 0.1,
+                            "max_output_tokens": 250
+                        },
+                        request_options={"timeout": gemini_timeout}
+                    )
+                deadline.record_latency(GEMINI_HOSTNAME, time.monotonic() - started)
                 
                 if hasattr(response, 'text') and response.text:
                     ai_text = response.text
@@ -253,69 +536,63 @@ def perform_ai_analysis(content, is_url=False, url=None, analysis_type="news"):
 
             return parse_ai_response(ai_text, analysis_type=analysis_type)
 
+        except gemini_quota.QuotaExhausted as e:
+            # Nothing was sent: answer from the overflow tier while the quota recovers
+            logger.debug("Gemini quota exhausted (%s); overflowing to %s", e, gemini_quota.GEMINI_OVERFLOW)
+            overflow = gemini_quota.GEMINI_OVERFLOW
+        except llm_batcher.BatchTimeout as e:
+            # Our wait ran out, not Gemini; the batch call is bounded by the same deadline
+            logger.warning("Batched Gemini analysis timed out: %s", e)
+            deadline.mark_skipped("gemini")
         except Exception as e:
-            print(f"DEBUG: Gemini analysis failed: {e}")
+            metrics.record_provider_error("gemini", e)
+            logger.warning("Gemini analysis failed: %s", e)
             # If Gemini fails, fall back to other methods
     
+    if overflow:
+        result = quota_overflow_result(content, analysis_type, overflow)
+        if result is not None:
+            return result
+
     # If Gemini is not available or failed, use Ollama or pre-trained model
-    if AI_PLATFORM == "ollama":
-        if analysis_type == "news":
+    if AI_PLATFORM == "ollama" or overflow == "ollama":
+        if analysis_type == "news" and LOCAL_MODEL_FIRST:
             # For news analysis, first try the pre-trained model
             try:
-                print(f"DEBUG: Attempting to use pre-trained fake news detector for news analysis...")
-                detection_result = detect_fake_news(content)
-                print(f"DEBUG: Pre-trained model result: {detection_result}")
-                
-                # Return the result in the expected format
-                result = {
-                    "status": detection_result['status'],
-                    "confidence": detection_result['confidence'],
-                    "reason": detection_result['reason'],
-                    "correction": detection_result.get('correction', ''),
-                    "privacy_risk": "Not Applicable",
-                    "privacy_explanation": "Privacy risk assessment not applicable to this function."
-                }
-                print(f"DEBUG: Returning pre-trained model result: {result['status']} with confidence {result['confidence']}")
-                return result
+                logger.debug("Attempting to use pre-trained fake news detector for news analysis...")
+                return local_model_result(content)
             except Exception as e:
-                print(f"DEBUG: Error using pre-trained fake news detector, falling back to Ollama: {e}")
+                logger.warning("Error using pre-trained fake news detector, falling back to Ollama: %s", e)
                 # Continue with Ollama as fallback
         
-        if analysis_type == "privacy":
-            # Reduce privacy context and use neutral data classification prompt
-            prompt = (
-                "Task: Classify data sensitivity.\n"
-                f"Input: {content[:1500]}\n"
-                "Instructions: Determine if the input contains sensitive personal data (Names, Emails, IDs).\n"
-                "Do not write code.\n"
-                "Response Format:\n"
-                "Status: [High/Medium/Low]\n"
-                "Confidence: [0-100]\n"
-                "Explanation: [Brief reason]\n"
-            )
-        else: # news analysis fallback to Ollama
+        search_context = ""
+        if analysis_type != "privacy":  # news analysis fallback to Ollama
             # Add search context to prevent hallucinations
-            # Extract a very concise search query
-            lines = content.split('\n')
-            first_line = lines[0].strip() if lines else content
-            search_query = first_line[:100]
+            search_query = search_query_for(content)
             
-            print(f"DEBUG: Performing concise web search for: {search_query}...")
-            links = web_search_duckduckgo(search_query, max_results=1)
-            search_context = ""
+            links = None
+            # Pages we fetched before often already cover the claim; only
+            # search the web when local recall is low
+            evidence = evidence_index.find_evidence(search_query, exclude_url=url)
+            if evidence:
+                logger.debug("Using local evidence from %s (coverage %.2f)", evidence["url"], evidence["coverage"])
+                search_context = format_search_context(evidence["content"], search_query)
+            # Search enrichment is optional: only start it if the budget can
+            # still cover search + reference fetch + the Ollama call itself
+            elif deadline.can_afford((SEARCH_HOSTNAME, 3), ("reference", 3), (OLLAMA_HOSTNAME, 10)):
+                logger.debug("Performing concise web search for: %s...", search_query)
+                with metrics.stage("search"):
+                    links = web_search_duckduckgo(search_query, max_results=1)
+            else:
+                deadline.mark_skipped("search")
             if links:
-                print(f"DEBUG: Found link for context: {links[0]}")
-                ref_content = fetch_url_content(links[0])
+                logger.debug("Found link for context: %s", links[0])
+                with metrics.stage("reference_fetch"):
+                    ref_content = fetch_url_content(links[0])
                 if ref_content:
-                    # Limit reference content to 1500 chars
-                    search_context = f"\n\nREAL-TIME CONTEXT FROM SEARCH:\n{ref_content[:1500]}\n"
-            
-            prompt = (
-                "You are an expert fact-checker. Verify the CONTENT below using 'REAL-TIME CONTEXT' as truth. "
-                "Respond ONLY as: Status: [Likely Real/Likely Fake/Uncertain], Confidence: [0-100], Explanation: [Assessment]. "
-                f"{search_context}\n\nCONTENT TO ANALYZE: {content[:1500]}"
-            )
+                    search_context = format_search_context(ref_content, search_query)
         
+        prompt = build_ollama_prompt(content, analysis_type, search_context)
         ai_text = call_ollama(prompt, model=OLLAMA_MODEL_TEXT)
         if "Error" in ai_text:
             return heuristic_fallback(content, is_url, url, ai_text, analysis_type)
@@ -324,6 +601,7 @@ def perform_ai_analysis(content, is_url=False, url=None, analysis_type="news"):
     # If no AI platform is available, use heuristic fallback
     return heuristic_fallback(content, is_url, url, "No AI platform available", analysis_type)
 
+@metrics.timed("response_parsing")
 def parse_ai_response(ai_response, analysis_type="news"):
     """
     Parse the AI response to extract structured data. Improved for robustness.
@@ -403,7 +681,7 @@ def parse_ai_response(ai_response, analysis_type="news"):
             "used_evidence": True
         }
     except Exception as e:
-        print(f"DEBUG: Error parsing AI response: {e}")
+        logger.warning("Error parsing AI response: %s", e)
         return {
             "status": status,
             "confidence": confidence,
@@ -414,66 +692,78 @@ def parse_ai_response(ai_response, analysis_type="news"):
             "used_evidence": True
         }
 
-def analyze_deepfake(file_path_or_data, image_data=None, mime_type=None):
+def analyze_deepfake_ollama(file_path_or_data, image_data=None, media=None):
+    """
+    Deepfake analysis of base64 image data, or of a MediaUpload, with the
+    Ollama vision model.
+    """
+    logger.debug("Deepfake analysis using Ollama with image data: %s", bool(image_data or media))
+    prompt_text = (
+        "Analyze this media for deepfakes, AI artifacts, or facial manipulation. "
+        "Respond ONLY as: Verdict: [Likely Real/Likely Deepfake/Uncertain], Confidence: [0-100], Reasoning: [Short assessment]. "
+        f"Context: Analyzing uploaded media file."
+    )
+
+    # image_data from frontend is already base64 encoded
+    ai_analysis = call_ollama(prompt_text, model=OLLAMA_MODEL_VISION, images=[image_data] if image_data else None, media=media)
+
+    if "Error" in ai_analysis:
+        logger.warning("Ollama deepfake analysis failed: %s", ai_analysis)
+        # Fallback to heuristics if ollama fails or model missing
+        return heuristic_fallback(file_path_or_data, False, None, ai_analysis, "deepfake")
+
+    logger.debug("Ollama deepfake analysis result: %s...", ai_analysis[:200])
+    # Parse the response (reusing logic)
+    verdict = "Uncertain"
+    verdict_match = re.search(r"Verdict:\s*\[?(Likely Real|Likely Deepfake|Uncertain|Likely Authentic)", ai_analysis, re.IGNORECASE)
+    if verdict_match:
+        v_raw = verdict_match.group(1).title()
+        if "Deepfake" in v_raw: verdict = "Likely Deepfake"
+        elif "Real" in v_raw or "Authentic" in v_raw: verdict = "Likely Authentic"
+
+    conf_val = 0.5
+    conf_match = re.search(r"Confidence:\s*\[?(\d+)", ai_analysis)
+    if conf_match:
+        conf_val = int(conf_match.group(1)) / 100.0
+
+    reasoning = "Local analysis completed via Ollama."
+    reason_match = re.search(r"Reasoning:\s*(.*)", ai_analysis, re.DOTALL | re.IGNORECASE)
+    if reason_match:
+        reasoning = reason_match.group(1).strip()
+
+    return {
+        "status": verdict,
+        "confidence": conf_val,
+        "reason": reasoning,
+        "privacy_risk": "Low",
+        "privacy_explanation": "Processed locally via Ollama.",
+        "analysis_details": {
+            "indicators_found": 0,
+            "fake_probability": conf_val if "Deepfake" in verdict else 1 - conf_val,
+            "technical_assessment": f"Ollama ({OLLAMA_MODEL_VISION}) assessment: {reasoning}"
+        }
+    }
+
+def analyze_deepfake(file_path_or_data, image_data=None, mime_type=None, media=None):
     """
-    Analyzes media content for deep fake indicators.
+    Analyzes media content for deep fake indicators. The media is either
+    base64 image_data or a media_upload.MediaUpload, which is streamed to the
+    model without an in-memory copy.
     """
-    print(f"DEBUG: analyze_deepfake called with file_path_or_data type: {type(file_path_or_data)}, image_data: {bool(image_data)}, mime_type: {mime_type}")
+    logger.debug("analyze_deepfake called with file_path_or_data type: %s, image_data: %s, mime_type: %s", type(file_path_or_data), bool(image_data or media), mime_type)
     
     # If image_data is provided (as base64 string from frontend), use it directly
-    if image_data:
-        print(f"DEBUG: Using provided image_data for analysis")
+    if image_data or media:
+        logger.debug("Using provided image_data for analysis")
         # Ollama Platform
         if AI_PLATFORM == "ollama":
-            print(f"DEBUG: Deepfake analysis using Ollama with image data: {bool(image_data)}")
-            prompt_text = (
-                "Analyze this media for deepfakes, AI artifacts, or facial manipulation. "
-                "Respond ONLY as: Verdict: [Likely Real/Likely Deepfake/Uncertain], Confidence: [0-100], Reasoning: [Short assessment]. "
-                f"Context: Analyzing uploaded media file."
-            )
-            
-            # image_data from frontend is already base64 encoded
-            ai_analysis = call_ollama(prompt_text, model=OLLAMA_MODEL_VISION, images=[image_data])
-            
-            if "Error" in ai_analysis:
-                print(f"DEBUG: Ollama deepfake analysis failed: {ai_analysis}")
-                # Fallback to heuristics if ollama fails or model missing
-                return heuristic_fallback(file_path_or_data, False, None, ai_analysis, "deepfake")
-
-            print(f"DEBUG: Ollama deepfake analysis result: {ai_analysis[:200]}...")
-            # Parse the response (reusing logic)
-            verdict = "Uncertain"
-            verdict_match = re.search(r"Verdict:\s*\[?(Likely Real|Likely Deepfake|Uncertain|Likely Authentic)", ai_analysis, re.IGNORECASE)
-            if verdict_match:
-                v_raw = verdict_match.group(1).title()
-                if "Deepfake" in v_raw: verdict = "Likely Deepfake"
-                elif "Real" in v_raw or "Authentic" in v_raw: verdict = "Likely Authentic"
-            
-            conf_val = 0.5
-            conf_match = re.search(r"Confidence:\s*\[?(\d+)", ai_analysis)
-            if conf_match:
-                conf_val = int(conf_match.group(1)) / 100.0
-            
-            reasoning = "Local analysis completed via Ollama."
-            reason_match = re.search(r"Reasoning:\s*(.*)", ai_analysis, re.DOTALL | re.IGNORECASE)
-            if reason_match:
-                reasoning = reason_match.group(1).strip()
-
-            return {
-                "status": verdict,
-                "confidence": conf_val,
-                "reason": reasoning,
-                "privacy_risk": "Low",
-                "privacy_explanation": "Processed locally via Ollama.",
-                "analysis_details": {
-                    "indicators_found": 0,
-                    "fake_probability": conf_val if "Deepfake" in verdict else 1 - conf_val,
-                    "technical_assessment": f"Ollama ({OLLAMA_MODEL_VISION}) assessment: {reasoning}"
-                }
-            }
+            return analyze_deepfake_ollama(file_path_or_data, image_data, media)
         
         # Gemini Platform
-        if GEMINI_API_KEY and model:
+        model = get_gemini_model()
+        # Inline media is limited in size; larger uploads go to the heuristics
+        fits_inline = media is None or media.size <= GEMINI_INLINE_MAX_BYTES
+        if GEMINI_API_KEY and model and fits_inline and not deadline.expired():
             try:
                 # Create a prompt for the AI
                 prompt_text = (
@@ -484,15 +774,29 @@ def analyze_deepfake(file_path_or_data, image_data=None, mime_type=None):
                 )
                 
                 # Use the SDK to call the model with image data if available
-                if image_data:
+                if isinstance(model, gemini_quota.PooledModel):
+                    # Sent as base64 as it is (or encoded while streaming), without a decoded copy
+                    media_type = (media.mime_type if media else mime_type) or "image/jpeg"
+                    contents = [prompt_text, {"inline_data": {"mime_type": media_type, "data": media or image_data}}]
+                    with metrics.stage("gemini_call"):
+                        response = model.generate_content(
+                            contents,
+                            generation_config={
+                                "temperature": 0.1,
+                                "max_output_tokens": 200
+                            },
+                            request_options={"timeout": deadline.hop_timeout(GEMINI_HOSTNAME, GEMINI_TIMEOUT) or deadline.MIN_HOP_SECONDS}
+                        )
+                elif image_data or media:
                     # For image analysis, we need to handle the image data differently
                     import base64
                     
                     # Decode the base64 image data to bytes
                     try:
-                        image_bytes = base64.b64decode(image_data)
+                        image_bytes = media.read() if media else base64.b64decode(image_data)
+                        mime_type = media.mime_type if media else mime_type
                     except Exception as e:
-                        print(f"DEBUG: Error decoding image data: {e}")
+                        logger.warning("Error decoding image data: %s", e)
                         raise e
                     
                     # Create a Part object with the image data
@@ -509,27 +813,28 @@ def analyze_deepfake(file_path_or_data, image_data=None, mime_type=None):
                         text_part = Part.from_text(prompt_text)
                         contents = [text_part, image_part]
                     
-                    response = model.generate_content(
-                        contents,
-                        generation_config={
-                            "temperature": 0.1,
-                            "max_output_tokens": 200
-                        }
-                    )
+                    with metrics.stage("gemini_call"):
+                        response = model.generate_content(
+                            contents,
+                            generation_config={
+                                "temperature": 0.1,
+                                "max_output_tokens": 200
+                            },
+                            request_options={"timeout": deadline.hop_timeout(GEMINI_HOSTNAME, GEMINI_TIMEOUT) or deadline.MIN_HOP_SECONDS}
+                        )
                 else:
                     # Text-only analysis
-                    response = model.generate_content(
-                        prompt_text,
-                        generation_config={
-                            "temperature": 0.1,
-                            "max_output_tokens": 200
-                        }
-                    )
+                    with metrics.stage("gemini_call"):
+                        response = model.generate_content(
+                            prompt_text,
+                            generation_config={
+                                "temperature": 0.1,
+                                "max_output_tokens": 200
+                            },
+                            request_options={"timeout": deadline.hop_timeout(GEMINI_HOSTNAME, GEMINI_TIMEOUT) or deadline.MIN_HOP_SECONDS}
+                        )
                 
-                with open("ai_debug_output.txt", "a", encoding="utf-8") as f:
-                    f.write(f"\n--- {time.ctime()} --- DEEPFAKE SDK ---\n")
-                    if image_data:
-                        f.write(f"Image data provided (base64 length: {len(image_data)})\n")
+                logger.debug("Deepfake Gemini SDK call", extra={"image_b64_length": len(image_data) if image_data else 0})
 
                 if hasattr(response, 'text') and response.text:
                     ai_analysis = response.text
@@ -566,12 +871,18 @@ def analyze_deepfake(file_path_or_data, image_data=None, mime_type=None):
                         "technical_assessment": f"AI assessment: {reasoning}"
                     }
                 }
+            except gemini_quota.QuotaExhausted as e:
+                logger.debug("Gemini quota exhausted (%s); overflowing to %s", e, gemini_quota.GEMINI_OVERFLOW)
+                metrics.record_fallback(f"quota_{gemini_quota.GEMINI_OVERFLOW}")
+                if gemini_quota.GEMINI_OVERFLOW == "ollama":
+                    return analyze_deepfake_ollama(file_path_or_data, image_data, media)
             except Exception as e:
-                print(f"DEBUG: Error using AI for deepfake analysis: {e}")
+                metrics.record_provider_error("gemini", e)
+                logger.warning("Error using AI for deepfake analysis: %s", e)
                 pass
         
         # If no AI platform is available, use heuristics
-        print(f"DEBUG: No AI platform available, using heuristics for deepfake detection")
+        logger.debug("No AI platform available, using heuristics for deepfake detection")
         # ... (rest of the heuristic logic remains same)
         # This could be a filename or some identifier
         file_lower = str(file_path_or_data).lower()
@@ -641,7 +952,7 @@ def analyze_deepfake(file_path_or_data, image_data=None, mime_type=None):
         }
     else:
         # If no image data provided, use filename-based heuristic analysis
-        print(f"DEBUG: No image data provided, using filename-based heuristic analysis")
+        logger.debug("No image data provided, using filename-based heuristic analysis")
         file_lower = str(file_path_or_data).lower()
         
         # Simulated deep fake detection heuristics
@@ -704,251 +1015,6 @@ def analyze_deepfake(file_path_or_data, image_data=None, mime_type=None):
                 "technical_assessment": "Filename-based heuristic analysis. Visual inspection is recommended."
             }
         }
-    # Ollama Platform
-    if AI_PLATFORM == "ollama":
-        print(f"DEBUG: Deepfake analysis using Ollama with image data: {bool(image_data)}")
-        prompt_text = (
-            "Analyze this media for deepfakes, AI artifacts, or facial manipulation. "
-            "Respond ONLY as: Verdict: [Likely Real/Likely Deepfake/Uncertain], Confidence: [0-100], Reasoning: [Short assessment]. "
-            f"Context: {file_path_or_data}."
-        )
-        
-        images = [image_data] if image_data else None
-        ai_analysis = call_ollama(prompt_text, model=OLLAMA_MODEL_VISION, images=images)
-        
-        if "Error" in ai_analysis:
-            print(f"DEBUG: Ollama deepfake analysis failed: {ai_analysis}")
-            # Fallback to heuristics if ollama fails or model missing
-            return heuristic_fallback(file_path_or_data, False, None, ai_analysis, "deepfake")
-
-        print(f"DEBUG: Ollama deepfake analysis result: {ai_analysis[:200]}...")
-        # Parse the response (reusing logic)
-        verdict = "Uncertain"
-        verdict_match = re.search(r"Verdict:\s*\[?(Likely Real|Likely Deepfake|Uncertain|Likely Authentic)", ai_analysis, re.IGNORECASE)
-        if verdict_match:
-            v_raw = verdict_match.group(1).title()
-            if "Deepfake" in v_raw: verdict = "Likely Deepfake"
-            elif "Real" in v_raw or "Authentic" in v_raw: verdict = "Likely Authentic"
-        
-        conf_val = 0.5
-        conf_match = re.search(r"Confidence:\s*\[?(\d+)", ai_analysis)
-        if conf_match:
-            conf_val = int(conf_match.group(1)) / 100.0
-        
-        reasoning = "Local analysis completed via Ollama."
-        reason_match = re.search(r"Reasoning:\s*(.*)", ai_analysis, re.DOTALL | re.IGNORECASE)
-        if reason_match:
-            reasoning = reason_match.group(1).strip()
-
-        return {
-            "status": verdict,
-            "confidence": conf_val,
-            "reason": reasoning,
-            "privacy_risk": "Low",
-            "privacy_explanation": "Processed locally via Ollama.",
-            "analysis_details": {
-                "indicators_found": 0,
-                "fake_probability": conf_val if "Deepfake" in verdict else 1 - conf_val,
-                "technical_assessment": f"Ollama ({OLLAMA_MODEL_VISION}) assessment: {reasoning}"
-            }
-        }
-
-    # Gemini Platform
-    if GEMINI_API_KEY:
-        try:
-            import subprocess
-            import json
-            import tempfile
-            
-            # Create a prompt for the AI
-            prompt_text = (
-                "You are an expert deepfake detector. Analyze this media for synthetic generation, manipulation, or AI artifacts. "
-                "For videos, focus on temporal flickering, unnatural movements, and lighting inconsistencies. "
-                f"Context: {file_path_or_data}. "
-                "Respond ONLY in this format: Verdict: [Likely Real/Likely Deepfake/Uncertain], Confidence: [0-100], Reasoning: [Short explanation]."
-            )
-            
-            # Prepare parts
-            parts = [{"text": prompt_text}]
-            if image_data:
-                parts.append({
-                    "inline_data": {
-                        "mime_type": mime_type or "image/jpeg",
-                        "data": image_data
-                    }
-                })
-            
-            # Prepare payload
-            payload = {
-                "contents": [{"parts": parts}],
-                "generationConfig": {"temperature": 0.1, "maxOutputTokens": 200}
-            }
-            
-            # Write payload to a temporary file
-            with tempfile.NamedTemporaryFile(mode='w', suffix='.json', delete=False) as temp:
-                json.dump(payload, temp)
-                temp_path = temp.name
-
-            # Direct REST API call via curl.exe
-            # Explicitly using gemini-1.5-flash for stable vision analysis
-            api_url = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-1.5-flash:generateContent?key={GEMINI_API_KEY}"
-            curl_cmd = f'curl.exe -s -X POST "{api_url}" -H "Content-Type: application/json" -d @"{temp_path}"'
-            
-            with open("ai_debug_output.txt", "a", encoding="utf-8") as f:
-                f.write(f"\n--- {time.ctime()} --- DEEPFAKE CURL ---\n")
-                if image_data:
-                    f.write(f"Image data provided (base64 length: {len(image_data)})\n")
-
-            result = subprocess.run(curl_cmd, shell=True, capture_output=True, text=True, timeout=30)
-            
-            # Clean up temp file
-            try: os.unlink(temp_path)
-            except: pass
-
-            if result.returncode == 0:
-                res_json = json.loads(result.stdout)
-                if 'error' in res_json:
-                    err = res_json['error']
-                    if err.get('status') == 'RESOURCE_EXHAUSTED' or err.get('code') == 429:
-                        return {
-                            "status": "Quota Exceeded",
-                            "confidence": 0,
-                            "reason": "Deepfake analysis limit reached. AI could not process the media.",
-                            "privacy_risk": "Low",
-                            "privacy_explanation": "Media analysis failed due to quota limitations.",
-                            "analysis_details": {
-                                "indicators_found": 0,
-                                "fake_probability": 0.5,
-                                "technical_assessment": "Gemini API Quota Exceeded. Please try again later."
-                            }
-                        }
-
-                if 'candidates' in res_json:
-                    ai_analysis = res_json['candidates'][0]['content']['parts'][0]['text']
-                    
-                    # Simple regex parsing
-                    verdict = "Uncertain"
-                    verdict_match = re.search(r"Verdict:\s*(Likely Real|Likely Deepfake|Uncertain|Likely Authentic)", ai_analysis, re.IGNORECASE)
-                    if verdict_match:
-                        v_raw = verdict_match.group(1).title()
-                        if "Deepfake" in v_raw: verdict = "Likely Deepfake"
-                        elif "Real" in v_raw or "Authentic" in v_raw: verdict = "Likely Authentic"
-                    
-                    conf_val = 0.5
-                    conf_match = re.search(r"Confidence:\s*(\d+)", ai_analysis)
-                    if conf_match:
-                        conf_val = int(conf_match.group(1)) / 100.0
-                    
-                    reasoning = "AI analysis completed."
-                    reason_match = re.search(r"Reasoning:\s*(.*)", ai_analysis, re.DOTALL | re.IGNORECASE)
-                    if reason_match:
-                        reasoning = reason_match.group(1).strip()
-
-                    return {
-                        "status": verdict,
-                        "confidence": conf_val,
-                        "reason": reasoning,
-                        "privacy_risk": "Low",
-                        "privacy_explanation": "Media content analysis completed.",
-                        "analysis_details": {
-                            "indicators_found": 0,
-                            "fake_probability": conf_val if "Deepfake" in verdict else 1 - conf_val,
-                            "technical_assessment": f"AI assessment: {reasoning}"
-                        }
-                    }
-                else:
-                    with open("ai_debug_output.txt", "a", encoding="utf-8") as f:
-                        f.write(f"ERROR: No candidates in deepfake response: {result.stdout[:500]}\n")
-            else:
-                with open("ai_debug_output.txt", "a", encoding="utf-8") as f:
-                    f.write(f"ERROR: Curl failed with code {result.returncode}: {result.stderr}\n")
-        except Exception as e:
-            print(f"DEBUG: Error using AI for deepfake analysis: {e}")
-            pass
-    
-    # Fallback to heuristic analysis if AI fails or no API key
-    if isinstance(file_path_or_data, str):
-        # ... (rest of the heuristic logic remains same)
-        # This could be a filename or some identifier
-        file_lower = file_path_or_data.lower()
-        
-        # Simulated deep fake detection heuristics
-        # In a real implementation, this would use ML models to analyze video/image frames
-        deepfake_indicators = [
-            'fake', 'deepfake', 'manipulated', 'altered', 'synthetic', 'generated',
-            'ai-generated', 'computer-generated', 'not real', 'simulation'
-        ]
-        
-        # Count indicators in filename/description
-        indicator_count = sum(1 for indicator in deepfake_indicators if indicator in file_lower)
-        
-        # Calculate probability based on indicators
-        if indicator_count > 0:
-            fake_probability = min(0.6 + (indicator_count * 0.15), 0.98)  # Higher base probability if indicators found
-        else:
-            # Analyze filename patterns that might suggest deepfakes
-            suspicious_patterns = ['fake', 'deep', 'ai_', '_ai', 'synthetic', 'generated', 'gen_', 'face', 'swap']
-            found_suspicious = sum(1 for pattern in suspicious_patterns if pattern in file_lower)
-            
-            if found_suspicious > 0:
-                fake_probability = min(0.5 + (found_suspicious * 0.12), 0.9)  # Moderate probability for suspicious patterns
-            else:
-                # Default lower probability if no suspicious indicators
-                fake_probability = 0.2  # Lower default assumption
-                
-                # Analyze file extension - certain extensions more likely to contain deepfakes
-                if any(ext in file_lower for ext in ['.mp4', '.mov', '.avi', '.mkv']):  # Video formats
-                    fake_probability += 0.15
-                elif any(ext in file_lower for ext in ['.jpg', '.jpeg', '.png', '.bmp']):  # Image formats
-                    fake_probability += 0.1
-                
-                # Add some variance but keep it reasonable
-                import random
-                fake_probability += random.uniform(-0.1, 0.15)
-                fake_probability = max(0.05, min(0.95, fake_probability))  # Clamp between 5% and 95%
-        
-        # Determine status based on probability
-        if fake_probability > 0.7:
-            status = "Likely Deepfake"
-            confidence = round(fake_probability, 3)
-            reason = f"High probability of manipulation detected ({indicator_count} indicators found)."
-        elif fake_probability > 0.4:
-            status = "Uncertain"
-            confidence = round(fake_probability, 3)
-            reason = f"Moderate probability of manipulation ({indicator_count} indicators found)."
-        else:
-            # If it's a video/image with NO indicators in filename and we are in FALLBACK mode, 
-            # we should be MORE uncertain rather than calling it authentic.
-            status = "Uncertain (Local Heuristics)"
-            confidence = 0.5
-            reason = f"AI analysis unavailable. No explicit deepfake indicators found in media metadata, but visual verification is required."
-        
-        return {
-            "status": status,
-            "confidence": confidence,
-            "reason": reason,
-            "privacy_risk": "Low",
-            "privacy_explanation": "Media content analysis completed. No privacy risks detected.",
-            "analysis_details": {
-                "indicators_found": indicator_count,
-                "fake_probability": fake_probability,
-                "technical_assessment": "Local heuristic fallback triggered. This is less accurate than AI visual analysis."
-            }
-        }
-    else:
-        # Handle binary data case
-        return {
-            "status": "Uncertain",
-            "confidence": 0.5,
-            "reason": "Unable to analyze media data format.",
-            "privacy_risk": "Low",
-            "privacy_explanation": "Media content analysis completed. No privacy risks detected in the analysis process.",
-            "analysis_details": {
-                "indicators_found": 0,
-                "fake_probability": 0.5,
-                "technical_assessment": "Format not recognized for deepfake analysis."
-            }
-        }
 
 def analyze_url(domain):
     # Heuristics for suspicious domains
@@ -1003,7 +1069,7 @@ def analyze_content(text, analysis_type="news"):
     text_lower = text.lower().strip()
     
     if analysis_type == "privacy":
-        print(f"DEBUG: Privacy analysis started for: {text[:50]}...")
+        logger.debug("Privacy analysis started for: %s...", text[:50])
         # Privacy risk detection only
         privacy_indicators = ['@', '.com', 'phone', 'address', 'location', 'email', 'name', 'street', 'city', 'zip', 'ssn', 'credit card', 'password', 'social security', 'account number', 'driver license', 'birth date', 'passport', 'national id', 'tax id']
         privacy_risks = [indicator for indicator in privacy_indicators if indicator in text_lower]
@@ -1026,10 +1092,10 @@ def analyze_content(text, analysis_type="news"):
             "privacy_risk": privacy_risk,
             "privacy_explanation": privacy_explanation
         }
-        print(f"DEBUG: analyze_content (privacy) -> status={result['status']} confidence={result['confidence']}")
+        logger.debug("analyze_content (privacy) -> status=%s confidence=%s", result['status'], result['confidence'])
         return result
     elif analysis_type == "news":  # News analysis
-        print(f"DEBUG: News analysis started for: {text[:50]}...")
+        logger.debug("News analysis started for: %s...", text[:50])
         # Use the pre-trained fake news detection model
         try:
             # First try the pre-trained model
@@ -1057,10 +1123,10 @@ def analyze_content(text, analysis_type="news"):
                 "privacy_risk": privacy_risk,
                 "privacy_explanation": privacy_explanation
             }
-            print(f"DEBUG: analyze_content (news) -> status={result['status']} confidence={result['confidence']}")
+            logger.debug("analyze_content (news) -> status=%s confidence=%s", result['status'], result['confidence'])
             return result
         except Exception as e:
-            print(f"DEBUG: Error using pre-trained fake news detector: {e}")
+            logger.warning("Error using pre-trained fake news detector: %s", e)
             # Fall back to the heuristic analysis
             fake_indicators = [
                 # Sensationalism
@@ -1174,13 +1240,14 @@ def analyze_content(text, analysis_type="news"):
             "privacy_risk": privacy_risk,
             "privacy_explanation": privacy_explanation
         }
-        print(f"DEBUG: analyze_content -> status={result['status']} confidence={result['confidence']}")
+        logger.debug("analyze_content -> status=%s confidence=%s", result['status'], result['confidence'])
         return result
     elif analysis_type == "news_advanced":  # Advanced news analysis using Gemini
-        print(f"DEBUG: Advanced news analysis started for: {text[:50]}...")
+        logger.debug("Advanced news analysis started for: %s...", text[:50])
         
         # Use Gemini to provide more detailed analysis
-        if AI_PLATFORM == "gemini" and model:
+        model = get_gemini_model() if AI_PLATFORM == "gemini" else None
+        if model and not deadline.expired():
             prompt = (
                 "As an expert fact-checker, analyze this news content thoroughly. "
                 "Provide a detailed assessment of its authenticity, including: "
@@ -1195,13 +1262,15 @@ def analyze_content(text, analysis_type="news"):
             )
             
             try:
-                response = model.generate_content(
-                    prompt,
-                    generation_config={
-                        "temperature": 0.1,
-                        "max_output_tokens": 1000
-                    }
-                )
+                with metrics.stage("gemini_call"):
+                    response = model.generate_content(
+                        prompt,
+                        generation_config={
+                            "temperature": 0.1,
+                            "max_output_tokens": 1000
+                        },
+                        request_options={"timeout": deadline.hop_timeout(GEMINI_HOSTNAME, GEMINI_TIMEOUT) or deadline.MIN_HOP_SECONDS}
+                    )
                 
                 if hasattr(response, 'text') and response.text:
                     gemini_response = response.text
@@ -1247,17 +1316,23 @@ def analyze_content(text, analysis_type="news"):
                     "privacy_explanation": "Privacy risk assessment not applicable to this function."
                 }
                 
-                print(f"DEBUG: analyze_content (news_advanced) -> status={result['status']} confidence={result['confidence']}")
+                logger.debug("analyze_content (news_advanced) -> status=%s confidence=%s", result['status'], result['confidence'])
                 return result
+            except gemini_quota.QuotaExhausted as e:
+                metrics.record_fallback("quota_local")
+                logger.debug("Gemini quota exhausted (%s), using fast local analysis", e)
+                return analyze_content(text, analysis_type="news")
             except Exception as e:
-                print(f"DEBUG: Gemini call failed ({e}), falling back to fast local analysis")
+                metrics.record_provider_error("gemini", e)
+                metrics.record_fallback("local_model")
+                logger.warning("Gemini call failed (%s), falling back to fast local analysis", e)
                 # If Gemini fails, fall back to fast local analysis
                 return analyze_content(text, analysis_type="news")
         else:
             # If Gemini is not available, fall back to regular analysis
             return analyze_content(text, analysis_type="news")
     else:  # For any other analysis type
-        print(f"DEBUG: Unknown analysis type: {analysis_type}, defaulting to heuristic analysis")
+        logger.debug("Unknown analysis type: %s, defaulting to heuristic analysis", analysis_type)
         # Default to heuristic analysis for unknown types
         # ... (same heuristic code as before)
         fake_indicators = [
@@ -1372,7 +1447,7 @@ def analyze_content(text, analysis_type="news"):
             "privacy_risk": privacy_risk,
             "privacy_explanation": privacy_explanation
         }
-        print(f"DEBUG: analyze_content (unknown type) -> status={result['status']} confidence={result['confidence']}")
+        logger.debug("analyze_content (unknown type) -> status=%s confidence=%s", result['status'], result['confidence'])
         return result
 
 
@@ -1419,6 +1494,7 @@ def heuristic_fallback(text, is_url=False, url=None, error_msg="", analysis_type
     """
     Comprehensive heuristic analysis when AI is unavailable.
     """
+    metrics.record_fallback("heuristic")
     # Parse URL if the input is a link
     if is_url:
         domain = urlparse(url).netloc.lower()
@@ -1435,9 +1511,10 @@ def heuristic_fallback(text, is_url=False, url=None, error_msg="", analysis_type
             "reason": reason,
             "correction": content_analysis.get("correction", ""),
             "privacy_risk": content_analysis["privacy_risk"],
-            "privacy_explanation": content_analysis["privacy_explanation"]
+            "privacy_explanation": content_analysis["privacy_explanation"],
+            "source": "heuristic",
         }
-        print(f"DEBUG: heuristic_fallback (url) -> status={result['status']} confidence={result['confidence']} reason={error_msg}")
+        logger.debug("heuristic_fallback (url) -> status=%s confidence=%s reason=%s", result['status'], result['confidence'], error_msg)
         return result
     else:
         # Regular text analysis
@@ -1449,12 +1526,14 @@ def heuristic_fallback(text, is_url=False, url=None, error_msg="", analysis_type
             "reason": result.get("reason", "Analysis completed"),
             "correction": result.get("correction", ""),
             "privacy_risk": result.get("privacy_risk", "Low"),
-            "privacy_explanation": result.get("privacy_explanation", "No privacy risks detected")
+            "privacy_explanation": result.get("privacy_explanation", "No privacy risks detected"),
+            "source": "heuristic",
         }
-        print(f"DEBUG: heuristic_fallback -> status={out['status']} confidence={out['confidence']} reason={error_msg}")
+        logger.debug("heuristic_fallback -> status=%s confidence=%s reason=%s", out['status'], out['confidence'], error_msg)
         return out
 
 
+@metrics.timed("trending_refresh")
 def get_trending_news():
     """
     Fetches trending news, popular topics, and user preferences for visualization.
@@ -1464,7 +1543,7 @@ def get_trending_news():
     API_KEY = os.getenv("NEWS_API_KEY")
     
     if not API_KEY or API_KEY == "":
-        print("DEBUG: News API key not found in environment, returning mock data")
+        logger.debug("News API key not found in environment, returning mock data")
         # Return mock data if no API key is available
         mock_trending_news = [
             {
@@ -1533,7 +1612,7 @@ def get_trending_news():
         from functools import partial
         
         # Get top headlines (single request)
-        headlines_url = f"https://newsapi.org/v2/top-headlines?country=us&pageSize=10&apiKey={API_KEY}"
+        headlines_url = f"{NEWS_API_BASE_URL}/top-headlines?country=us&pageSize=10&apiKey={API_KEY}"
         headlines_response = requests.get(headlines_url, timeout=5)
         trending_news = []
         all_articles = []
@@ -1554,7 +1633,7 @@ def get_trending_news():
                     })
                     all_articles.append(article)
         else:
-            print(f"DEBUG: Top headlines API error: {headlines_response.status_code}")
+            logger.warning("Top headlines API error: %s", headlines_response.status_code)
 
         # Define categories to analyze
         categories = ["technology", "business", "science", "health", "entertainment", "general"]
@@ -1565,7 +1644,7 @@ def get_trending_news():
         def fetch_category_news(category):
             try:
                 # First try the exact category term
-                category_url = f"https://newsapi.org/v2/everything?q={category}&sortBy=popularity&pageSize=5&apiKey={API_KEY}"
+                category_url = f"{NEWS_API_BASE_URL}/everything?q={category}&sortBy=popularity&pageSize=5&apiKey={API_KEY}"
                 response = requests.get(category_url, timeout=5)
                 
                 if response.status_code == 200:
@@ -1584,7 +1663,7 @@ def get_trending_news():
                         }
                         
                         broad_query = broad_queries.get(category, category)
-                        broad_url = f"https://newsapi.org/v2/everything?q={broad_query}&sortBy=popularity&pageSize=5&apiKey={API_KEY}"
+                        broad_url = f"{NEWS_API_BASE_URL}/everything?q={broad_query}&sortBy=popularity&pageSize=5&apiKey={API_KEY}"
                         broad_response = requests.get(broad_url, timeout=5)
                         
                         if broad_response.status_code == 200:
@@ -1595,7 +1674,7 @@ def get_trending_news():
                 else:
                     return category, []
             except Exception as e:
-                print(f"DEBUG: Error fetching {category} news: {e}")
+                logger.warning("Error fetching %s news: %s", category, e)
                 return category, []
 
         # Execute all category requests in parallel
@@ -1709,7 +1788,7 @@ def get_trending_news():
             "timestamp": datetime.datetime.now().isoformat()
         }
     except Exception as e:
-        print(f"DEBUG: Error fetching trending news: {e}")
+        logger.warning("Error fetching trending news: %s", e)
         # Return mock data as fallback
         mock_trending_news = [
             {
@@ -1,11 +1,76 @@
-from flask import Flask, request, jsonify
-from analyzer import analyze_news, get_trending_news
+from flask import Flask, request, jsonify, g, Response
+from analyzer import analyze_deepfake, analyze_news, get_trending_news
 from flask_cors import CORS
+import math
 import os
+import deadline
+import http_cache
+import jobs
+import media_upload
+import metrics
+import online_learning
+import prescreen
+import profiler
+import rate_limit
+import shadow
+import time
+import uuid
 
 app = Flask(__name__)
+# Werkzeug stops reading any body past this, declared length or not (413)
+app.config["MAX_CONTENT_LENGTH"] = media_upload.MEDIA_MAX_BYTES + media_upload.FORM_OVERHEAD_BYTES
 CORS(app, resources={r"/*": {"origins": "*"}})  # Allow all origins for development
 
+@app.before_request
+def start_request_metrics():
+    jobs.start_workers()
+    online_learning.start()
+    g.request_started = time.perf_counter()
+    metrics.inc("truevail_http_requests_in_flight", 1)
+
+@app.after_request
+def record_request_metrics(response):
+    endpoint = request.url_rule.rule if request.url_rule else "unmatched"
+    started = g.pop("request_started", None)
+    if started is not None:
+        metrics.inc("truevail_http_requests_in_flight", -1)
+        metrics.observe("truevail_http_request_duration_seconds", time.perf_counter() - started, endpoint=endpoint)
+    metrics.inc("truevail_http_requests_total", endpoint=endpoint, status=str(response.status_code))
+    return response
+
+@app.after_request
+def compress_response(response):
+    """Compresses large JSON bodies for clients that accept it."""
+    if response.direct_passthrough or not http_cache.compressible(
+        response.mimetype, response.headers.get("Content-Encoding"), response.content_length
+    ):
+        return response
+    response.vary.add("Accept-Encoding")
+    body, encoding = http_cache.negotiate(response.get_data(), request.headers.get("Accept-Encoding"))
+    if encoding:
+        response.set_data(body)
+        response.headers["Content-Encoding"] = encoding
+        if "ETag" in response.headers:
+            response.headers["ETag"] = http_cache.encoded_etag(response.headers["ETag"], encoding)
+    return response
+
+def analysis_response(body, key):
+    """A stored analysis body, pointing at its cacheable GET /analysis/<key> form."""
+    response = Response(body, mimetype="application/json")
+    response.headers["ETag"] = http_cache.etag(body)
+    response.headers["Content-Location"] = f"/analysis/{key}"
+    return response
+
+def conditional_response(body, max_age, endpoint):
+    """JSON body with ETag and Cache-Control, or 304 when the client's If-None-Match still matches."""
+    status, body, headers = http_cache.conditional(
+        body, request.headers.get("If-None-Match"), request.headers.get("Accept-Encoding"),
+        f"public, max-age={http_cache.max_age(max_age)}", endpoint,
+    )
+    response = Response(body, status=status, mimetype="application/json")
+    response.headers.update(headers)
+    return response
+
 # ✅ HOME ROUTE
 @app.route("/", methods=["GET"])
 def home():
@@ -14,6 +79,19 @@ def home():
         "message": "Use POST /analyze to analyze content"
     })
 
+def admission_error(analysis_type, text=None, image_data=None):
+    """429 response when the client's rate limit bucket cannot pay for this request, else None."""
+    client = rate_limit.client_id(
+        request.headers.get("X-API-Key"), request.remote_addr, request.headers.get("X-Forwarded-For")
+    )
+    allowed, retry_after = rate_limit.admit(client, rate_limit.request_kind(text, analysis_type, image_data))
+    if allowed:
+        return None
+    response = jsonify({"error": "Rate limit exceeded", "retry_after": math.ceil(retry_after)})
+    response.status_code = 429
+    response.headers["Retry-After"] = rate_limit.retry_after_header(retry_after)
+    return response
+
 @app.route("/analyze", methods=["POST"])
 def analyze():
     data = request.json
@@ -24,10 +102,40 @@ def analyze():
 
     if not text and not image_data:
         return jsonify({"analysis": "No text or image provided"})
+    request_id = request.headers.get("X-Request-ID") or uuid.uuid4().hex
+    cache_key = http_cache.content_hash(text, analysis_type) if http_cache.cacheable(text, analysis_type, image_data) else None
+    if cache_key:
+        # Repeats are answered from the store before they cost any rate limit tokens
+        cached = http_cache.lookup(cache_key)
+        metrics.record_cache("analysis", cached is not None)
+        if cached:
+            response = analysis_response(cached[0], cache_key)
+            response.headers["X-Request-ID"] = request_id
+            return response
+    throttled = admission_error(analysis_type, text, image_data)
+    if throttled:
+        return throttled
 
     try:
-        result = analyze_news(text, analysis_type=analysis_type, image_data=image_data, mime_type=mime_type)
-        return jsonify(result)
+        # Every outbound hop of this analysis draws from one shared budget
+        budget = deadline.parse_budget(request.headers.get("X-Request-Budget"))
+        profile_enabled = profiler.should_profile(request.headers.get("X-Profile"))
+        with profiler.profile_request(profile_enabled) as profile:
+            with deadline.request_deadline(budget) as dl:
+                started = time.perf_counter()
+                result = analyze_news(text, analysis_type=analysis_type, image_data=image_data, mime_type=mime_type)
+        if dl.skipped and isinstance(result, dict):
+            result["partial"] = True
+            result["skipped_stages"] = dl.skipped
+        if not image_data:
+            shadow.mirror(text, analysis_type, result, time.perf_counter() - started)
+        body = http_cache.store(cache_key, result) if cache_key else None
+        response = analysis_response(body, cache_key) if body else jsonify(result)
+        response.headers["X-Request-ID"] = request_id
+        if profile.get("id"):
+            # Only the generated id: the file lives in PROFILE_DIR on the server
+            response.headers["X-Profile-Id"] = profile["id"]
+        return response
     except Exception as e:
         return jsonify({
             "analysis": f"Server error: {str(e)}",
@@ -40,11 +148,122 @@ def analyze():
 
     return jsonify(result)
 
+@app.route("/analyze/media", methods=["POST"])
+def analyze_media():
+    """
+    Deepfake analysis of an image or video sent as the raw body (optional
+    ?filename= and ?text= context) or as the "file" field of a multipart form.
+    """
+    throttled = admission_error("deepfake")
+    if throttled:
+        return throttled
+    try:
+        if request.mimetype == "multipart/form-data":
+            # Boundaries and headers come on top of the file itself
+            media_upload.check_length(request.content_length, app.config["MAX_CONTENT_LENGTH"])
+            file = request.files.get("file")
+            if file is None:
+                return jsonify({"error": 'No "file" field in the form'}), 400
+            upload = media_upload.receive(file.stream, file.mimetype, file.filename)
+            context = request.form.get("text")
+        else:
+            media_upload.check_length(request.content_length)
+            upload = media_upload.receive(request.stream, request.mimetype, request.args.get("filename"))
+            context = request.args.get("text")
+    except media_upload.UploadError as e:
+        return jsonify({"error": str(e)}), e.status
+
+    with upload:
+        budget = deadline.parse_budget(request.headers.get("X-Request-Budget"))
+        with deadline.request_deadline(budget):
+            result = analyze_deepfake(context or upload.filename or "Uploaded media file", media=upload)
+    result["media_sha256"] = upload.sha256
+    result["media_bytes"] = upload.size
+    return jsonify(result)
+
+@app.route("/analyze/async", methods=["POST"])
+def analyze_async():
+    """Queues an analysis and answers 202 with the job id right away."""
+    data = request.get_json(silent=True) or {}
+    if not data.get("text") and not data.get("image_data"):
+        return jsonify({"error": "No text or image provided"}), 400
+    webhook_url = data.get("webhook_url")
+    if webhook_url and not jobs.valid_webhook(webhook_url):
+        return jsonify({"error": "webhook_url must be an http(s) URL on a public host"}), 400
+    try:
+        priority = int(data.get("priority", 0))
+    except (TypeError, ValueError):
+        return jsonify({"error": "priority must be an integer"}), 400
+    throttled = admission_error(data.get("type", "news"), data.get("text"), data.get("image_data"))
+    if throttled:
+        return throttled
+
+    payload = {key: data.get(key) for key in ("text", "type", "image_data", "mime_type") if data.get(key)}
+    job = jobs.submit(payload, priority=priority, webhook_url=webhook_url)
+    response = jsonify({"job_id": job["id"], "status": job["status"], "status_url": f"/jobs/{job['id']}"})
+    response.status_code = 202
+    response.headers["Location"] = f"/jobs/{job['id']}"
+    return response
+
+@app.route("/jobs/<job_id>", methods=["GET"])
+def job_status(job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job)
+
+@app.route("/feedback", methods=["POST"])
+def feedback():
+    """Records an analyst's correction; the online model learns it on its next publish."""
+    submitter = online_learning.analyst(request.headers.get("X-Analyst-Token"))
+    if submitter is None:
+        return jsonify({"error": "An analyst token (X-Analyst-Token) is required"}), 401
+    data = request.get_json(silent=True)
+    data = data if isinstance(data, dict) else {}
+    text = data.get("text")
+    if not isinstance(text, str) or not text.strip():
+        return jsonify({"error": "text is required"}), 400
+    label = online_learning.parse_label(data)
+    if label is None:
+        return jsonify({"error": 'label must be "real" or "fake"'}), 400
+    feedback_id = online_learning.record(text, label, data.get("note"), submitter)
+    return jsonify({"id": feedback_id, "status": "accepted", "model_version": online_learning.current_version()}), 202
+
+@app.route("/model/rollback", methods=["POST"])
+def model_rollback():
+    """Puts the base detector back in every process and discards the feedback learned so far."""
+    if not online_learning.is_admin(request.headers.get("X-Admin-Token")):
+        return jsonify({"error": "An admin token (X-Admin-Token) is required"}), 401
+    after_id = online_learning.request_rollback()
+    return jsonify({"status": "rolling back", "discarded_through": after_id}), 202
+
+@app.route("/shadow/report", methods=["GET"])
+def shadow_report():
+    """Agreement, latency and cost of the shadow candidates against production."""
+    if not shadow.authorized(request.headers.get("X-Admin-Token")):
+        return jsonify({"error": "An admin token (X-Admin-Token) is required"}), 401
+    try:
+        hours = float(request.args.get("hours", shadow.SHADOW_REPORT_HOURS))
+    except ValueError:
+        return jsonify({"error": "hours must be a number"}), 400
+    return jsonify(shadow.report(hours))
+
+@app.route("/analysis/<key>", methods=["GET"])
+def cached_analysis(key):
+    """A stored /analyze result by content hash, cacheable by browsers and proxies."""
+    cached = http_cache.lookup(key) if http_cache.valid_hash(key) else None
+    if cached is None:
+        return jsonify({"error": "Analysis not found"}), 404
+    body, ttl = cached
+    return conditional_response(body, ttl, "/analysis/<key>")
+
 @app.route('/trending-news', methods=['GET'])
 def trending_news():
     try:
-        result = get_trending_news()
-        return jsonify(result)
+        body, ttl = http_cache.memoized(
+            "trending", http_cache.TRENDING_MAX_AGE_SECONDS, lambda: prescreen.screen_trending(get_trending_news())
+        )
+        return conditional_response(body, ttl, "/trending-news")
     except Exception as e:
         return jsonify({
             "status": "error",
@@ -70,6 +289,11 @@ def readiness_check():
         "service": "TrueVail Backend"
     })
 
+@app.route('/metrics')
+def metrics_endpoint():
+    """Prometheus scrape endpoint (aggregated across workers when METRICS_DIR is set)"""
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
 # Error handlers for production
 @app.errorhandler(500)
 def internal_error(error):
@@ -78,6 +302,13 @@ def internal_error(error):
         "message": "An unexpected error occurred"
     }), 500
 
+@app.errorhandler(413)
+def too_large(error):
+    return jsonify({
+        "error": "Request too large",
+        "message": f"Bodies are limited to {app.config['MAX_CONTENT_LENGTH']} bytes"
+    }), 413
+
 @app.errorhandler(404)
 def not_found(error):
     return jsonify({
@@ -0,0 +1,747 @@
+"""
+Async (ASGI) serving entry point for TrueVail.
+
+Exposes the same routes as app.py, but outbound I/O (Ollama, Gemini, page
+fetches, DuckDuckGo search) is awaited on one shared httpx connection pool
+instead of holding a worker thread, so a single process can keep hundreds of
+analyses waiting on upstreams at once. CPU-bound work (HTML extraction, the
+local detector, heuristics, deepfake and trending analysis) runs on a bounded
+thread pool; the request deadline is carried into those threads.
+
+Run with either of:
+    uvicorn asgi_app:app --app-dir backend --port 5001
+    gunicorn asgi_app:app --chdir backend -k uvicorn.workers.UvicornWorker --workers 2
+
+Per-request profiling (X-Profile) is only available under app.py: the
+sampling profiler follows one thread, and here a request has none of its own.
+"""
+import os
+import math
+import time
+import uuid
+import asyncio
+import functools
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from urllib.parse import urlparse, quote_plus
+
+import httpx
+from starlette.applications import Starlette
+from starlette.datastructures import MutableHeaders
+from starlette.formparsers import MultiPartException, MultiPartParser
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import JSONResponse, Response
+from starlette.routing import Match, Route
+
+import analyzer
+import deadline
+import http_cache
+import debug_log
+import evidence_index
+import gemini_quota
+import jobs
+import llm_batcher
+import media_upload
+import metrics
+import online_learning
+import page_cache
+import politeness
+import prescreen
+import rate_limit
+import search_cache
+import shadow
+
+logger = debug_log.get_logger("asgi")
+
+# Threads for CPU-bound and not-yet-async work
+ASGI_BLOCKING_THREADS = int(os.getenv("ASGI_BLOCKING_THREADS", str(min(32, (os.cpu_count() or 1) + 4))))
+# Outbound connection pool shared by all in-flight requests
+ASGI_MAX_CONNECTIONS = int(os.getenv("ASGI_MAX_CONNECTIONS", "200"))
+ASGI_MAX_KEEPALIVE = int(os.getenv("ASGI_MAX_KEEPALIVE", "50"))
+
+BROWSER_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+}
+
+_executor = None
+_client = None
+
+
+async def run_blocking(func, *args, **kwargs):
+    """Runs a blocking call on the worker pool, keeping the request's context (deadline)."""
+    ctx = contextvars.copy_context()
+    call = functools.partial(ctx.run, func, *args, **kwargs)
+    return await asyncio.get_running_loop().run_in_executor(_executor, call)
+
+
+async def call_ollama(prompt, model="llama3.1", images=None, timeout=60):
+    """Async counterpart of analyzer.call_ollama; returns the reply or an 'Error...' string."""
+    timeout = deadline.hop_timeout(analyzer.OLLAMA_HOSTNAME, timeout)
+    if not timeout:
+        deadline.mark_skipped("ollama")
+        return "Error: Request budget exhausted before Ollama call. Using faster local analysis."
+    payload = {
+        "model": model,
+        "prompt": prompt,
+        "stream": False,
+        "options": {"temperature": 0.1}
+    }
+    if images:
+        payload["images"] = images
+    logger.debug("Ollama request", extra={"model": model, "prompt": prompt, "images": len(images) if images else 0})
+    started = time.monotonic()
+    try:
+        with metrics.stage("ollama_call"):
+            response = await _client.post(f"{analyzer.OLLAMA_HOST}/api/generate", json=payload, timeout=timeout)
+        deadline.record_latency(analyzer.OLLAMA_HOSTNAME, time.monotonic() - started)
+        if response.status_code != 200:
+            metrics.record_provider_error("ollama", f"HTTP {response.status_code}")
+            logger.warning("Ollama returned error: %s", response.status_code)
+            return f"Error: Ollama returned {response.status_code}"
+        res_text = response.json().get("response", "")
+        logger.debug("Ollama response", extra={"model": model, "response": res_text})
+        return res_text
+    except httpx.ConnectError as e:
+        metrics.record_provider_error("ollama", e)
+        logger.warning("Connection error to Ollama: %s", e)
+        return "Error: Cannot connect to Ollama. Is the Ollama service running?"
+    except httpx.TimeoutException as e:
+        metrics.record_provider_error("ollama", e)
+        deadline.record_latency(analyzer.OLLAMA_HOSTNAME, time.monotonic() - started)
+        logger.warning("Ollama request timed out: %s", e)
+        return "Error: Ollama request timed out. Using faster local analysis."
+    except Exception as e:
+        metrics.record_provider_error("ollama", e)
+        logger.warning("General error in call_ollama: %s", e)
+        return f"Error connecting to Ollama: {str(e)}"
+
+
+async def _get_with_retries(url, host, provider, stage, attempts, default_timeout, on_throttle=None,
+                            throttle_statuses=politeness.THROTTLE_STATUSES, robots=True):
+    """
+    GETs url with budget-bounded attempts, within the host's politeness limits;
+    returns the response text or None. A throttling status (or a host that is
+    backing off) ends the attempts and is reported to on_throttle.
+    """
+    attempts = deadline.hop_attempts(host, attempts, default_timeout)
+    if not attempts:
+        deadline.mark_skipped(stage)
+    for attempt in range(attempts):
+        timeout = deadline.hop_timeout(host, default_timeout)
+        if not timeout:
+            deadline.mark_skipped(stage)
+            break
+        started = time.monotonic()
+        try:
+            with await politeness.acquire_async(url, robots=robots) as slot:
+                started = time.monotonic()
+                response = await _client.get(url, headers=BROWSER_HEADERS, timeout=timeout, follow_redirects=True)
+                throttled = slot.record(response.status_code, response.headers.get("Retry-After"), throttle_statuses)
+            deadline.record_latency(host, time.monotonic() - started)
+            if throttled:
+                logger.warning("%s throttled with HTTP %s for %s", provider, response.status_code, url)
+                if on_throttle:
+                    on_throttle(response.headers.get("Retry-After"))
+                return None
+            response.raise_for_status()
+            return response.text
+        except politeness.Refused as e:
+            logger.warning("%s skipped %s: %s", provider, url, e)
+            if on_throttle and e.retry_after:
+                on_throttle(e.retry_after)
+            return None
+        except Exception as e:
+            metrics.record_provider_error(provider, e)
+            if isinstance(e, httpx.TimeoutException):
+                deadline.record_latency(host, time.monotonic() - started)
+            logger.warning("%s attempt %s failed for %s: %s", provider, attempt + 1, url, e)
+    return None
+
+
+async def fetch_url_content(url):
+    """Async counterpart of analyzer.fetch_url_content."""
+    cached = page_cache.get(url)
+    metrics.record_cache("page", cached is not None)
+    if cached is not None:
+        return cached
+    html = await _get_with_retries(url, urlparse(url).netloc, "fetch", "fetch", 2, 7)
+    if html is None:
+        return None
+    content = await run_blocking(analyzer.extract_main_text, html)
+    page_cache.put(url, content)
+    evidence_index.add_async(url, content)
+    return content
+
+
+async def web_search(query, max_results=3):
+    """Async counterpart of analyzer.web_search_duckduckgo."""
+    return await search_cache.cached_search_async(query, max_results, fetch_search_results)
+
+
+async def fetch_search_results(query, max_results=3):
+    """Async counterpart of analyzer.fetch_search_results."""
+    search_url = f"{analyzer.DUCKDUCKGO_HTML_URL}?q={quote_plus(query)}"
+    # A search API rather than a crawl: host limits apply, robots.txt does not
+    html = await _get_with_retries(search_url, analyzer.SEARCH_HOSTNAME, "duckduckgo", "search", 2, 6,
+                                   on_throttle=search_cache.throttled,
+                                   throttle_statuses=search_cache.THROTTLE_STATUSES, robots=False)
+    if html is None:
+        return None
+    return analyzer.parse_search_results(html, max_results)
+
+
+async def call_gemini(content, analysis_type):
+    """
+    Returns the parsed Gemini result, or None when Gemini is unavailable,
+    skipped or failed; raises gemini_quota.QuotaExhausted when no key has room.
+    """
+    model = analyzer.get_gemini_model()
+    if not (analyzer.GEMINI_API_KEY and model):
+        return None
+    gemini_timeout = deadline.hop_timeout(analyzer.GEMINI_HOSTNAME, analyzer.GEMINI_TIMEOUT)
+    if not gemini_timeout:
+        deadline.mark_skipped("gemini")
+        return None
+    future = llm_batcher.submit(content, analysis_type)
+    if future is not None:
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future), llm_batcher.wait_timeout(gemini_timeout))
+        except llm_batcher.BatchError as e:
+            logger.debug("Batched Gemini analysis unavailable (%s); sending it on its own", e)
+        except asyncio.TimeoutError:
+            # Our wait ran out, not Gemini; the batch call is bounded by the same deadline
+            logger.warning("Batched Gemini analysis timed out")
+            deadline.mark_skipped("gemini")
+            return None
+        except gemini_quota.QuotaExhausted:
+            raise
+        except Exception as e:
+            metrics.record_provider_error("gemini", e)
+            logger.warning("Gemini analysis failed: %s", e)
+            return None
+        gemini_timeout = deadline.hop_timeout(analyzer.GEMINI_HOSTNAME, analyzer.GEMINI_TIMEOUT)
+        if not gemini_timeout:
+            deadline.mark_skipped("gemini")
+            return None
+    kwargs = {
+        "generation_config": {"temperature": 0.1, "max_output_tokens": 250},
+        "request_options": {"timeout": gemini_timeout},
+    }
+    prompt_text = analyzer.build_gemini_prompt(content, analysis_type)
+    started = time.monotonic()
+    try:
+        with metrics.stage("gemini_call"):
+            if hasattr(model, "generate_content_async"):
+                response = await model.generate_content_async(prompt_text, **kwargs)
+            else:
+                response = await run_blocking(model.generate_content, prompt_text, **kwargs)
+        deadline.record_latency(analyzer.GEMINI_HOSTNAME, time.monotonic() - started)
+        if not (hasattr(response, 'text') and response.text):
+            raise Exception(f"No text in response: {response}")
+        return analyzer.parse_ai_response(response.text, analysis_type=analysis_type)
+    except gemini_quota.QuotaExhausted:
+        raise
+    except Exception as e:
+        metrics.record_provider_error("gemini", e)
+        logger.warning("Gemini analysis failed: %s", e)
+        return None
+
+
+async def perform_ai_analysis(content, is_url=False, url=None, analysis_type="news"):
+    """Async counterpart of analyzer.perform_ai_analysis (same provider order and fallbacks)."""
+    overflow = None
+    try:
+        result = await call_gemini(content, analysis_type)
+    except gemini_quota.QuotaExhausted as e:
+        logger.debug("Gemini quota exhausted (%s); overflowing to %s", e, gemini_quota.GEMINI_OVERFLOW)
+        overflow = gemini_quota.GEMINI_OVERFLOW
+        result = await run_blocking(analyzer.quota_overflow_result, content, analysis_type, overflow)
+    if result is not None:
+        return result
+
+    if analyzer.AI_PLATFORM == "ollama" or overflow == "ollama":
+        if analysis_type == "news" and analyzer.LOCAL_MODEL_FIRST:
+            try:
+                return await run_blocking(analyzer.local_model_result, content)
+            except Exception as e:
+                logger.warning("Error using pre-trained fake news detector, falling back to Ollama: %s", e)
+
+        search_context = ""
+        if analysis_type != "privacy":
+            links = None
+            search_query = analyzer.search_query_for(content)
+            evidence = await run_blocking(evidence_index.find_evidence, search_query, url)
+            if evidence:
+                search_context = analyzer.format_search_context(evidence["content"], search_query)
+            elif deadline.can_afford((analyzer.SEARCH_HOSTNAME, 3), ("reference", 3), (analyzer.OLLAMA_HOSTNAME, 10)):
+                with metrics.stage("search"):
+                    links = await web_search(search_query, max_results=1)
+            else:
+                deadline.mark_skipped("search")
+            if links:
+                with metrics.stage("reference_fetch"):
+                    ref_content = await fetch_url_content(links[0])
+                if ref_content:
+                    search_context = analyzer.format_search_context(ref_content, search_query)
+
+        prompt = analyzer.build_ollama_prompt(content, analysis_type, search_context)
+        ai_text = await call_ollama(prompt, model=analyzer.OLLAMA_MODEL_TEXT)
+        if "Error" in ai_text:
+            return await run_blocking(analyzer.heuristic_fallback, content, is_url, url, ai_text, analysis_type)
+        return analyzer.parse_ai_response(ai_text, analysis_type=analysis_type)
+
+    return await run_blocking(analyzer.heuristic_fallback, content, is_url, url, "No AI platform available", analysis_type)
+
+
+async def analyze_with_reuse(content, is_url=False, url=None, analysis_type="news"):
+    """Async counterpart of analyzer.analyze_with_reuse."""
+    reused = await run_blocking(analyzer.reuse_near_duplicate, content, analysis_type)
+    if reused is not None:
+        return reused
+    result = await perform_ai_analysis(content, is_url=is_url, url=url, analysis_type=analysis_type)
+    await run_blocking(analyzer.remember_verdict, content, analysis_type, result)
+    return result
+
+
+async def analyze_news(text, analysis_type="news", image_data=None, mime_type=None):
+    """Async counterpart of analyzer.analyze_news."""
+    parsed_url = urlparse(text.strip()) if text else None
+    is_url = bool(parsed_url and parsed_url.scheme and parsed_url.netloc)
+
+    if analysis_type == "deepfake":
+        return await run_blocking(analyzer.analyze_deepfake, text, image_data=image_data, mime_type=mime_type)
+    elif analysis_type == "privacy":
+        return await run_blocking(analyzer.analyze_content, text, analysis_type="privacy")
+    elif is_url:
+        url = text.strip()
+        with metrics.stage("url_fetch"):
+            content = await fetch_url_content(url)
+        if not content:
+            content = f"News URL: {url}"
+            logger.warning("Scraping failed for %s. Passing URL to AI for search-enhanced analysis.", url)
+        if deadline.expired():
+            deadline.mark_skipped("ai")
+            result = analyzer.prescreen_result(url)
+            if result is not None:
+                return result
+            return await run_blocking(analyzer.heuristic_fallback, content, True, url, "Request budget exhausted", analysis_type)
+        return await analyze_with_reuse(content, is_url=True, url=url, analysis_type=analysis_type)
+    elif analysis_type == "news_advanced":
+        return await run_blocking(analyzer.analyze_content, text, analysis_type=analysis_type)
+    else:
+        return await analyze_with_reuse(text, analysis_type=analysis_type)
+
+
+async def home(request):
+    return JSONResponse({
+        "status": "TrueVail backend is running on port 5001",
+        "message": "Use POST /analyze to analyze content"
+    })
+
+
+async def admission_error(request, analysis_type, text=None, image_data=None):
+    """429 response when the client's rate limit bucket cannot pay for this request, else None."""
+    client = rate_limit.client_id(
+        request.headers.get("X-API-Key"),
+        request.client.host if request.client else None,
+        request.headers.get("X-Forwarded-For"),
+    )
+    kind = rate_limit.request_kind(text, analysis_type, image_data)
+    allowed, retry_after = await run_blocking(rate_limit.admit, client, kind)
+    if allowed:
+        return None
+    return JSONResponse(
+        {"error": "Rate limit exceeded", "retry_after": math.ceil(retry_after)},
+        status_code=429,
+        headers={"Retry-After": rate_limit.retry_after_header(retry_after)},
+    )
+
+
+def analysis_response(body, key, request_id):
+    """A stored analysis body, pointing at its cacheable GET /analysis/{key} form."""
+    return Response(body, media_type="application/json", headers={
+        "ETag": http_cache.etag(body),
+        "Content-Location": f"/analysis/{key}",
+        "X-Request-ID": request_id,
+    })
+
+
+def conditional_response(request, body, max_age, endpoint):
+    """JSON body with ETag and Cache-Control, or 304 when the client's If-None-Match still matches."""
+    status, body, headers = http_cache.conditional(
+        body, request.headers.get("if-none-match"), request.headers.get("accept-encoding"),
+        f"public, max-age={http_cache.max_age(max_age)}", endpoint,
+    )
+    return Response(body, status_code=status, media_type="application/json", headers=headers)
+
+
+async def analyze(request):
+    try:
+        data = await request.json()
+    except ValueError:
+        data = None
+    data = data or {}
+    text = data.get("text")
+    analysis_type = data.get("type", "news")
+    image_data = data.get("image_data")
+    mime_type = data.get("mime_type")
+
+    if not text and not image_data:
+        return JSONResponse({"analysis": "No text or image provided"})
+    request_id = request.headers.get("X-Request-ID") or uuid.uuid4().hex
+    cache_key = http_cache.content_hash(text, analysis_type) if http_cache.cacheable(text, analysis_type, image_data) else None
+    if cache_key:
+        # Repeats are answered from the store before they cost any rate limit tokens
+        cached = await run_blocking(http_cache.lookup, cache_key)
+        metrics.record_cache("analysis", cached is not None)
+        if cached:
+            return analysis_response(cached[0], cache_key, request_id)
+    throttled = await admission_error(request, analysis_type, text, image_data)
+    if throttled:
+        return throttled
+
+    try:
+        budget = deadline.parse_budget(request.headers.get("X-Request-Budget"))
+        with deadline.request_deadline(budget) as dl:
+            started = time.perf_counter()
+            result = await analyze_news(text, analysis_type=analysis_type, image_data=image_data, mime_type=mime_type)
+        if dl.skipped and isinstance(result, dict):
+            result["partial"] = True
+            result["skipped_stages"] = dl.skipped
+        if not image_data:
+            shadow.mirror(text, analysis_type, result, time.perf_counter() - started)
+        body = await run_blocking(http_cache.store, cache_key, result) if cache_key else None
+        if body:
+            return analysis_response(body, cache_key, request_id)
+        return JSONResponse(result, headers={"X-Request-ID": request_id})
+    except Exception as e:
+        return JSONResponse({
+            "analysis": f"Server error: {str(e)}",
+            "status": "Error",
+            "confidence": "0",
+            "reason": f"An error occurred during analysis: {str(e)}",
+            "privacy_risk": "Unknown",
+            "privacy_explanation": "Could not determine privacy risks due to error."
+        })
+
+
+async def analyze_media(request):
+    """
+    Deepfake analysis of an image or video sent as the raw body (optional
+    ?filename= and ?text= context) or as the "file" field of a multipart form.
+    """
+    throttled = await admission_error(request, "deepfake")
+    if throttled:
+        return throttled
+    content_type = request.headers.get("content-type", "")
+    content_length = request.headers.get("content-length")
+    content_length = int(content_length) if content_length and content_length.isdigit() else None
+    try:
+        if content_type.startswith("multipart/form-data"):
+            # Boundaries and headers come on top of the file itself
+            max_bytes = media_upload.MEDIA_MAX_BYTES + media_upload.FORM_OVERHEAD_BYTES
+            media_upload.check_length(content_length, max_bytes)
+            # Starlette spools form files itself (needs python-multipart); request.form()
+            # bounds no file part, so the body is cut off at max_bytes while it is parsed
+            parser = MultiPartParser(
+                request.headers, media_upload.limited(request.stream(), max_bytes), max_files=1, max_fields=10
+            )
+            try:
+                form = await parser.parse()
+            except MultiPartException as e:
+                return JSONResponse({"error": str(e)}, status_code=400)
+            try:
+                file = form.get("file")
+                if file is None or isinstance(file, str):
+                    return JSONResponse({"error": 'No "file" field in the form'}, status_code=400)
+                upload = await run_blocking(media_upload.receive, file.file, file.content_type, file.filename)
+                context = form.get("text")
+            finally:
+                await form.close()
+        else:
+            media_upload.check_length(content_length)
+            upload = await media_upload.receive_async(
+                request.stream(), content_type, request.query_params.get("filename")
+            )
+            context = request.query_params.get("text")
+    except media_upload.UploadError as e:
+        return JSONResponse({"error": str(e)}, status_code=e.status)
+
+    with upload:
+        budget = deadline.parse_budget(request.headers.get("X-Request-Budget"))
+        with deadline.request_deadline(budget):
+            result = await run_blocking(
+                analyzer.analyze_deepfake, context or upload.filename or "Uploaded media file", media=upload
+            )
+    result["media_sha256"] = upload.sha256
+    result["media_bytes"] = upload.size
+    return JSONResponse(result)
+
+
+async def analyze_async(request):
+    """Queues an analysis and answers 202 with the job id right away."""
+    try:
+        data = await request.json()
+    except ValueError:
+        data = None
+    data = data or {}
+    if not data.get("text") and not data.get("image_data"):
+        return JSONResponse({"error": "No text or image provided"}, status_code=400)
+    webhook_url = data.get("webhook_url")
+    # Resolving the webhook host is blocking DNS
+    if webhook_url and not await run_blocking(jobs.valid_webhook, webhook_url):
+        return JSONResponse({"error": "webhook_url must be an http(s) URL on a public host"}, status_code=400)
+    try:
+        priority = int(data.get("priority", 0))
+    except (TypeError, ValueError):
+        return JSONResponse({"error": "priority must be an integer"}, status_code=400)
+    throttled = await admission_error(request, data.get("type", "news"), data.get("text"), data.get("image_data"))
+    if throttled:
+        return throttled
+
+    payload = {key: data.get(key) for key in ("text", "type", "image_data", "mime_type") if data.get(key)}
+    job = await run_blocking(jobs.submit, payload, priority=priority, webhook_url=webhook_url)
+    return JSONResponse(
+        {"job_id": job["id"], "status": job["status"], "status_url": f"/jobs/{job['id']}"},
+        status_code=202,
+        headers={"Location": f"/jobs/{job['id']}"},
+    )
+
+
+async def job_status(request):
+    job = await run_blocking(jobs.get, request.path_params["job_id"])
+    if job is None:
+        return JSONResponse({"error": "Job not found"}, status_code=404)
+    return JSONResponse(job)
+
+
+async def feedback(request):
+    """Records an analyst's correction; the online model learns it on its next publish."""
+    submitter = online_learning.analyst(request.headers.get("X-Analyst-Token"))
+    if submitter is None:
+        return JSONResponse({"error": "An analyst token (X-Analyst-Token) is required"}, status_code=401)
+    try:
+        data = await request.json()
+    except ValueError:
+        data = None
+    data = data if isinstance(data, dict) else {}
+    text = data.get("text")
+    if not isinstance(text, str) or not text.strip():
+        return JSONResponse({"error": "text is required"}, status_code=400)
+    label = online_learning.parse_label(data)
+    if label is None:
+        return JSONResponse({"error": 'label must be "real" or "fake"'}, status_code=400)
+    feedback_id = await run_blocking(online_learning.record, text, label, data.get("note"))
+    return JSONResponse(
+        {"id": feedback_id, "status": "accepted", "model_version": online_learning.current_version()},
+        status_code=202,
+    )
+
+
+async def model_rollback(request):
+    """Puts the base detector back in every process and discards the feedback learned so far."""
+    if not online_learning.is_admin(request.headers.get("X-Admin-Token")):
+        return JSONResponse({"error": "An admin token (X-Admin-Token) is required"}, status_code=401)
+    after_id = await run_blocking(online_learning.request_rollback)
+    return JSONResponse({"status": "rolling back", "discarded_through": after_id}, status_code=202)
+
+
+async def shadow_report(request):
+    """Agreement, latency and cost of the shadow candidates against production."""
+    if not shadow.authorized(request.headers.get("X-Admin-Token")):
+        return JSONResponse({"error": "An admin token (X-Admin-Token) is required"}, status_code=401)
+    try:
+        hours = float(request.query_params.get("hours", shadow.SHADOW_REPORT_HOURS))
+    except ValueError:
+        return JSONResponse({"error": "hours must be a number"}, status_code=400)
+    return JSONResponse(await run_blocking(shadow.report, hours))
+
+
+async def cached_analysis(request):
+    """A stored /analyze result by content hash, cacheable by browsers and proxies."""
+    key = request.path_params["key"]
+    cached = await run_blocking(http_cache.lookup, key) if http_cache.valid_hash(key) else None
+    if cached is None:
+        return JSONResponse({"error": "Analysis not found"}, status_code=404)
+    body, ttl = cached
+    return conditional_response(request, body, ttl, "/analysis/{key}")
+
+
+async def trending_news(request):
+    try:
+        body, ttl = await run_blocking(
+            http_cache.memoized, "trending", http_cache.TRENDING_MAX_AGE_SECONDS,
+            lambda: prescreen.screen_trending(analyzer.get_trending_news()),
+        )
+        return conditional_response(request, body, ttl, "/trending-news")
+    except Exception as e:
+        return JSONResponse({
+            "status": "error",
+            "message": f"Failed to fetch trending news: {str(e)}"
+        }, status_code=500)
+
+
+async def health_check(request):
+    """Health check endpoint for production monitoring"""
+    return JSONResponse({
+        "status": "healthy",
+        "service": "TrueVail Backend",
+        "version": "1.0.0"
+    })
+
+
+async def readiness_check(request):
+    """Readiness check endpoint"""
+    return JSONResponse({
+        "status": "ready",
+        "service": "TrueVail Backend"
+    })
+
+
+async def metrics_endpoint(request):
+    """Prometheus scrape endpoint (aggregated across workers when METRICS_DIR is set)"""
+    return Response(metrics.render(), media_type="text/plain; version=0.0.4")
+
+
+async def not_found(request, exc):
+    return JSONResponse({
+        "error": "Resource not found",
+        "message": "The requested endpoint does not exist"
+    }, status_code=404)
+
+
+async def internal_error(request, exc):
+    return JSONResponse({
+        "error": "Internal server error",
+        "message": "An unexpected error occurred"
+    }, status_code=500)
+
+
+class RequestMetricsMiddleware:
+    """Same HTTP request metrics as the Flask before/after_request hooks."""
+
+    def __init__(self, app):
+        self.app = app
+
+    def _endpoint(self, scope):
+        for route in routes:
+            match, _ = route.matches(scope)
+            if match == Match.FULL:
+                return route.path
+        return "unmatched"
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        started = time.perf_counter()
+        status = {"code": 500}
+
+        async def send_with_status(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        metrics.inc("truevail_http_requests_in_flight", 1)
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            endpoint = self._endpoint(scope)
+            metrics.inc("truevail_http_requests_in_flight", -1)
+            metrics.observe("truevail_http_request_duration_seconds", time.perf_counter() - started, endpoint=endpoint)
+            metrics.inc("truevail_http_requests_total", endpoint=endpoint, status=str(status["code"]))
+
+
+class CompressionMiddleware:
+    """Compresses large JSON responses for clients that accept it, like compress_response in app.py."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        accept_encoding = dict(scope["headers"]).get(b"accept-encoding", b"").decode("latin-1")
+        held = {"start": None, "chunks": []}
+
+        async def compressing_send(message):
+            if message["type"] == "http.response.start":
+                headers = MutableHeaders(scope=message)
+                length = headers.get("content-length")
+                if http_cache.compressible(
+                    headers.get("content-type"), headers.get("content-encoding"),
+                    int(length) if length and length.isdigit() else None,
+                ):
+                    held["start"] = message
+                    return
+            elif message["type"] == "http.response.body" and held["start"] is not None:
+                held["chunks"].append(message.get("body", b""))
+                if message.get("more_body"):
+                    return
+                start, held["start"] = held["start"], None
+                body, encoding = http_cache.negotiate(b"".join(held["chunks"]), accept_encoding)
+                headers = MutableHeaders(scope=start)
+                headers.add_vary_header("Accept-Encoding")
+                if encoding:
+                    headers["Content-Encoding"] = encoding
+                    headers["Content-Length"] = str(len(body))
+                    if "etag" in headers:
+                        headers["ETag"] = http_cache.encoded_etag(headers["etag"], encoding)
+                await send(start)
+                message = {"type": "http.response.body", "body": body}
+            await send(message)
+
+        await self.app(scope, receive, compressing_send)
+
+
+@asynccontextmanager
+async def lifespan(app):
+    global _executor, _client
+    _executor = ThreadPoolExecutor(max_workers=ASGI_BLOCKING_THREADS, thread_name_prefix="truevail-blocking")
+    _client = httpx.AsyncClient(limits=httpx.Limits(
+        max_connections=ASGI_MAX_CONNECTIONS,
+        max_keepalive_connections=ASGI_MAX_KEEPALIVE,
+    ))
+    # Jobs run on their own threads, not on the pool that serves requests
+    jobs.start_workers()
+    online_learning.start()
+    try:
+        yield
+    finally:
+        await _client.aclose()
+        _executor.shutdown(wait=False)
+
+
+routes = [
+    Route("/", home, methods=["GET"]),
+    Route("/analyze", analyze, methods=["POST"]),
+    Route("/analyze/media", analyze_media, methods=["POST"]),
+    Route("/analyze/async", analyze_async, methods=["POST"]),
+    Route("/jobs/{job_id}", job_status, methods=["GET"]),
+    Route("/feedback", feedback, methods=["POST"]),
+    Route("/model/rollback", model_rollback, methods=["POST"]),
+    Route("/shadow/report", shadow_report, methods=["GET"]),
+    Route("/analysis/{key}", cached_analysis, methods=["GET"]),
+    Route("/trending-news", trending_news, methods=["GET"]),
+    Route("/health", health_check),
+    Route("/ready", readiness_check),
+    Route("/metrics", metrics_endpoint),
+]
+
+app = Starlette(
+    routes=routes,
+    middleware=[
+        Middleware(RequestMetricsMiddleware),
+        Middleware(CORSMiddleware, allow_origins=["*"], allow_methods=["*"], allow_headers=["*"]),
+        Middleware(CompressionMiddleware),
+    ],
+    exception_handlers={404: not_found, 500: internal_error},
+    lifespan=lifespan,
+)
+
+if __name__ == "__main__":
+    import uvicorn
+    uvicorn.run(app, host="0.0.0.0", port=int(os.environ.get("PORT", 5001)))
@@ -0,0 +1,105 @@
+"""
+A/B evaluation of prompt compaction (compaction.py) on a labelled set.
+
+Every item is analyzed twice through perform_ai_analysis against the
+configured LLM (AI_PLATFORM, OLLAMA_HOST / GEMINI_API_KEY): once with the old
+blind truncation (the first 5000 chars for Gemini, 1500 for Ollama and the
+search context) and once with extractive compaction at the configured
+budgets. Reports accuracy, prompt size and latency per arm.
+
+Input is JSONL with one {"text": ..., "label": "real"|"fake"} per line.
+
+Usage (from backend/):
+    python benchmarks/compaction_eval.py labelled.jsonl
+    python benchmarks/compaction_eval.py labelled.jsonl --limit 50 --output eval.json
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+# The LLM has to see every item; the local detector would answer first otherwise
+os.environ["LOCAL_MODEL_FIRST"] = "0"
+# Both arms must pay for their own searches and verdicts
+os.environ.setdefault("NEAR_DUP_ENABLED", "0")
+os.environ.setdefault("SEARCH_CACHE_ENABLED", "0")
+os.environ.setdefault("EVIDENCE_ENABLED", "0")
+os.environ.setdefault("LOG_LEVEL", "ERROR")
+
+import analyzer  # noqa: E402
+import compaction  # noqa: E402
+
+# Token budgets equivalent to the old character cuts
+TRUNCATION_ARM = {"enabled": False, "gemini": 1250, "ollama": 375, "context": 375}
+
+
+def configure(arm):
+    compaction.COMPACT_ENABLED = arm["enabled"]
+    compaction.COMPACT_GEMINI_TOKENS = arm["gemini"]
+    compaction.COMPACT_OLLAMA_TOKENS = arm["ollama"]
+    compaction.COMPACT_CONTEXT_TOKENS = arm["context"]
+
+
+def is_correct(result, label):
+    status = str(result.get("status", "")).lower() if isinstance(result, dict) else ""
+    return ("fake" in status) == (label == "fake") and "uncertain" not in status
+
+
+def run_arm(name, arm, items):
+    configure(arm)
+    correct = 0
+    prompt_tokens = []
+    latencies = []
+    for text, label in items:
+        prompt = analyzer.build_gemini_prompt(text) if analyzer.AI_PLATFORM == "gemini" else analyzer.build_ollama_prompt(text)
+        prompt_tokens.append(compaction.estimate_tokens(prompt))
+        started = time.perf_counter()
+        result = analyzer.perform_ai_analysis(text, analysis_type="news")
+        latencies.append(time.perf_counter() - started)
+        correct += is_correct(result, label)
+    report = {
+        "items": len(items),
+        "accuracy": round(correct / len(items), 4) if items else None,
+        "mean_prompt_tokens": round(statistics.fmean(prompt_tokens), 1) if items else None,
+        "median_latency": round(statistics.median(latencies), 3) if items else None,
+    }
+    print(f"{name:<12} accuracy {report['accuracy']}  prompt ~{report['mean_prompt_tokens']} tokens  "
+          f"median latency {report['median_latency']}s")
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare blind truncation with extractive compaction")
+    parser.add_argument("input", help='JSONL with {"text": ..., "label": "real"|"fake"} per line')
+    parser.add_argument("--limit", type=int, default=0)
+    parser.add_argument("--output", help="write the report as JSON")
+    args = parser.parse_args()
+
+    with open(args.input, encoding="utf-8") as f:
+        items = [(row["text"], row["label"].lower()) for row in map(json.loads, filter(str.strip, f))]
+    if args.limit:
+        items = items[:args.limit]
+
+    compacted_arm = {
+        "enabled": True,
+        "gemini": compaction.COMPACT_GEMINI_TOKENS,
+        "ollama": compaction.COMPACT_OLLAMA_TOKENS,
+        "context": compaction.COMPACT_CONTEXT_TOKENS,
+    }
+    report = {
+        "truncation": run_arm("truncation", TRUNCATION_ARM, items),
+        "compaction": run_arm("compaction", compacted_arm, items),
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,316 @@
+"""
+End-to-end load test for the Flask service under different gunicorn setups.
+
+For each gunicorn configuration the harness starts the app against the local
+upstream stand-ins (stub_servers.py) with configurable LLM / search / page
+latency and error rates, drives /analyze and /trending-news with a weighted
+traffic mix from a pool of closed-loop clients, and reports throughput,
+p50/p95/p99 latency and worker saturation (in-flight requests divided by
+workers x threads, sampled from the per-worker metrics snapshots). The
+worker class "uvicorn" serves the async entry point (asgi_app.py) through
+uvicorn's gunicorn worker instead of the Flask app.
+
+Example (from backend/), showing what sync workers cost when every analysis
+waits ~2 s on the LLM:
+    python benchmarks/load_test.py --concurrency 32 --duration 30 \\
+        --config sync:4 --config gthread:4:16 --config uvicorn:1 --ollama-latency 2000 --ollama-jitter 500
+"""
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import socket
+import argparse
+import tempfile
+import threading
+import subprocess
+from collections import defaultdict
+
+import requests
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+from stub_servers import StubUpstreams, add_profile_arguments, profiles_from_args  # noqa: E402
+
+# Worker classes that are served from asgi_app.py rather than app.py
+ASGI_WORKERS = {"uvicorn": "uvicorn.workers.UvicornWorker"}
+DEFAULT_MIX = "text=40,url=25,privacy=15,deepfake=10,trending=10"
+# 1x1 transparent PNG; only its presence matters to the deepfake path
+TINY_IMAGE_B64 = "iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAQAAAC1HAwCAAAAC0lEQVR42mNkYAAAAAYAAjCB0C8AAAAASUVORK5CYII="
+
+
+def parse_mix(spec):
+    mix = {}
+    for part in spec.split(","):
+        kind, weight = part.split("=")
+        mix[kind.strip()] = float(weight)
+    return mix
+
+
+def parse_config(spec):
+    """'sync:4' or 'gthread:4:16' -> dict(worker_class, workers, threads)."""
+    parts = spec.split(":")
+    return {
+        "worker_class": parts[0],
+        "workers": int(parts[1]) if len(parts) > 1 else 1,
+        "threads": int(parts[2]) if len(parts) > 2 else 1,
+    }
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def build_request(kind, stubs):
+    """Returns (method, path, json_body) for one request of the given kind."""
+    if kind == "text":
+        return "POST", "/analyze", {"text": "Officials confirmed the new transit line opens in March after safety checks.", "type": "news"}
+    if kind == "url":
+        page = random.choice(["article_tag.html", "paragraphs_only.html", "boilerplate_heavy.html"])
+        return "POST", "/analyze", {"text": stubs.page_url(page), "type": "news"}
+    if kind == "privacy":
+        return "POST", "/analyze", {"text": "Email jane.doe@example.com, phone 555-0100, address 1 Main Street.", "type": "privacy"}
+    if kind == "deepfake":
+        return "POST", "/analyze", {"text": "upload.png", "type": "deepfake", "image_data": TINY_IMAGE_B64, "mime_type": "image/png"}
+    if kind == "trending":
+        return "GET", "/trending-news", None
+    raise ValueError(f"Unknown request kind: {kind}")
+
+
+def start_server(config, stubs, metrics_dir, timeout):
+    port = _free_port()
+    env = dict(os.environ)
+    env.update(stubs.env())
+    env.update({
+        "AI_PLATFORM": "ollama",
+        "GEMINI_API_KEY": "",
+        "NEWS_API_KEY": "loadtest",
+        # Send news through search + Ollama so requests really wait on the LLM
+        "LOCAL_MODEL_FIRST": "0",
+        "METRICS_DIR": metrics_dir,
+        "METRICS_FLUSH_SECONDS": "0.25",
+        "LOG_LEVEL": "ERROR",
+        "AI_DEBUG_LOG": os.path.join(metrics_dir, "ai_debug_output.txt"),
+        "PAGE_CACHE_DB": os.path.join(metrics_dir, "page_cache.db"),
+        "JOBS_DB": os.path.join(metrics_dir, "jobs.db"),
+        "EVIDENCE_DB": os.path.join(metrics_dir, "evidence.db"),
+        # Repeated texts would be answered from caches instead of waiting on the LLM
+        "ANALYSIS_CACHE_ENABLED": "0",
+        "ANALYSIS_CACHE_DB": os.path.join(metrics_dir, "analysis_cache.db"),
+        "NEAR_DUP_ENABLED": "0",
+        "NEAR_DUP_DB": "",
+        "FEEDBACK_DB": os.path.join(metrics_dir, "feedback.db"),
+        "SHADOW_DB": os.path.join(metrics_dir, "shadow.db"),
+        "GEMINI_QUOTA_DB": os.path.join(metrics_dir, "gemini_quota.db"),
+        # Every stub is one host; per-host limits would measure refusals
+        "POLITENESS_ENABLED": "0",
+        "SEARCH_CACHE_PATH": os.path.join(metrics_dir, "search_cache.json"),
+        # Every simulated client is 127.0.0.1; throttling them would measure 429s
+        "RATE_LIMIT_ENABLED": "0",
+        "RATE_LIMIT_DB": os.path.join(metrics_dir, "rate_limit.db"),
+    })
+    worker_class = config["worker_class"]
+    app_module = "asgi_app:app" if worker_class in ASGI_WORKERS else "app:app"
+    cmd = [
+        sys.executable, "-m", "gunicorn", app_module,
+        "--chdir", BACKEND_DIR,
+        "--bind", f"127.0.0.1:{port}",
+        "--workers", str(config["workers"]),
+        "--worker-class", ASGI_WORKERS.get(worker_class, worker_class),
+        "--threads", str(config["threads"]),
+        "--timeout", str(timeout),
+        "--log-level", "warning",
+    ]
+    process = subprocess.Popen(cmd, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    base_url = f"http://127.0.0.1:{port}"
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"gunicorn exited: {process.stderr.read().decode(errors='replace')[-2000:]}")
+        try:
+            if requests.get(f"{base_url}/health", timeout=1).status_code == 200:
+                return process, base_url
+        except requests.RequestException:
+            time.sleep(0.25)
+    process.terminate()
+    raise RuntimeError("gunicorn did not become healthy within 60 s")
+
+
+def read_in_flight(metrics_dir):
+    """Sums the in-flight gauge over the live workers' metrics snapshots."""
+    total = 0.0
+    for filename in os.listdir(metrics_dir):
+        if not (filename.startswith("metrics_") and filename.endswith(".json")):
+            continue
+        try:
+            pid = int(filename[len("metrics_"):-len(".json")])
+            os.kill(pid, 0)
+            with open(os.path.join(metrics_dir, filename), encoding="utf-8") as f:
+                snapshot = json.load(f)
+        except (ValueError, OSError):
+            continue
+        for name, labels, value in snapshot.get("values", []):
+            if name == "truevail_http_requests_in_flight":
+                total += value
+    return total
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def summarize(latencies):
+    return {
+        "count": len(latencies),
+        "p50": percentile(latencies, 0.50),
+        "p95": percentile(latencies, 0.95),
+        "p99": percentile(latencies, 0.99),
+        "max": max(latencies) if latencies else None,
+    }
+
+
+def run_load(base_url, stubs, mix, concurrency, duration, request_timeout, metrics_dir, capacity):
+    kinds = list(mix)
+    weights = [mix[kind] for kind in kinds]
+    latencies = defaultdict(list)
+    errors = defaultdict(int)
+    lock = threading.Lock()
+    stop_at = time.time() + duration
+    saturation_samples = []
+
+    def client():
+        session = requests.Session()
+        while time.time() < stop_at:
+            kind = random.choices(kinds, weights)[0]
+            method, path, body = build_request(kind, stubs)
+            started = time.perf_counter()
+            try:
+                response = session.request(method, base_url + path, json=body, timeout=request_timeout)
+                # 429s and other 4xx are failures too, not served requests
+                ok = 200 <= response.status_code < 300
+            except requests.RequestException:
+                ok = False
+            elapsed = time.perf_counter() - started
+            with lock:
+                latencies[kind].append(elapsed)
+                if not ok:
+                    errors[kind] += 1
+
+    def sampler():
+        while time.time() < stop_at:
+            try:
+                saturation_samples.append(read_in_flight(metrics_dir) / capacity)
+            except OSError:
+                pass
+            time.sleep(0.25)
+
+    threads = [threading.Thread(target=client, daemon=True) for _ in range(concurrency)]
+    threads.append(threading.Thread(target=sampler, daemon=True))
+    started = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.time() - started
+
+    all_latencies = [value for values in latencies.values() for value in values]
+    total_errors = sum(errors.values())
+    return {
+        "requests": len(all_latencies),
+        "errors": total_errors,
+        "error_rate": total_errors / len(all_latencies) if all_latencies else 0.0,
+        "throughput_rps": len(all_latencies) / elapsed if elapsed else 0.0,
+        "latency": summarize(all_latencies),
+        "by_kind": {kind: dict(summarize(values), errors=errors[kind]) for kind, values in latencies.items()},
+        "saturation": {
+            "mean": sum(saturation_samples) / len(saturation_samples) if saturation_samples else None,
+            "max": max(saturation_samples) if saturation_samples else None,
+        },
+    }
+
+
+def format_seconds(value):
+    return "   -   " if value is None else f"{value * 1000:7.0f}"
+
+
+def print_report(results):
+    print()
+    print(f"{'config':18s} {'rps':>7s} {'err%':>6s} {'p50 ms':>8s} {'p95 ms':>8s} {'p99 ms':>8s} {'sat avg':>8s} {'sat max':>8s}")
+    for name, result in results.items():
+        latency = result["latency"]
+        saturation = result["saturation"]
+        print(
+            f"{name:18s} {result['throughput_rps']:7.2f} {result['error_rate'] * 100:6.1f} "
+            f"{format_seconds(latency['p50'])}  {format_seconds(latency['p95'])}  {format_seconds(latency['p99'])} "
+            f"{(saturation['mean'] or 0) * 100:7.0f}% {(saturation['max'] or 0) * 100:7.0f}%"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test TrueVail under different gunicorn configurations")
+    parser.add_argument("--config", action="append", default=[],
+                        help="worker_class:workers[:threads], repeatable (default: sync:2 and gthread:2:8)")
+    parser.add_argument("--concurrency", type=int, default=16, help="concurrent closed-loop clients")
+    parser.add_argument("--duration", type=float, default=20.0, help="seconds of load per configuration")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help=f"traffic mix weights (default {DEFAULT_MIX})")
+    parser.add_argument("--request-timeout", type=float, default=60.0)
+    parser.add_argument("--worker-timeout", type=int, default=120, help="gunicorn --timeout")
+    parser.add_argument("--output", default=os.path.join(BENCH_DIR, "load_results.json"))
+    add_profile_arguments(parser)
+    parser.set_defaults(ollama_latency=2000.0, ollama_jitter=500.0, search_latency=300.0,
+                        pages_latency=150.0, newsapi_latency=200.0, gemini_latency=1200.0)
+    args = parser.parse_args()
+
+    configs = args.config or ["sync:2", "gthread:2:8"]
+    mix = parse_mix(args.mix)
+    results = {}
+    with StubUpstreams(profiles=profiles_from_args(args)) as stubs:
+        for spec in configs:
+            config = parse_config(spec)
+            if config["worker_class"] in ASGI_WORKERS:
+                # An async worker holds as many requests as there are clients
+                capacity = max(config["workers"], args.concurrency)
+            else:
+                capacity = config["workers"] * (config["threads"] if config["worker_class"] == "gthread" else 1)
+            metrics_dir = tempfile.mkdtemp(prefix="truevail_load_")
+            print(f"Running {spec} (capacity {capacity}) for {args.duration:.0f}s with {args.concurrency} clients...")
+            process, base_url = start_server(config, stubs, metrics_dir, args.worker_timeout)
+            try:
+                result = run_load(base_url, stubs, mix, args.concurrency, args.duration,
+                                  args.request_timeout, metrics_dir, capacity)
+            finally:
+                process.terminate()
+                process.wait(timeout=30)
+                shutil.rmtree(metrics_dir, ignore_errors=True)
+            result["config"] = dict(config, capacity=capacity)
+            results[spec] = result
+
+        upstream_calls = stubs.counts
+
+    print_report(results)
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "concurrency": args.concurrency,
+            "duration": args.duration,
+            "mix": mix,
+            "upstream_calls": upstream_calls,
+        },
+        "results": results,
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nFull report written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,244 @@
+"""
+Micro-benchmarks for the analyzer hot paths.
+
+Runs fully offline: every upstream (Ollama, Gemini REST, DuckDuckGo HTML,
+NewsAPI, article pages) is served by the local stand-ins in stub_servers.py.
+Results are written as JSON and compared against a stored baseline; a case
+whose median is slower than the baseline by more than the tolerance is a
+regression and makes the run exit with status 1. Without a baseline only
+failing cases count, unless --check (for CI) makes the missing baseline an
+error too.
+
+Usage (from backend/):
+    python benchmarks/run_benchmarks.py                     # run and compare
+    python benchmarks/run_benchmarks.py --save-baseline     # record a new baseline
+    python benchmarks/run_benchmarks.py --check             # CI: fail when there is no baseline
+    python benchmarks/run_benchmarks.py --only predict --only parse_ai_response
+"""
+import os
+import sys
+import json
+import time
+import random
+import platform
+import argparse
+import statistics
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BACKEND_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+from stub_servers import StubUpstreams, PAGES_DIR, FIXTURES_DIR  # noqa: E402
+
+DEFAULT_RESULTS = os.path.join(BENCH_DIR, "results.json")
+DEFAULT_BASELINE = os.path.join(BENCH_DIR, "baseline.json")
+
+
+def measure(func, min_time=0.5, min_rounds=5, max_rounds=10000, warmup=1):
+    """Calls func repeatedly and returns timing statistics in seconds."""
+    for _ in range(warmup):
+        func()
+    timings = []
+    started = time.perf_counter()
+    while len(timings) < max_rounds and (len(timings) < min_rounds or time.perf_counter() - started < min_time):
+        t0 = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - t0)
+    timings.sort()
+    return {
+        "rounds": len(timings),
+        "min": timings[0],
+        "median": statistics.median(timings),
+        "mean": statistics.fmean(timings),
+        "p95": timings[min(len(timings) - 1, int(len(timings) * 0.95))],
+        "ops_per_sec": len(timings) / sum(timings) if sum(timings) else None,
+    }
+
+
+def build_cases(stubs):
+    """Returns {name: (callable, options)}; imports analyzer after the env points at the stubs."""
+    import analyzer
+    import compaction
+    import near_duplicate
+    from fake_news_detection import FakeNewsDetector
+
+    with open(os.path.join(FIXTURES_DIR, "samples.json"), encoding="utf-8") as f:
+        samples = json.load(f)
+    texts = samples["texts"]
+    ai_responses = samples["ai_responses"]
+    pages = {}
+    for name in sorted(os.listdir(PAGES_DIR)):
+        with open(os.path.join(PAGES_DIR, name), encoding="utf-8") as f:
+            pages[name] = f.read()
+
+    corpus = list(texts.values())
+    trained = {}
+
+    def detector():
+        # Trained on first use so a broken model only fails its own cases
+        if "detector" not in trained:
+            trained["detector"] = FakeNewsDetector().train()
+        return trained["detector"]
+
+    def compact():
+        if "compact" not in trained:
+            import compact_model
+            path = os.path.join(BENCH_DIR, "fake_news.tvm")
+            compact_model.export(detector(), path)
+            trained["compact"] = compact_model.CompactModel(path)
+            os.remove(path)  # stays mapped
+        return trained["compact"]
+
+    def predict_all():
+        model = detector()
+        for text in corpus:
+            model.predict(text)
+
+    def parse_all():
+        for kind, response in ai_responses.items():
+            analyzer.parse_ai_response(response, analysis_type="privacy" if kind.startswith("privacy") else "news")
+
+    def analyze_url_all():
+        for url in samples["urls"]:
+            analyzer.analyze_url(analyzer.urlparse(url).netloc)
+
+    cases = {
+        "preprocess_text": (lambda: detector().preprocess_text(texts["medium_fake"] * 4), {}),
+        "predict": (predict_all, {}),
+        "predict_compact": (lambda: [compact().predict(text) for text in corpus], {}),
+        # One short document: compiled tables vs the sklearn transform/predict_proba path
+        "predict_single": (lambda: detector().predict(texts["short_fake"]), {}),
+        "predict_single_sklearn": (lambda: detector().predict_batch([texts["short_fake"]]), {}),
+        "train": (lambda: FakeNewsDetector().train(), {"min_time": 1.0, "min_rounds": 3}),
+        "parse_ai_response": (parse_all, {}),
+        "analyze_content_news": (lambda: analyzer.analyze_content(texts["medium_real"], "news"), {}),
+        "analyze_content_privacy": (lambda: analyzer.analyze_content(texts["privacy"], "privacy"), {}),
+        "heuristic_fallback": (lambda: analyzer.heuristic_fallback(texts["medium_fake"], False, None, "bench", "news"), {}),
+        "heuristic_fallback_url": (
+            lambda: analyzer.heuristic_fallback(texts["medium_real"], True, samples["urls"][0], "bench", "news"), {}
+        ),
+        "analyze_url": (analyze_url_all, {}),
+    }
+    for name, html in pages.items():
+        case = f"extract_main_text[{os.path.splitext(name)[0]}]"
+        cases[case] = (lambda html=html: analyzer.extract_main_text(html), {})
+        case = f"fetch_url_content[{os.path.splitext(name)[0]}]"
+        cases[case] = (lambda name=name: analyzer.fetch_url_content(stubs.page_url(name)), {})
+    # 5000 distinct synthetic texts plus the probe's original
+    vocabulary = sorted({word for text in corpus for word in near_duplicate.normalize_tokens(text)})
+    rng = random.Random(7)
+    index = near_duplicate.MinHashIndex()
+    for i in range(5000):
+        tokens = [rng.choice(vocabulary) for _ in range(40)]
+        index.add(f"bench{i}", index.signature(tokens), {"i": i})
+    index.add("original", index.signature(near_duplicate.normalize_tokens(texts["medium_fake"])), {"i": -1})
+    probe = near_duplicate.normalize_tokens("BREAKING: " + texts["medium_fake"] + " !!!")
+    cases["near_duplicate_signature"] = (lambda: index.signature(probe), {})
+    cases["near_duplicate_query"] = (lambda: index.query(index.signature(probe)), {})
+    # web_search_duckduckgo is a cache hit after its first round; fetch_search_results always searches
+    long_text = analyzer.extract_main_text(pages["long_article.html"])
+    cases["compact_long_article"] = (lambda: compaction.compact(long_text, compaction.COMPACT_GEMINI_TOKENS), {})
+    cases["build_ollama_prompt_long"] = (lambda: analyzer.build_ollama_prompt(long_text), {})
+    cases["web_search_duckduckgo"] = (lambda: analyzer.web_search_duckduckgo("methane summit agreement"), {})
+    cases["fetch_search_results"] = (lambda: analyzer.fetch_search_results("methane summit agreement"), {})
+    cases["analyze_news_url"] = (lambda: analyzer.analyze_news(stubs.page_url("article_tag.html")), {})
+    cases["perform_ai_analysis_ollama"] = (
+        lambda: analyzer.perform_ai_analysis(texts["privacy"], analysis_type="privacy"), {}
+    )
+    return cases
+
+
+def compare(results, baseline, tolerance):
+    """Returns a list of (case, baseline_median, current_median, ratio) regressions."""
+    regressions = []
+    for name, current in results.items():
+        previous = baseline.get(name)
+        if not previous or "median" not in current or not previous.get("median"):
+            continue
+        ratio = current["median"] / previous["median"]
+        if ratio > 1 + tolerance:
+            regressions.append((name, previous["median"], current["median"], ratio))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="TrueVail analyzer micro-benchmarks")
+    parser.add_argument("--output", default=DEFAULT_RESULTS, help="where to write results JSON")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="baseline JSON to compare against")
+    parser.add_argument("--save-baseline", action="store_true", help="store this run as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed median slowdown (0.25 = 25%%)")
+    parser.add_argument("--min-time", type=float, default=0.5, help="minimum seconds spent per case")
+    parser.add_argument("--only", action="append", default=[], help="run only cases starting with this prefix")
+    parser.add_argument("--check", action="store_true", help="fail when the baseline is missing (for CI)")
+    args = parser.parse_args()
+
+    with StubUpstreams() as stubs:
+        os.environ.update(stubs.env())
+        # Keep every path offline and deterministic: no Gemini SDK, Ollama via the stub
+        os.environ["GEMINI_API_KEY"] = ""
+        os.environ["AI_PLATFORM"] = "ollama"
+        # Measure real fetches, not page cache hits
+        os.environ["PAGE_CACHE_DB"] = ""
+        os.environ["PAGE_CACHE_TTL_SECONDS"] = "0"
+        # Nor verdicts reused from reworded copies of an earlier case
+        os.environ["NEAR_DUP_ENABLED"] = "0"
+        os.environ["NEAR_DUP_DB"] = ""
+        # The stubs are one host; per-host limits would measure refusals
+        os.environ["POLITENESS_ENABLED"] = "0"
+        os.environ["EVIDENCE_ENABLED"] = "0"
+        os.environ["SEARCH_CACHE_PATH"] = ""
+        os.environ.setdefault("LOG_LEVEL", "ERROR")
+        os.environ.setdefault("AI_DEBUG_LOG_LEVEL", "CRITICAL")
+
+        cases = build_cases(stubs)
+        results = {}
+        for name, (func, options) in cases.items():
+            if args.only and not any(name.startswith(prefix) for prefix in args.only):
+                continue
+            options = dict({"min_time": args.min_time}, **options)
+            try:
+                results[name] = measure(func, **options)
+                print(f"{name:45s} median {results[name]['median'] * 1e6:12.1f} us   ({results[name]['rounds']} rounds)")
+            except Exception as e:
+                results[name] = {"error": f"{type(e).__name__}: {e}"}
+                print(f"{name:45s} ERROR {results[name]['error']}")
+
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+        },
+        "results": results,
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nResults written to {args.output}")
+
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"Baseline saved to {args.baseline}")
+        return 0
+
+    failed = [name for name, result in results.items() if "error" in result]
+    for name in failed:
+        print(f"FAILED {name}: {results[name]['error']}")
+    if not os.path.exists(args.baseline):
+        if args.check:
+            print(f"No baseline at {args.baseline}; record one on the reference machine with --save-baseline.")
+            return 1
+        print("No baseline found; run with --save-baseline to create one.")
+        return 1 if failed else 0
+
+    with open(args.baseline, encoding="utf-8") as f:
+        baseline = json.load(f).get("results", {})
+    regressions = compare(results, baseline, args.tolerance)
+    for name, before, after, ratio in regressions:
+        print(f"REGRESSION {name}: {before * 1e6:.1f} us -> {after * 1e6:.1f} us ({ratio:.2f}x)")
+    return 1 if regressions or failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
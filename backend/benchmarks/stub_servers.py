@@ -0,0 +1,251 @@
+"""
+Local stand-ins for the upstream services TrueVail depends on.
+
+One threaded HTTP server on 127.0.0.1 answers like Ollama (/api/generate),
+Gemini REST (/v1beta/models/<model>:generateContent), DuckDuckGo's HTML
+search (/html/), NewsAPI (/v2/top-headlines, /v2/everything) and a plain web
+server for the saved fixture pages (/pages/<name>.html). Each service has its
+own latency and error profile so benchmarks and load tests can run fully
+offline with realistic (or deliberately bad) upstream behaviour.
+
+Run standalone with:
+    python benchmarks/stub_servers.py --port 8765 --ollama-latency 2000
+"""
+import os
+import json
+import time
+import random
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+PAGES_DIR = os.path.join(FIXTURES_DIR, "pages")
+
+SERVICES = ("ollama", "gemini", "search", "newsapi", "pages")
+
+
+class UpstreamProfile:
+    """Latency (milliseconds, uniform within +/- jitter) and error behaviour of one service."""
+
+    def __init__(self, latency_ms=0.0, jitter_ms=0.0, error_rate=0.0, error_status=503):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.error_status = error_status
+
+    def delay(self):
+        latency = self.latency_ms + random.uniform(-self.jitter_ms, self.jitter_ms)
+        if latency > 0:
+            time.sleep(latency / 1000.0)
+
+    def should_fail(self):
+        return self.error_rate > 0 and random.random() < self.error_rate
+
+
+OLLAMA_REPLY = (
+    "Status: Likely Real\nConfidence: 78\n"
+    "Explanation: The content is consistent with the reference context and cites verifiable details."
+)
+GEMINI_REPLY = (
+    "Verdict: Likely Real, Confidence: 72, "
+    "Reasoning: No temporal flickering or blending artifacts were found."
+)
+
+
+def _fixture_pages():
+    try:
+        return sorted(name for name in os.listdir(PAGES_DIR) if name.endswith(".html"))
+    except OSError:
+        return []
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    @property
+    def base_url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def _send(self, status, body, content_type="application/json"):
+        if isinstance(body, (dict, list)):
+            body = json.dumps(body)
+        data = body.encode("utf-8") if isinstance(body, str) else body
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _read_body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length) if length else b""
+
+    def _service(self, path):
+        if path.startswith("/api/generate"):
+            return "ollama"
+        if path.startswith("/v1beta/models/"):
+            return "gemini"
+        if path.startswith("/html"):
+            return "search"
+        if path.startswith("/v2/"):
+            return "newsapi"
+        if path.startswith("/pages/"):
+            return "pages"
+        return None
+
+    def _dispatch(self, method):
+        parsed = urlparse(self.path)
+        service = self._service(parsed.path)
+        if service is None:
+            self._send(404, {"error": "not found"})
+            return
+        if method == "POST":
+            self._read_body()
+        self.server.counts[service] = self.server.counts.get(service, 0) + 1
+        profile = self.server.profiles.get(service) or UpstreamProfile()
+        profile.delay()
+        if profile.should_fail():
+            self._send(profile.error_status, {"error": {"code": profile.error_status, "status": "UNAVAILABLE"}})
+            return
+        getattr(self, f"_handle_{service}")(parsed)
+
+    def do_GET(self):
+        self._dispatch("GET")
+
+    def do_POST(self):
+        self._dispatch("POST")
+
+    def _handle_ollama(self, parsed):
+        self._send(200, {"model": "stub", "response": OLLAMA_REPLY, "done": True})
+
+    def _handle_gemini(self, parsed):
+        self._send(200, {"candidates": [{"content": {"parts": [{"text": GEMINI_REPLY}]}}]})
+
+    def _handle_search(self, parsed):
+        links = "\n".join(
+            f'<div class="result"><a class="result__a" href="{self.base_url}/pages/{name}">{name}</a></div>'
+            for name in _fixture_pages()
+        )
+        self._send(200, f"<html><body>{links}</body></html>", "text/html; charset=utf-8")
+
+    def _handle_newsapi(self, parsed):
+        query = parse_qs(parsed.query)
+        size = int((query.get("pageSize") or ["5"])[0])
+        topic = (query.get("q") or ["headlines"])[0]
+        pages = _fixture_pages() or ["article_tag.html"]
+        articles = [
+            {
+                "source": {"id": None, "name": f"Stub Source {i % 4}"},
+                "title": f"Stub {topic} story {i}: officials confirm new report",
+                "description": f"A growing {topic} trend was confirmed in a new report published today.",
+                "url": f"{self.base_url}/pages/{pages[i % len(pages)]}",
+                "publishedAt": "2026-10-19T08:00:00Z",
+            }
+            for i in range(size)
+        ]
+        self._send(200, {"status": "ok", "totalResults": len(articles), "articles": articles})
+
+    def _handle_pages(self, parsed):
+        name = os.path.basename(parsed.path)
+        path = os.path.join(PAGES_DIR, name)
+        if not os.path.isfile(path):
+            self._send(404, "<html><body>Not found</body></html>", "text/html")
+            return
+        with open(path, "rb") as f:
+            self._send(200, f.read(), "text/html; charset=utf-8")
+
+
+class StubUpstreams:
+    """
+    Starts the stand-in server on a background thread.
+
+    Use as a context manager; env() returns the environment variables that
+    point analyzer at the stand-ins (they must be set before it is imported).
+    """
+
+    def __init__(self, port=0, profiles=None):
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), _StubHandler)
+        self.server.daemon_threads = True
+        self.server.profiles = dict(profiles or {})
+        self.server.counts = {}
+        self.thread = threading.Thread(target=self.server.serve_forever, name="stub-upstreams", daemon=True)
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def counts(self):
+        return dict(self.server.counts)
+
+    def set_profile(self, service, profile):
+        self.server.profiles[service] = profile
+
+    def page_url(self, name):
+        return f"{self.url}/pages/{name}"
+
+    def env(self):
+        return {
+            "OLLAMA_HOST": self.url,
+            "DUCKDUCKGO_HTML_URL": f"{self.url}/html/",
+            "NEWS_API_BASE_URL": f"{self.url}/v2",
+            "GEMINI_API_BASE": self.url,
+        }
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def add_profile_arguments(parser):
+    """Adds --<service>-latency/--<service>-jitter/--<service>-error-rate options."""
+    for service in SERVICES:
+        parser.add_argument(f"--{service}-latency", type=float, default=0.0, help=f"{service} latency in ms")
+        parser.add_argument(f"--{service}-jitter", type=float, default=0.0, help=f"{service} latency jitter in ms")
+        parser.add_argument(f"--{service}-error-rate", type=float, default=0.0, help=f"{service} error ratio (0-1)")
+
+
+def profiles_from_args(args):
+    return {
+        service: UpstreamProfile(
+            latency_ms=getattr(args, f"{service}_latency"),
+            jitter_ms=getattr(args, f"{service}_jitter"),
+            error_rate=getattr(args, f"{service}_error_rate"),
+        )
+        for service in SERVICES
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the TrueVail upstream stand-ins")
+    parser.add_argument("--port", type=int, default=8765)
+    add_profile_arguments(parser)
+    args = parser.parse_args()
+    stubs = StubUpstreams(port=args.port, profiles=profiles_from_args(args)).start()
+    for key, value in stubs.env().items():
+        print(f"{key}={value}")
+    try:
+        stubs.thread.join()
+    except KeyboardInterrupt:
+        stubs.stop()
+
+
+if __name__ == "__main__":
+    main()
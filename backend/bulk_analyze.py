@@ -0,0 +1,232 @@
+"""
+Offline bulk analysis of article archives.
+
+Reads items from JSONL (one object per line) or CSV (with a header row),
+analyzes them across a process pool and streams one JSON line per item to the
+output file. Progress (items/sec) is reported on stderr while it runs.
+
+    python bulk_analyze.py archive.jsonl -o scores.jsonl --processes 8
+    python bulk_analyze.py urls.csv -o scores.jsonl --mode full --ollama-concurrency 2
+
+Modes:
+    local   the pre-trained FakeNewsDetector only (no network, CPU bound)
+    full    analyze_news, i.e. the same pipeline as POST /analyze
+
+In full mode the number of simultaneous calls to each upstream (Ollama,
+Gemini, search, page fetches) is capped across all processes by shared
+semaphores, so adding processes does not stampede a single provider.
+
+The output file doubles as the checkpoint: each finished item is flushed as
+soon as it completes (and fsynced every --checkpoint-every items), and a rerun
+with the same output skips every id that already has a result. Items that
+failed are retried on the next run.
+"""
+import os
+import sys
+import csv
+import json
+import time
+import argparse
+import threading
+import multiprocessing
+
+DEFAULT_TEXT_FIELDS = ("text", "url", "content")
+UPSTREAMS = ("ollama", "gemini", "search", "fetch")
+
+# Per-process state, set up by _init_worker
+_mode = None
+_budget = None
+
+
+def read_items(path, id_field="id", text_field=None, type_field="type"):
+    """Yields (id, text, analysis_type) from a JSONL or CSV file; ids default to the row number."""
+    if path.endswith(".csv"):
+        f = open(path, newline="", encoding="utf-8")
+        rows = csv.DictReader(f)
+    else:
+        f = open(path, encoding="utf-8")
+        rows = (json.loads(line) for line in f if line.strip())
+    with f:
+        for number, row in enumerate(rows, 1):
+            if text_field:
+                text = row.get(text_field)
+            else:
+                text = next((row[field] for field in DEFAULT_TEXT_FIELDS if row.get(field)), None)
+            item_id = str(row.get(id_field) or number)
+            yield item_id, text, row.get(type_field) or "news"
+
+
+def load_checkpoint(output):
+    """Ids that already have a result in the output file."""
+    done = set()
+    if not os.path.exists(output):
+        return done
+    with open(output, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue  # a line cut short by an interrupted run
+            if "result" in record:
+                done.add(record["id"])
+    return done
+
+
+def terminate_partial_line(path):
+    """Ends a line left half-written by an interrupted run, so appends start clean."""
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        return
+    with open(path, "rb+") as f:
+        f.seek(-1, os.SEEK_END)
+        if f.read(1) != b"\n":
+            f.write(b"\n")
+
+
+def _limited(func, semaphore):
+    def wrapper(*args, **kwargs):
+        with semaphore:
+            return func(*args, **kwargs)
+    return wrapper
+
+
+class _LimitedModel:
+    """Gemini model proxy whose generate_content waits for an upstream slot."""
+
+    def __init__(self, model, semaphore):
+        self._model = model
+        self.generate_content = _limited(model.generate_content, semaphore)
+
+    def __getattr__(self, name):
+        return getattr(self._model, name)
+
+
+def _init_worker(mode, budget, semaphores):
+    global _mode, _budget
+    _mode = mode
+    _budget = budget
+    if mode != "full":
+        return
+    import analyzer
+
+    analyzer.call_ollama = _limited(analyzer.call_ollama, semaphores["ollama"])
+    analyzer.fetch_search_results = _limited(analyzer.fetch_search_results, semaphores["search"])
+    analyzer.fetch_url_content = _limited(analyzer.fetch_url_content, semaphores["fetch"])
+    model = analyzer.get_gemini_model()
+    if model is not None:
+        limited_model = _LimitedModel(model, semaphores["gemini"])
+        analyzer.get_gemini_model = lambda: limited_model
+
+
+def analyze_item(item):
+    """Runs one item in a worker process; returns its output record."""
+    item_id, text, analysis_type = item
+    started = time.perf_counter()
+    try:
+        if not text:
+            raise ValueError("item has no text")
+        if _mode == "local":
+            from fake_news_detection import detect_fake_news
+            result = detect_fake_news(text)
+            result["is_fake"] = bool(result["is_fake"])
+        else:
+            import deadline
+            from analyzer import analyze_news
+            with deadline.request_deadline(_budget) as dl:
+                result = analyze_news(text, analysis_type=analysis_type)
+            if dl.skipped and isinstance(result, dict):
+                result["partial"] = True
+                result["skipped_stages"] = dl.skipped
+        record = {"id": item_id, "result": result}
+    except Exception as e:
+        record = {"id": item_id, "error": f"{type(e).__name__}: {e}"}
+    record["elapsed"] = round(time.perf_counter() - started, 4)
+    return record
+
+
+class Progress:
+    """Prints processed count and items/sec (overall and recent) at an interval."""
+
+    def __init__(self, interval, skipped):
+        self.interval = interval
+        self.skipped = skipped
+        self.done = 0
+        self.errors = 0
+        self.started = self.last_time = time.time()
+        self.last_done = 0
+
+    def update(self, record):
+        self.done += 1
+        if "error" in record:
+            self.errors += 1
+        now = time.time()
+        if now - self.last_time >= self.interval:
+            self.report(now)
+
+    def report(self, now=None, final=False):
+        now = now or time.time()
+        overall = self.done / max(now - self.started, 1e-9)
+        recent = (self.done - self.last_done) / max(now - self.last_time, 1e-9)
+        label = "finished" if final else "progress"
+        print(
+            f"[{label}] {self.done} processed ({self.errors} errors, {self.skipped} resumed) "
+            f"{overall:.1f} items/s overall, {recent:.1f} items/s recent",
+            file=sys.stderr, flush=True,
+        )
+        self.last_time, self.last_done = now, self.done
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Bulk-analyze a JSONL/CSV archive with TrueVail")
+    parser.add_argument("input", help="JSONL or CSV file (fields: id, text/url/content, type)")
+    parser.add_argument("-o", "--output", required=True, help="JSONL results; also the resume checkpoint")
+    parser.add_argument("--mode", choices=("local", "full"), default="local")
+    parser.add_argument("--processes", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--id-field", default="id")
+    parser.add_argument("--text-field", help=f"input field to analyze (default: first of {', '.join(DEFAULT_TEXT_FIELDS)})")
+    parser.add_argument("--type-field", default="type")
+    parser.add_argument("--budget", type=float, default=60.0, help="per-item deadline in seconds (full mode)")
+    parser.add_argument("--max-pending", type=int, default=0, help="items queued ahead of the pool (default 4 x processes)")
+    parser.add_argument("--checkpoint-every", type=int, default=100, help="fsync the output every N items")
+    parser.add_argument("--report-seconds", type=float, default=5.0)
+    for upstream, default in zip(UPSTREAMS, (2, 4, 2, 8)):
+        parser.add_argument(f"--{upstream}-concurrency", type=int, default=default,
+                            help=f"max simultaneous {upstream} calls across all processes (default {default})")
+    args = parser.parse_args(argv)
+
+    done = load_checkpoint(args.output)
+    if done:
+        print(f"Resuming: {len(done)} items already in {args.output}", file=sys.stderr)
+
+    # Bounds how far reading runs ahead of the pool, so huge archives stream
+    pending = threading.BoundedSemaphore(args.max_pending or 4 * args.processes)
+
+    def items():
+        for item in read_items(args.input, args.id_field, args.text_field, args.type_field):
+            if item[0] in done:
+                continue
+            pending.acquire()
+            yield item
+
+    semaphores = {
+        upstream: multiprocessing.BoundedSemaphore(max(1, getattr(args, f"{upstream}_concurrency")))
+        for upstream in UPSTREAMS
+    }
+    progress = Progress(args.report_seconds, len(done))
+    terminate_partial_line(args.output)
+    with open(args.output, "a", encoding="utf-8") as out:
+        with multiprocessing.Pool(args.processes, initializer=_init_worker,
+                                  initargs=(args.mode, args.budget, semaphores)) as pool:
+            for record in pool.imap_unordered(analyze_item, items()):
+                pending.release()
+                out.write(json.dumps(record) + "\n")
+                out.flush()
+                progress.update(record)
+                if progress.done % args.checkpoint_every == 0:
+                    os.fsync(out.fileno())
+        os.fsync(out.fileno())
+    progress.report(final=True)
+    return 1 if progress.errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
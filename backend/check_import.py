@@ -1,2 +1,86 @@
-import analyzer
-print("Import successful")
+"""
+Import-time budget check for the serving modules.
+
+Imports each module in a fresh interpreter with outbound sockets disabled and
+fails (exit status 1) when:
+    - the import takes longer than IMPORT_BUDGET_SECONDS (default 1.5),
+    - it opens a network connection, or
+    - it pulls in a heavy dependency that should only load on first use.
+
+Usage (from backend/):
+    python check_import.py                 # analyzer and app
+    python check_import.py asgi_app        # any module list
+"""
+import os
+import sys
+import json
+import subprocess
+
+IMPORT_BUDGET_SECONDS = float(os.getenv("IMPORT_BUDGET_SECONDS", "1.5"))
+DEFAULT_MODULES = ["analyzer", "app"]
+# Loaded lazily by fake_news_detection / analyzer; importing them eagerly is a regression
+LAZY_MODULES = ["sklearn", "nltk", "pandas", "joblib", "google.generativeai", "google.genai"]
+
+_CHILD = r"""
+import json, socket, sys, time
+
+def _no_network(*args, **kwargs):
+    raise RuntimeError("network access during import: %r" % (args,))
+
+socket.socket.connect = _no_network
+socket.socket.connect_ex = _no_network
+socket.create_connection = _no_network
+socket.getaddrinfo = _no_network
+
+started = time.perf_counter()
+error = None
+try:
+    __import__(sys.argv[1])
+except Exception as e:
+    error = "%s: %s" % (type(e).__name__, e)
+elapsed = time.perf_counter() - started
+print(json.dumps({
+    "seconds": elapsed,
+    "error": error,
+    "loaded": [name for name in json.loads(sys.argv[2]) if name in sys.modules],
+}))
+"""
+
+
+def check(module):
+    """Imports module in a child interpreter; returns a list of failure messages."""
+    here = os.path.dirname(os.path.abspath(__file__))
+    env = dict(os.environ, LOG_LEVEL="ERROR")
+    completed = subprocess.run(
+        [sys.executable, "-c", _CHILD, module, json.dumps(LAZY_MODULES)],
+        cwd=here, env=env, capture_output=True, text=True,
+    )
+    try:
+        report = json.loads(completed.stdout.strip().splitlines()[-1])
+    except (IndexError, ValueError):
+        return [f"{module}: import check crashed: {completed.stderr.strip()[-500:]}"]
+
+    failures = []
+    if report["error"]:
+        failures.append(f"{module}: import failed: {report['error']}")
+    if report["seconds"] > IMPORT_BUDGET_SECONDS:
+        failures.append(f"{module}: import took {report['seconds']:.2f}s (budget {IMPORT_BUDGET_SECONDS:.2f}s)")
+    if report["loaded"]:
+        failures.append(f"{module}: eagerly imported {', '.join(report['loaded'])}")
+    print(f"{module:20s} {report['seconds']:.3f}s")
+    return failures
+
+
+def main(modules):
+    failures = []
+    for module in modules:
+        failures.extend(check(module))
+    for failure in failures:
+        print(f"FAIL {failure}")
+    if not failures:
+        print("Import successful")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:] or DEFAULT_MODULES))
@@ -0,0 +1,284 @@
+"""
+Compact, memory-mapped form of the trained FakeNewsDetector.
+
+The sklearn detector keeps its vocabulary as a Python dict of strings and its
+weights as float64 arrays, and every worker process trains (or unpickles) its
+own copy, importing sklearn and NLTK on the way. export() flattens a trained
+detector into one file:
+
+    header      magic, version and a JSON table of contents
+    vocabulary  64-bit hashes of every uni-/bigram, sorted (uint64)
+    idf, coef   float32 weights in the same order as the hashes
+    stop words  the preprocessing and vectorizer stop-word lists
+    stems       sorted hashes of surface words + offsets into a blob of stems
+
+CompactModel maps the file read-only, so every worker on a host shares the
+same physical pages, and needs neither sklearn nor NLTK: a word or term is
+looked up with a binary search over its hash array, and the matched rows are
+scored by fake_news_detection.linear_decision, the same core as the trained
+detector's CompiledModel. Words missing from the stem table are stemmed with
+NLTK's Porter stemmer (imported on first need); export with --words to cover
+more of the language up front.
+
+The weights are never copied: a text's matched rows are gathered from the
+mapped idf/coef arrays. Hashing and binary searches cost several times a dict
+lookup, so each process also remembers the stems and rows of its most common
+words and terms, up to COMPACT_CACHE_ENTRIES of each (0 turns the caches off).
+The caches are private to each process, unlike the mapped file, so they are
+kept small.
+
+    python compact_model.py export                    # train and write COMPACT_MODEL_PATH
+    python compact_model.py export --words corpus.txt -o /srv/models/fake_news.tvm
+
+get_fake_news_detector() loads COMPACT_MODEL_PATH when the file exists.
+"""
+import os
+import sys
+import json
+import mmap
+import struct
+import hashlib
+import argparse
+import threading
+
+import debug_log
+from fake_news_detection import clean_tokens, linear_decision, ngram_terms, prediction_result, sigmoid
+
+logger = debug_log.get_logger("compact_model")
+
+COMPACT_MODEL_PATH = os.getenv(
+    "COMPACT_MODEL_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "models", "fake_news.tvm"),
+)
+
+MAGIC = b"TVCM"
+VERSION = 1
+# magic, version, length of the JSON table of contents
+_PREAMBLE = struct.Struct("<4sII")
+ALIGNMENT = 8
+# Stems and vocabulary rows each process remembers
+COMPACT_CACHE_ENTRIES = int(os.getenv("COMPACT_CACHE_ENTRIES", "10000"))
+
+
+def term_hash(term):
+    """Stable 64-bit hash of a term (Python's hash() differs between processes)."""
+    return int.from_bytes(hashlib.blake2b(term.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+def _sorted_hashes(terms):
+    import numpy as np
+
+    hashes = np.fromiter((term_hash(term) for term in terms), dtype=np.uint64, count=len(terms))
+    order = np.argsort(hashes, kind="stable")
+    hashes = hashes[order]
+    if len(hashes) > 1 and (hashes[1:] == hashes[:-1]).any():
+        raise ValueError("term hash collision; the vocabulary cannot be stored compactly")
+    return hashes, order
+
+
+def export(detector, path=COMPACT_MODEL_PATH, extra_words=()):
+    """Writes a trained FakeNewsDetector to path in the compact format."""
+    import numpy as np
+
+    if not detector.is_trained:
+        raise ValueError("the detector must be trained before it is exported")
+    if list(detector.model.classes_) != [0, 1]:
+        raise ValueError(f"expected classes [0, 1], got {list(detector.model.classes_)}")
+    vectorizer = detector.vectorizer
+    if vectorizer.sublinear_tf or vectorizer.norm != "l2" or not vectorizer.use_idf:
+        raise ValueError("only l2-normalized, non-sublinear TF-IDF is supported")
+
+    # Stem every extra word too, so it is in the table
+    for text in extra_words:
+        detector.preprocess_text(text)
+
+    terms = [None] * len(vectorizer.vocabulary_)
+    for term, column in vectorizer.vocabulary_.items():
+        terms[column] = term
+    vocab_hashes, order = _sorted_hashes(terms)
+    idf = vectorizer.idf_[order].astype(np.float32)
+    coef = detector.model.coef_[0][order].astype(np.float32)
+
+    surface = sorted(detector.stems)
+    stem_hashes, stem_order = _sorted_hashes(surface)
+    stems = [detector.stems[surface[i]].encode("utf-8") for i in stem_order]
+    stem_offsets = np.zeros(len(stems) + 1, dtype=np.uint32)
+    stem_offsets[1:] = np.cumsum([len(stem) for stem in stems])
+
+    vector_stop_words = vectorizer.get_stop_words() or ()
+    sections = {
+        "vocab_hashes": vocab_hashes,
+        "idf": idf,
+        "coef": coef,
+        "stem_hashes": stem_hashes,
+        "stem_offsets": stem_offsets,
+        "stem_blob": np.frombuffer(b"".join(stems), dtype=np.uint8),
+        "stop_words": np.frombuffer("\n".join(sorted(detector.stop_words)).encode("utf-8"), dtype=np.uint8),
+        "vector_stop_words": np.frombuffer("\n".join(sorted(vector_stop_words)).encode("utf-8"), dtype=np.uint8),
+    }
+    contents = {
+        "intercept": float(detector.model.intercept_[0]),
+        "ngram_range": list(vectorizer.ngram_range),
+        "sections": {},
+    }
+    # Offsets are relative to the end of the header, which depends on the table of contents length
+    offset = 0
+    for name, array in sections.items():
+        contents["sections"][name] = [offset, array.dtype.str, len(array)]
+        offset += -(-array.nbytes // ALIGNMENT) * ALIGNMENT
+
+    toc = json.dumps(contents).encode("utf-8")
+    header_length = -(-(_PREAMBLE.size + len(toc)) // ALIGNMENT) * ALIGNMENT
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(_PREAMBLE.pack(MAGIC, VERSION, len(toc)) + toc)
+        f.write(b"\0" * (header_length - _PREAMBLE.size - len(toc)))
+        for array in sections.values():
+            data = array.tobytes()
+            f.write(data + b"\0" * (-len(data) % ALIGNMENT))
+    # Readers keep mapping the old file until they reload; replacing is atomic
+    os.replace(tmp_path, path)
+    return path
+
+
+def _find(hashes, value):
+    """Position of value in the sorted hash array, or None."""
+    position = int(hashes.searchsorted(hashes.dtype.type(value)))
+    if position < len(hashes) and int(hashes[position]) == value:
+        return position
+    return None
+
+
+class CompactModel:
+    """Read-only detector backed by a memory-mapped compact model file; same predict API."""
+
+    is_trained = True
+
+    def __init__(self, path=COMPACT_MODEL_PATH):
+        import numpy as np
+
+        self.path = path
+        with open(path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, toc_length = _PREAMBLE.unpack_from(self._map, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path} is not a version {VERSION} compact model")
+        contents = json.loads(self._map[_PREAMBLE.size:_PREAMBLE.size + toc_length])
+        base = -(-(_PREAMBLE.size + toc_length) // ALIGNMENT) * ALIGNMENT
+        arrays = {
+            name: np.frombuffer(self._map, dtype=np.dtype(dtype), count=count, offset=base + offset)
+            for name, (offset, dtype, count) in contents["sections"].items()
+        }
+        self.vocab_hashes = arrays["vocab_hashes"]
+        self.idf = arrays["idf"]
+        self.coef = arrays["coef"]
+        self.stem_hashes = arrays["stem_hashes"]
+        self.stem_offsets = arrays["stem_offsets"]
+        self.stem_blob = arrays["stem_blob"]
+        # Small, and checked per token: kept as Python sets
+        self.stop_words = frozenset(arrays["stop_words"].tobytes().decode("utf-8").split("\n")) - {""}
+        self.vector_stop_words = frozenset(arrays["vector_stop_words"].tobytes().decode("utf-8").split("\n")) - {""}
+        self.intercept = contents["intercept"]
+        self.ngram_range = tuple(contents["ngram_range"])
+        self._stemmer = None
+        self._stemmer_lock = threading.Lock()
+        # Per process: the lookups done so far
+        self._stems = {}
+        self._rows = {}
+
+    def _stem_missing(self, token):
+        if self._stemmer is None:
+            with self._stemmer_lock:
+                if self._stemmer is None:
+                    from nltk.stem.porter import PorterStemmer
+                    self._stemmer = PorterStemmer()
+        return self._stemmer.stem(token)
+
+    def stem(self, token):
+        """The exported stem of token, else NLTK's."""
+        stem = self._stems.get(token)
+        if stem is not None:
+            return stem
+        position = _find(self.stem_hashes, term_hash(token))
+        if position is None:
+            stem = self._stem_missing(token)
+        else:
+            start, end = self.stem_offsets[position], self.stem_offsets[position + 1]
+            stem = self.stem_blob[start:end].tobytes().decode("utf-8")
+        if len(self._stems) < COMPACT_CACHE_ENTRIES:
+            self._stems[token] = stem
+        return stem
+
+    def stem_tokens(self, tokens):
+        return [self.stem(token) for token in tokens]
+
+    def row(self, term):
+        """Row of term in the weight arrays, or None when it is not in the vocabulary."""
+        try:
+            return self._rows[term]
+        except KeyError:
+            pass
+        row = _find(self.vocab_hashes, term_hash(term))
+        if len(self._rows) < COMPACT_CACHE_ENTRIES:
+            self._rows[term] = row
+        return row
+
+    def terms(self, text):
+        """The uni-/bigrams the TF-IDF vectorizer would extract from text."""
+        tokens = [
+            stem for stem in self.stem_tokens(clean_tokens(text, self.stop_words))
+            if len(stem) > 1 and stem not in self.vector_stop_words
+        ]
+        return ngram_terms(tokens, self.ngram_range)
+
+    def decision(self, text):
+        """Logistic regression decision value (log-odds of real) for text."""
+        counts = {}
+        for term in self.terms(text):
+            row = self.row(term)
+            if row is not None:
+                counts[row] = counts.get(row, 0) + 1
+        if not counts:
+            return self.intercept
+        # Only the matched rows leave the mapped file, as Python floats
+        rows = list(counts)
+        idf = self.idf[rows].tolist()
+        coef = self.coef[rows].tolist()
+        return linear_decision(dict(enumerate(counts.values())), coef, self.intercept, idf)
+
+    def predict(self, text):
+        return self.predict_batch([text])[0]
+
+    def predict_batch(self, texts):
+        results = []
+        for text in texts:
+            decision = self.decision(text)
+            real = sigmoid(decision)
+            results.append(prediction_result(1 if decision > 0 else 0, [1 - real, real]))
+        return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export the fake news detector in the compact mmap format")
+    parser.add_argument("command", choices=("export",))
+    parser.add_argument("-o", "--output", default=COMPACT_MODEL_PATH)
+    parser.add_argument("--words", help="text file whose words are added to the stem table")
+    args = parser.parse_args(argv)
+
+    from fake_news_detection import FakeNewsDetector
+
+    detector = FakeNewsDetector().train()
+    extra = []
+    if args.words:
+        with open(args.words, encoding="utf-8") as f:
+            extra = f.readlines()
+    export(detector, args.output, extra)
+    model = CompactModel(args.output)
+    print(f"Wrote {args.output}: {len(model.vocab_hashes)} terms, {len(model.stem_hashes)} stems, "
+          f"{os.path.getsize(args.output)} bytes")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
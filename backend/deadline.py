@@ -0,0 +1,191 @@
+"""
+Request deadline budget for TrueVail analyses.
+
+The Flask layer opens a deadline for every /analyze call and each outbound hop
+(page fetch, search, Gemini, Ollama) asks this module how long it may wait and
+how many attempts it can still afford. Timeouts are derived from the remaining
+budget and from the latency we have recently observed for that host, so a slow
+upstream cannot hold a worker for longer than the request is allowed to live.
+"""
+import os
+import time
+import threading
+import contextvars
+from collections import deque
+from contextlib import contextmanager
+
+# Total wall-clock budget for one analysis request (seconds)
+REQUEST_BUDGET_SECONDS = float(os.getenv("REQUEST_BUDGET_SECONDS", "25"))
+# Upper bound a client may ask for through the X-Request-Budget header
+MAX_REQUEST_BUDGET_SECONDS = float(os.getenv("MAX_REQUEST_BUDGET_SECONDS", "60"))
+# Below this many seconds a hop is not worth starting at all
+MIN_HOP_SECONDS = float(os.getenv("MIN_HOP_SECONDS", "0.5"))
+# Timeouts are set to this multiple of the host's observed p95 latency
+LATENCY_TIMEOUT_FACTOR = 2.0
+LATENCY_WINDOW = 50
+
+
+class Deadline:
+    """A fixed point in time by which the current request must be answered."""
+
+    def __init__(self, budget):
+        self.budget = budget
+        self.started_at = time.monotonic()
+        self.expires_at = self.started_at + budget
+        self.skipped = []
+
+    def remaining(self):
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def elapsed(self):
+        return time.monotonic() - self.started_at
+
+    def expired(self):
+        return self.remaining() < MIN_HOP_SECONDS
+
+    def mark_skipped(self, stage):
+        """Record that a stage was skipped or cut short to stay within budget."""
+        if stage not in self.skipped:
+            self.skipped.append(stage)
+
+
+_current = contextvars.ContextVar("truevail_deadline", default=None)
+
+
+def parse_budget(value):
+    """Turns an X-Request-Budget header value into a clamped budget in seconds."""
+    try:
+        budget = float(value)
+    except (TypeError, ValueError):
+        return REQUEST_BUDGET_SECONDS
+    if budget <= 0:
+        return REQUEST_BUDGET_SECONDS
+    return min(budget, MAX_REQUEST_BUDGET_SECONDS)
+
+
+@contextmanager
+def request_deadline(budget=None):
+    """Opens a deadline for the duration of the block and yields it."""
+    deadline = Deadline(budget if budget is not None else REQUEST_BUDGET_SECONDS)
+    token = _current.set(deadline)
+    try:
+        yield deadline
+    finally:
+        _current.reset(token)
+
+
+def current():
+    """Returns the active Deadline, or None when called outside a request."""
+    return _current.get()
+
+
+def remaining():
+    """Seconds left in the current request, or None when there is no deadline."""
+    deadline = _current.get()
+    return deadline.remaining() if deadline else None
+
+
+def expired():
+    deadline = _current.get()
+    return bool(deadline and deadline.expired())
+
+
+def mark_skipped(stage):
+    deadline = _current.get()
+    if deadline:
+        deadline.mark_skipped(stage)
+
+
+class _HostLatency:
+    """Sliding window of recent call durations for one upstream host."""
+
+    def __init__(self):
+        self.samples = deque(maxlen=LATENCY_WINDOW)
+        self.lock = threading.Lock()
+
+    def record(self, seconds):
+        with self.lock:
+            self.samples.append(seconds)
+
+    def percentile(self, q):
+        with self.lock:
+            if not self.samples:
+                return None
+            ordered = sorted(self.samples)
+        index = min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))
+        return ordered[index]
+
+
+_latencies = {}
+_latencies_lock = threading.Lock()
+
+
+def _host_latency(host):
+    stats = _latencies.get(host)
+    if stats is None:
+        with _latencies_lock:
+            stats = _latencies.setdefault(host, _HostLatency())
+    return stats
+
+
+def record_latency(host, seconds):
+    """Feeds an observed call duration (success or timeout) for a host."""
+    _host_latency(host).record(seconds)
+
+
+def latency_percentile(host, q):
+    return _host_latency(host).percentile(q)
+
+
+def hop_timeout(host, default):
+    """
+    Timeout for a single attempt against host.
+
+    Starts from the caller's default, tightens it to a multiple of the host's
+    observed p95 once we have samples, and never exceeds what is left of the
+    request budget. Returns 0 when the budget is already spent.
+    """
+    timeout = default
+    p95 = latency_percentile(host, 0.95)
+    if p95 is not None:
+        timeout = min(default, max(MIN_HOP_SECONDS * 2, p95 * LATENCY_TIMEOUT_FACTOR))
+
+    left = remaining()
+    if left is None:
+        return timeout
+    if left < MIN_HOP_SECONDS:
+        return 0
+    return min(timeout, left)
+
+
+def hop_attempts(host, default_attempts, default_timeout):
+    """
+    How many attempts against host still fit in the remaining budget.
+
+    Uses the host's median latency (or the default timeout when we have not
+    seen it yet) as the expected cost of one attempt.
+    """
+    left = remaining()
+    if left is None:
+        return default_attempts
+    if left < MIN_HOP_SECONDS:
+        return 0
+    expected = latency_percentile(host, 0.5) or default_timeout
+    fits = int(left // max(expected, MIN_HOP_SECONDS))
+    return max(1, min(default_attempts, fits))
+
+
+def can_afford(*hosts_and_defaults):
+    """
+    True when the remaining budget covers the typical latency of every hop.
+
+    Takes (host, default_seconds) pairs so callers can decide up front whether
+    an optional stage such as search enrichment is worth starting.
+    """
+    left = remaining()
+    if left is None:
+        return True
+    needed = 0.0
+    for host, default in hosts_and_defaults:
+        needed += latency_percentile(host, 0.5) or default
+    return left >= needed
@@ -0,0 +1,185 @@
+"""
+Structured, non-blocking logging for the TrueVail backend.
+
+Request threads only pay for an in-memory enqueue: records go onto a bounded
+queue and a single background listener formats them as JSON lines, writes
+them to a size-rotated debug file and echoes them to stderr. Low-value levels
+can be sampled and long payloads (prompts, model responses) are truncated.
+
+Configuration (environment variables):
+    LOG_LEVEL            console level (default INFO)
+    AI_DEBUG_LOG         debug file path (default ai_debug_output.txt)
+    AI_DEBUG_LOG_LEVEL   debug file level (default DEBUG)
+    LOG_MAX_BYTES        rotate the debug file at this size (default 5 MB)
+    LOG_BACKUP_COUNT     rotated files to keep (default 3)
+    LOG_SAMPLE_RATES     per-level keep ratio, e.g. "DEBUG=0.1,INFO=0.5"
+    LOG_MAX_FIELD_CHARS  truncate messages and fields to this length (default 500)
+    LOG_QUEUE_SIZE       records buffered before new ones are dropped (default 10000)
+"""
+import os
+import json
+import time
+import queue
+import atexit
+import random
+import logging
+import threading
+import logging.handlers
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+AI_DEBUG_LOG = os.getenv("AI_DEBUG_LOG", "ai_debug_output.txt")
+AI_DEBUG_LOG_LEVEL = os.getenv("AI_DEBUG_LOG_LEVEL", "DEBUG").upper()
+LOG_MAX_BYTES = int(os.getenv("LOG_MAX_BYTES", str(5 * 1024 * 1024)))
+LOG_BACKUP_COUNT = int(os.getenv("LOG_BACKUP_COUNT", "3"))
+LOG_SAMPLE_RATES = os.getenv("LOG_SAMPLE_RATES", "")
+LOG_MAX_FIELD_CHARS = int(os.getenv("LOG_MAX_FIELD_CHARS", "500"))
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+
+ROOT_LOGGER = "truevail"
+
+# Attributes every LogRecord has; anything else was passed through `extra=`
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+
+def _parse_sample_rates(spec):
+    rates = {}
+    for part in spec.split(","):
+        if "=" not in part:
+            continue
+        level, rate = part.split("=", 1)
+        try:
+            rates[logging.getLevelName(level.strip().upper())] = max(0.0, min(1.0, float(rate)))
+        except ValueError:
+            continue
+    return rates
+
+
+def _truncate(value):
+    if isinstance(value, (bytes, bytearray)):
+        return f"<{len(value)} bytes>"
+    if not isinstance(value, (str, int, float, bool)) and value is not None:
+        value = str(value)
+    if isinstance(value, str) and len(value) > LOG_MAX_FIELD_CHARS:
+        return value[:LOG_MAX_FIELD_CHARS] + f"...[+{len(value) - LOG_MAX_FIELD_CHARS} chars]"
+    return value
+
+
+class SamplingFilter(logging.Filter):
+    """Keeps each record with the probability configured for its level."""
+
+    def __init__(self, rates):
+        super().__init__()
+        self.rates = rates
+
+    def filter(self, record):
+        rate = self.rates.get(record.levelno)
+        return rate is None or rate >= 1.0 or random.random() < rate
+
+
+class JsonLineFormatter(logging.Formatter):
+    """One JSON object per record: timestamp, level, logger, message and extra fields."""
+
+    def format(self, record):
+        entry = {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(record.created)) + f".{int(record.msecs):03d}",
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": _truncate(record.getMessage()),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS and not key.startswith("_"):
+                entry[key] = _truncate(value)
+        if record.exc_info:
+            entry["exc"] = _truncate(self.formatException(record.exc_info))
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """
+    Enqueues the raw record without formatting it on the calling thread.
+
+    When the listener falls behind and the queue is full the record is
+    dropped and counted instead of blocking the request.
+    """
+
+    dropped = 0
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            DroppingQueueHandler.dropped += 1
+
+
+_listener = None
+_configure_lock = threading.Lock()
+
+
+def configure():
+    """Installs the queue handler and starts the background writer (idempotent)."""
+    global _listener
+    if _listener is not None:
+        return
+    with _configure_lock:
+        if _listener is not None:
+            return
+
+        formatter = JsonLineFormatter()
+        console = logging.StreamHandler()
+        console.setLevel(LOG_LEVEL)
+        console.setFormatter(formatter)
+        handlers = [console]
+        try:
+            debug_file = logging.handlers.RotatingFileHandler(
+                AI_DEBUG_LOG, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT,
+                encoding="utf-8", delay=True
+            )
+            debug_file.setLevel(AI_DEBUG_LOG_LEVEL)
+            debug_file.setFormatter(formatter)
+            handlers.append(debug_file)
+        except OSError:
+            pass
+
+        log_queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+        queue_handler = DroppingQueueHandler(log_queue)
+        rates = _parse_sample_rates(LOG_SAMPLE_RATES)
+        if rates:
+            queue_handler.addFilter(SamplingFilter(rates))
+
+        root = logging.getLogger(ROOT_LOGGER)
+        root.addHandler(queue_handler)
+        root.setLevel(min(h.level for h in handlers))
+        root.propagate = False
+
+        _listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+        _listener.start()
+        atexit.register(shutdown)
+        if hasattr(os, "register_at_fork"):
+            # Threads do not survive fork (gunicorn --preload): give each child its own writer
+            os.register_at_fork(after_in_child=_restart_in_child)
+
+
+def _restart_in_child():
+    global _listener
+    if _listener is not None:
+        _listener = logging.handlers.QueueListener(
+            _listener.queue, *_listener.handlers, respect_handler_level=True
+        )
+        _listener.start()
+
+
+def shutdown():
+    """Flushes queued records and stops the writer thread."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def get_logger(name):
+    """Returns a logger under the truevail namespace, configuring logging on first use."""
+    configure()
+    return logging.getLogger(f"{ROOT_LOGGER}.{name}")
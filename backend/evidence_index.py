@@ -0,0 +1,270 @@
+"""
+Local evidence index: BM25 over every page fetch_url_content has extracted.
+
+Claims about the same event come in again and again, and each one used to
+trigger a live DuckDuckGo search plus a page fetch. Extracted pages are now
+added to an inverted index in SQLite (EVIDENCE_DB), and the Ollama news path
+asks it for reference material first; the web is only searched when local
+recall is low, i.e. no page covers at least EVIDENCE_MIN_COVERAGE of the query
+terms.
+
+Ranking is Okapi BM25 multiplied by an exponential time decay with a half-life
+of EVIDENCE_HALF_LIFE_HOURS, so fresh reporting outranks stale pages on the
+same topic. Updates are incremental: pages are queued and written by one
+background thread per process (re-adding a URL replaces its postings), and
+pages older than EVIDENCE_MAX_AGE_DAYS are pruned.
+"""
+import os
+import re
+import math
+import time
+import queue
+import sqlite3
+import threading
+from collections import Counter
+
+import debug_log
+import metrics
+from fake_news_detection import load_stop_words
+
+logger = debug_log.get_logger("evidence_index")
+
+EVIDENCE_ENABLED = os.getenv("EVIDENCE_ENABLED", "1") != "0"
+EVIDENCE_DB = os.getenv("EVIDENCE_DB", "evidence.db")
+EVIDENCE_HALF_LIFE_HOURS = float(os.getenv("EVIDENCE_HALF_LIFE_HOURS", "72"))
+EVIDENCE_MAX_AGE_DAYS = float(os.getenv("EVIDENCE_MAX_AGE_DAYS", "30"))
+EVIDENCE_MIN_COVERAGE = float(os.getenv("EVIDENCE_MIN_COVERAGE", "0.6"))
+EVIDENCE_MAX_CHARS = int(os.getenv("EVIDENCE_MAX_CHARS", "20000"))
+EVIDENCE_QUEUE_SIZE = 1000
+PRUNE_EVERY = 500
+
+# Okapi BM25 parameters
+K1 = 1.2
+B = 0.75
+
+_WORD_RE = re.compile(r"[a-z0-9]+")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS docs (
+    id INTEGER PRIMARY KEY,
+    url TEXT UNIQUE NOT NULL,
+    content TEXT NOT NULL,
+    length INTEGER NOT NULL,
+    added_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS terms (term TEXT PRIMARY KEY, df INTEGER NOT NULL) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS postings (
+    term TEXT NOT NULL,
+    doc_id INTEGER NOT NULL,
+    tf INTEGER NOT NULL,
+    PRIMARY KEY (term, doc_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS postings_doc ON postings (doc_id);
+CREATE INDEX IF NOT EXISTS docs_added ON docs (added_at);
+CREATE TABLE IF NOT EXISTS stats (key TEXT PRIMARY KEY, value REAL NOT NULL) WITHOUT ROWID;
+"""
+
+_local = threading.local()
+_queue = queue.Queue(maxsize=EVIDENCE_QUEUE_SIZE)
+_writer_lock = threading.Lock()
+_writer_pid = None
+
+
+def tokenize(text):
+    stop_words = load_stop_words()
+    return [token for token in _WORD_RE.findall(text.lower()) if len(token) > 1 and token not in stop_words]
+
+
+def _connect():
+    conn = getattr(_local, "conn", None)
+    if conn is not None and _local.pid == os.getpid():
+        return conn
+    conn = sqlite3.connect(EVIDENCE_DB, timeout=10, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.executescript(_SCHEMA)
+    _local.conn = conn
+    _local.pid = os.getpid()
+    return conn
+
+
+def _stat(conn, key):
+    row = conn.execute("SELECT value FROM stats WHERE key = ?", (key,)).fetchone()
+    return row[0] if row else 0.0
+
+
+def _bump_stats(conn, docs, length):
+    conn.execute(
+        "INSERT INTO stats (key, value) VALUES ('docs', ?), ('total_length', ?)"
+        " ON CONFLICT(key) DO UPDATE SET value = value + excluded.value",
+        (docs, length),
+    )
+
+
+def _delete_doc(conn, doc_id, length):
+    conn.execute(
+        "UPDATE terms SET df = df - 1 WHERE term IN (SELECT term FROM postings WHERE doc_id = ?)",
+        (doc_id,),
+    )
+    conn.execute("DELETE FROM postings WHERE doc_id = ?", (doc_id,))
+    conn.execute("DELETE FROM docs WHERE id = ?", (doc_id,))
+    _bump_stats(conn, -1, -length)
+
+
+def add_document(url, content, added_at=None):
+    """Indexes (or re-indexes) one page synchronously."""
+    content = (content or "")[:EVIDENCE_MAX_CHARS]
+    counts = Counter(tokenize(content))
+    if not counts:
+        return
+    length = sum(counts.values())
+    conn = _connect()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        existing = conn.execute("SELECT id, length FROM docs WHERE url = ?", (url,)).fetchone()
+        if existing:
+            _delete_doc(conn, existing[0], existing[1])
+        doc_id = conn.execute(
+            "INSERT INTO docs (url, content, length, added_at) VALUES (?, ?, ?, ?)",
+            (url, content, length, added_at or time.time()),
+        ).lastrowid
+        conn.executemany("INSERT INTO postings (term, doc_id, tf) VALUES (?, ?, ?)",
+                         [(term, doc_id, tf) for term, tf in counts.items()])
+        conn.executemany("INSERT INTO terms (term, df) VALUES (?, 1) ON CONFLICT(term) DO UPDATE SET df = df + 1",
+                         [(term,) for term in counts])
+        _bump_stats(conn, 1, length)
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+
+
+def prune(max_age_days=EVIDENCE_MAX_AGE_DAYS):
+    """Removes pages older than max_age_days; returns how many were removed."""
+    conn = _connect()
+    cutoff = time.time() - max_age_days * 86400
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        stale = conn.execute("SELECT id, length FROM docs WHERE added_at < ?", (cutoff,)).fetchall()
+        for doc_id, length in stale:
+            _delete_doc(conn, doc_id, length)
+        conn.execute("DELETE FROM terms WHERE df <= 0")
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    return len(stale)
+
+
+def search(query, limit=3, exclude_url=None, now=None):
+    """
+    Returns up to limit pages ranked by time-decayed BM25, best first, each as
+    {"url", "content", "score", "coverage", "age_hours"}.
+    """
+    terms = sorted(set(tokenize(query)))
+    if not terms:
+        return []
+    conn = _connect()
+    n_docs = _stat(conn, "docs")
+    if n_docs <= 0:
+        return []
+    avg_length = _stat(conn, "total_length") / n_docs
+    placeholders = ",".join("?" * len(terms))
+    idf = {}
+    for term, df in conn.execute(f"SELECT term, df FROM terms WHERE term IN ({placeholders})", terms):
+        if df > 0:
+            idf[term] = max(0.0, math.log(1 + (n_docs - df + 0.5) / (df + 0.5)))
+    if not idf:
+        return []
+
+    found = list(idf)
+    rows = conn.execute(
+        f"SELECT p.doc_id, p.term, p.tf, d.length FROM postings p JOIN docs d ON d.id = p.doc_id"
+        f" WHERE p.term IN ({','.join('?' * len(found))})",
+        found,
+    ).fetchall()
+    scores = {}
+    matched = {}
+    for doc_id, term, tf, length in rows:
+        norm = tf * (K1 + 1) / (tf + K1 * (1 - B + B * length / avg_length))
+        scores[doc_id] = scores.get(doc_id, 0.0) + idf[term] * norm
+        matched[doc_id] = matched.get(doc_id, 0) + 1
+    if not scores:
+        return []
+
+    # Time decay needs added_at; only look up the strongest BM25 candidates
+    candidates = sorted(scores, key=scores.get, reverse=True)[:max(limit * 10, 20)]
+    now = now or time.time()
+    half_life = EVIDENCE_HALF_LIFE_HOURS * 3600
+    results = []
+    placeholders = ",".join("?" * len(candidates))
+    for doc_id, url, content, added_at in conn.execute(
+        f"SELECT id, url, content, added_at FROM docs WHERE id IN ({placeholders})", candidates
+    ):
+        if url == exclude_url:
+            continue
+        age = max(0.0, now - added_at)
+        results.append({
+            "url": url,
+            "content": content,
+            "score": scores[doc_id] * 0.5 ** (age / half_life),
+            "coverage": matched[doc_id] / len(terms),
+            "age_hours": round(age / 3600, 1),
+        })
+    results.sort(key=lambda result: result["score"], reverse=True)
+    return results[:limit]
+
+
+def find_evidence(query, exclude_url=None):
+    """
+    The best local page for query when local recall is good enough (it covers
+    at least EVIDENCE_MIN_COVERAGE of the query terms), else None.
+    """
+    if not EVIDENCE_ENABLED:
+        return None
+    try:
+        with metrics.stage("evidence_lookup"):
+            results = search(query, limit=5, exclude_url=exclude_url)
+    except sqlite3.Error as e:
+        logger.warning("Evidence index lookup failed: %s", e)
+        return None
+    for result in results:
+        if result["coverage"] >= EVIDENCE_MIN_COVERAGE:
+            metrics.record_cache("evidence", True)
+            return result
+    metrics.record_cache("evidence", False)
+    return None
+
+
+def _writer_loop():
+    added = 0
+    while True:
+        url, content, added_at = _queue.get()
+        try:
+            add_document(url, content, added_at)
+            added += 1
+            if added % PRUNE_EVERY == 0:
+                prune()
+        except Exception as e:
+            logger.warning("Could not index %s: %s", url, e)
+
+
+def _ensure_writer():
+    global _writer_pid
+    if _writer_pid == os.getpid():
+        return
+    with _writer_lock:
+        if _writer_pid != os.getpid():
+            threading.Thread(target=_writer_loop, name="evidence-index-writer", daemon=True).start()
+            _writer_pid = os.getpid()
+
+
+def add_async(url, content):
+    """Queues a page for indexing; never blocks the caller (drops when the queue is full)."""
+    if not EVIDENCE_ENABLED or not content:
+        return
+    _ensure_writer()
+    try:
+        _queue.put_nowait((url, content, time.time()))
+    except queue.Full:
+        metrics.inc("truevail_stage_errors_total", stage="evidence_index", error="QueueFull")
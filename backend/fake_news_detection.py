@@ -3,37 +3,198 @@ Fake News Detection Model for TrueVail Application
 Based on the repository: https://github.com/nguyenvo09/fake_news_detection_deep_learning
 
 This module provides a fake news detection model that can be integrated into the TrueVail backend.
+
+Importing it is cheap: scikit-learn and NLTK are only imported when the first
+detector is built, and the stop-word list ships with the repo (data/), so no
+corpus is downloaded at runtime.
 """
 import os
-import pickle
-import numpy as np
-import pandas as pd
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.linear_model import LogisticRegression
-from sklearn.naive_bayes import MultinomialNB
-from sklearn.ensemble import RandomForestClassifier
 import re
-import nltk
-from nltk.corpus import stopwords
-from nltk.tokenize import word_tokenize
-from nltk.stem import PorterStemmer
-import joblib
+import math
+import threading
 import warnings
+import debug_log
+import metrics
 warnings.filterwarnings('ignore')
 
-# Download required NLTK data
-try:
-    nltk.data.find('tokenizers/punkt')
-except LookupError:
-    nltk.download('punkt')
+logger = debug_log.get_logger("fake_news_detection")
+
+STOPWORDS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "stopwords_english.txt")
+MAX_CACHED_STEMS = 200000
+
+_stop_words = None
+_URL_RE = re.compile(r'http\S+|www\S+|https\S+', flags=re.MULTILINE)
+_NON_LETTER_RE = re.compile(r'[^a-zA-Z\s]')
+# Letter-only words word_tokenize splits in two ("cannot" -> "can", "not")
+_CONTRACTION_RE = re.compile(r"\b(can(?=not\b)|gim(?=me\b)|gon(?=na\b)|got(?=ta\b)|lem(?=me\b)|wan(?=na\b))")
+
+
+def load_stop_words():
+    """NLTK's English stop-word list, read from the bundled copy."""
+    global _stop_words
+    if _stop_words is None:
+        with open(STOPWORDS_PATH, encoding="utf-8") as f:
+            _stop_words = frozenset(line.strip() for line in f if line.strip())
+    return _stop_words
+
+
+# Built-in training examples, used when the repository data is not available
+DEFAULT_TRAIN_TEXTS = [
+    "This is a real news article with factual information.",
+    "Breaking news: Scientists discover new breakthrough in medicine.",
+    "Government announces new policy to improve education.",
+    "Study shows benefits of regular exercise for heart health.",
+    "Local community raises funds for new library.",
+    "City council votes on new infrastructure improvements.",
+    "New research confirms benefits of healthy diet and exercise.",
+    "Stock market reaches record high amid economic growth.",
+    "International climate agreement signed by world leaders.",
+    "University researchers publish peer-reviewed study on renewable energy.",
+    "Public health officials recommend vaccination for disease prevention.",
+    "Health experts confirm findings of peer-reviewed medical study.",
+    "Official report shows increase in employment rates nationwide.",
+    "Scientific journal publishes research on climate change.",
+    "Fake news spreading rapidly on social media platforms.",
+    "This story is completely false and made up.",
+    "Unverified claims about political candidates.",
+    "Miracle cure for cancer discovered without scientific evidence.",
+    "You won't believe what happened next.",
+    "Shocking celebrity death reported falsely.",
+    "Aliens landed in downtown area today.",
+    "Scientists prove water is wet in groundbreaking discovery.",
+    "Breaking: World's tallest mountain found to be made of cheese.",
+    "Experts say drinking water causes instant weight loss.",
+    "Historical documents reveal dinosaurs lived with humans.",
+    "Breaking news: Scientists prove the Earth is flat."
+]
+DEFAULT_TRAIN_LABELS = [1] * 14 + [0] * 12  # 1 for real, 0 for fake
+
+
+def clean_tokens(text, stop_words):
+    """Lowercased letter-only tokens of text, without URLs, stop words and short words (not stemmed)."""
+    # Convert to lowercase
+    text = text.lower()
+    
+    # Remove URLs
+    text = _URL_RE.sub('', text)
+    
+    # Remove special characters and digits
+    text = _NON_LETTER_RE.sub('', text)
+    
+    # Tokenize: only letters and whitespace are left, so a whitespace split
+    # plus the contractions NLTK's word_tokenize splits gives its tokens
+    text = _CONTRACTION_RE.sub(r"\1 ", text)
+    return [token for token in text.split() if token not in stop_words and len(token) > 2]
+
+
+def prediction_result(prediction, prediction_proba):
+    """Result dict for a predicted class (1 real, 0 fake) and its [fake, real] probabilities."""
+    # Determine the confidence
+    confidence = max(prediction_proba)
+    
+    return {
+        "status": "Likely Real" if prediction == 1 else "Likely Fake",
+        "confidence": float(confidence),
+        "reason": f"Content {'matches' if prediction == 1 else 'does not match'} patterns of real news with {confidence*100:.1f}% confidence.",
+        "is_fake": prediction == 0,
+        "prediction_score": float(prediction_proba[0] if prediction == 0 else prediction_proba[1])
+    }
+
+
+def sigmoid(x):
+    """Logistic function, without overflow for large negative x."""
+    if x >= 0:
+        return 1 / (1 + math.exp(-x))
+    z = math.exp(x)
+    return z / (1 + z)
+
+
+def ngram_terms(tokens, ngram_range):
+    """The n-grams of tokens for an sklearn (low, high) ngram_range, unigrams first."""
+    low, high = ngram_range
+    if low == 1 and high == 1:
+        return tokens
+    terms = list(tokens) if low == 1 else []
+    for n in range(max(low, 2), high + 1):
+        terms.extend(" ".join(tokens[i:i + n]) for i in range(len(tokens) - n + 1))
+    return terms
+
+
+def linear_decision(counts, coef, intercept, idf=None):
+    """
+    Logistic regression decision value (log-odds of real) of one document
+    given as {column: term count}: its l2-normalized TF-IDF weights (plain
+    counts without idf) dotted with coef, plus the intercept. The one scoring
+    core of CompiledModel, compact_model.CompactModel and the online model.
+    """
+    if not counts:
+        return intercept
+    dot = squares = 0.0
+    for column, count in counts.items():
+        weight = count * idf[column] if idf is not None else count
+        dot += weight * coef[column]
+        squares += weight * weight
+    return float(dot) / math.sqrt(squares) + intercept
+
+
+class CompiledModel:
+    """
+    A fitted TF-IDF vectorizer + binary logistic regression flattened into
+    plain lookup tables, for scoring one document without sklearn: the
+    term -> column table, IDF weights, coefficients and intercept. A document
+    is scored as the sparse dot product of its l2-normalized TF-IDF weights
+    with the coefficients, plus the intercept, and the sigmoid of that; the
+    same math as vectorizer.transform + predict_proba, without the input
+    validation and the 1xN sparse matrix.
+    """
+
+    def __init__(self, vectorizer, model):
+        self.index = vectorizer.vocabulary_
+        self.idf = vectorizer.idf_.tolist()
+        self.coef = model.coef_[0].tolist()
+        self.intercept = float(model.intercept_[0])
+        self.stop_words = vectorizer.get_stop_words() or frozenset()
+        self.ngram_range = vectorizer.ngram_range
+
+    @classmethod
+    def build(cls, vectorizer, model):
+        """CompiledModel for a fitted pair, or None when their settings are not supported."""
+        supported = (
+            vectorizer.analyzer == "word" and vectorizer.token_pattern == r"(?u)\b\w\w+\b"
+            and vectorizer.tokenizer is None and vectorizer.preprocessor is None
+            and vectorizer.use_idf and vectorizer.norm == "l2" and not vectorizer.sublinear_tf
+            and not vectorizer.binary and list(model.classes_) == [0, 1]
+        )
+        return cls(vectorizer, model) if supported else None
+
+    def terms(self, processed):
+        """The uni-/bigrams the vectorizer extracts from preprocessed (lowercase, letters-only) text."""
+        tokens = [token for token in processed.split() if len(token) > 1 and token not in self.stop_words]
+        return ngram_terms(tokens, self.ngram_range)
+
+    def decision(self, processed):
+        """Logistic regression decision value (log-odds of real) for preprocessed text."""
+        counts = {}
+        index = self.index
+        for term in self.terms(processed):
+            column = index.get(term)
+            if column is not None:
+                counts[column] = counts.get(column, 0) + 1
+        return linear_decision(counts, self.coef, self.intercept, self.idf)
+
+    def predict(self, processed):
+        decision = self.decision(processed)
+        real = sigmoid(decision)
+        return prediction_result(1 if decision > 0 else 0, [1 - real, real])
 
-try:
-    nltk.data.find('corpora/stopwords')
-except LookupError:
-    nltk.download('stopwords')
 
 class FakeNewsDetector:
     def __init__(self):
+        from sklearn.feature_extraction.text import TfidfVectorizer
+        from sklearn.linear_model import LogisticRegression
+        # The Porter stemmer is pure Python and needs no NLTK data files
+        from nltk.stem.porter import PorterStemmer
+
         self.vectorizer = TfidfVectorizer(
             max_df=0.7, 
             max_features=5000,
@@ -43,29 +204,28 @@ class FakeNewsDetector:
         )
         self.model = LogisticRegression(random_state=42)
         self.stemmer = PorterStemmer()
-        self.stop_words = set(stopwords.words('english'))
+        self.stop_words = load_stop_words()
+        # token -> stem for every word seen so far (also the compact model's stem table)
+        self.stems = {}
+        # Single-document scoring tables, built once the model is fitted
+        self.compiled = None
         self.is_trained = False
         
     def preprocess_text(self, text):
         """
         Preprocess the input text for fake news detection
         """
-        # Convert to lowercase
-        text = text.lower()
-        
-        # Remove URLs
-        text = re.sub(r'http\S+|www\S+|https\S+', '', text, flags=re.MULTILINE)
+        # Remove stopwords and stem; stems are remembered, the stemmer is slow
+        stems = []
+        for token in clean_tokens(text, self.stop_words):
+            stem = self.stems.get(token)
+            if stem is None:
+                stem = self.stemmer.stem(token)
+                if len(self.stems) < MAX_CACHED_STEMS:
+                    self.stems[token] = stem
+            stems.append(stem)
         
-        # Remove special characters and digits
-        text = re.sub(r'[^a-zA-Z\s]', '', text)
-        
-        # Tokenize
-        tokens = word_tokenize(text)
-        
-        # Remove stopwords and stem
-        tokens = [self.stemmer.stem(token) for token in tokens if token not in self.stop_words and len(token) > 2]
-        
-        return ' '.join(tokens)
+        return ' '.join(stems)
     
     def prepare_training_data(self, data_dir="train_test_data/data_0"):
         """
@@ -117,68 +277,11 @@ class FakeNewsDetector:
             # Try to load from repository if available
             try:
                 train_texts, train_labels, _, _ = self.prepare_training_data()
-                if not train_texts:
-                    # Fallback to an improved training example with more diverse examples
-                    train_texts = [
-                        "This is a real news article with factual information.",
-                        "Breaking news: Scientists discover new breakthrough in medicine.",
-                        "Government announces new policy to improve education.",
-                        "Study shows benefits of regular exercise for heart health.",
-                        "Local community raises funds for new library.",
-                        "City council votes on new infrastructure improvements.",
-                        "New research confirms benefits of healthy diet and exercise.",
-                        "Stock market reaches record high amid economic growth.",
-                        "International climate agreement signed by world leaders.",
-                        "University researchers publish peer-reviewed study on renewable energy.",
-                        "Public health officials recommend vaccination for disease prevention.",
-                        "Health experts confirm findings of peer-reviewed medical study.",
-                        "Official report shows increase in employment rates nationwide.",
-                        "Scientific journal publishes research on climate change.",
-                        "Fake news spreading rapidly on social media platforms.",
-                        "This story is completely false and made up.",
-                        "Unverified claims about political candidates.",
-                        "Miracle cure for cancer discovered without scientific evidence.",
-                        "You won't believe what happened next.",
-                        "Shocking celebrity death reported falsely.",
-                        "Aliens landed in downtown area today.",
-                        "Scientists prove water is wet in groundbreaking discovery.",
-                        "Breaking: World's tallest mountain found to be made of cheese.",
-                        "Experts say drinking water causes instant weight loss.",
-                        "Historical documents reveal dinosaurs lived with humans.",
-                        "Breaking news: Scientists prove the Earth is flat."
-                    ]
-                    train_labels = [1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0]  # 1 for real, 0 for fake
-            except:
-                # Fallback to an improved training example with more diverse examples
-                train_texts = [
-                    "This is a real news article with factual information.",
-                    "Breaking news: Scientists discover new breakthrough in medicine.",
-                    "Government announces new policy to improve education.",
-                    "Study shows benefits of regular exercise for heart health.",
-                    "Local community raises funds for new library.",
-                    "City council votes on new infrastructure improvements.",
-                    "New research confirms benefits of healthy diet and exercise.",
-                    "Stock market reaches record high amid economic growth.",
-                    "International climate agreement signed by world leaders.",
-                    "University researchers publish peer-reviewed study on renewable energy.",
-                    "Public health officials recommend vaccination for disease prevention.",
-                    "Health experts confirm findings of peer-reviewed medical study.",
-                    "Official report shows increase in employment rates nationwide.",
-                    "Scientific journal publishes research on climate change.",
-                    "Fake news spreading rapidly on social media platforms.",
-                    "This story is completely false and made up.",
-                    "Unverified claims about political candidates.",
-                    "Miracle cure for cancer discovered without scientific evidence.",
-                    "You won't believe what happened next.",
-                    "Shocking celebrity death reported falsely.",
-                    "Aliens landed in downtown area today.",
-                    "Scientists prove water is wet in groundbreaking discovery.",
-                    "Breaking: World's tallest mountain found to be made of cheese.",
-                    "Experts say drinking water causes instant weight loss.",
-                    "Historical documents reveal dinosaurs lived with humans.",
-                    "Breaking news: Scientists prove the Earth is flat."
-                ]
-                train_labels = [1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0]  # 1 for real, 0 for fake
+            except Exception:
+                train_texts = None
+            if not train_texts:
+                # Fallback to the built-in examples
+                train_texts, train_labels = DEFAULT_TRAIN_TEXTS, DEFAULT_TRAIN_LABELS
         
         # Preprocess texts
         processed_texts = [self.preprocess_text(text) for text in train_texts]
@@ -188,6 +291,7 @@ class FakeNewsDetector:
         
         # Train the model
         self.model.fit(X, train_labels)
+        self.compiled = CompiledModel.build(self.vectorizer, self.model)
         self.is_trained = True
         
         return self
@@ -200,29 +304,25 @@ class FakeNewsDetector:
         if not self.is_trained:
             self.train()
         
-        # Preprocess the input text
-        processed_text = self.preprocess_text(text)
-        
-        # Vectorize the text
-        X = self.vectorizer.transform([processed_text])
-        
-        # Get prediction
-        prediction = self.model.predict(X)[0]
-        prediction_proba = self.model.predict_proba(X)[0]
-        
-        # Determine the confidence
-        confidence = max(prediction_proba)
-        
-        result = {
-            "status": "Likely Real" if prediction == 1 else "Likely Fake",
-            "confidence": float(confidence),
-            "reason": f"Content {'matches' if prediction == 1 else 'does not match'} patterns of real news with {confidence*100:.1f}% confidence.",
-            "is_fake": prediction == 0,
-            "prediction_score": float(prediction_proba[0] if prediction == 0 else prediction_proba[1])
-        }
-        
-        return result
-    
+        # One document: the compiled tables skip sklearn's per-call overhead
+        if self.compiled is not None:
+            return self.compiled.predict(self.preprocess_text(text))
+        return self.predict_batch([text])[0]
+
+    def predict_batch(self, texts):
+        """
+        Predict several texts with one vectorizer/model pass; returns a list of
+        results in the same format as predict()
+        """
+        if not self.is_trained:
+            self.train()
+
+        # Preprocess and vectorize all texts at once
+        X = self.vectorizer.transform([self.preprocess_text(text) for text in texts])
+        predictions = self.model.predict(X)
+        probabilities = self.model.predict_proba(X)
+        return [prediction_result(prediction, proba) for prediction, proba in zip(predictions, probabilities)]
+
     def save_model(self, filepath):
         """
         Save the trained model to a file
@@ -232,36 +332,91 @@ class FakeNewsDetector:
             'model': self.model,
             'is_trained': self.is_trained
         }
+        import joblib
         joblib.dump(model_data, filepath)
     
     def load_model(self, filepath):
         """
         Load a pre-trained model from a file
         """
+        import joblib
         model_data = joblib.load(filepath)
         self.vectorizer = model_data['vectorizer']
         self.model = model_data['model']
+        self.compiled = CompiledModel.build(self.vectorizer, self.model) if model_data['is_trained'] else None
         self.is_trained = model_data['is_trained']
 
-# Global instance of the fake news detector
-fake_news_detector = FakeNewsDetector()
+# Global instance of the fake news detector, built on first use
+fake_news_detector = None
+_detector_lock = threading.Lock()
 
 
+def get_fake_news_detector():
+    """
+    Returns the shared detector, created on first call: the memory-mapped
+    compact model when one has been exported (see compact_model.py), else a
+    FakeNewsDetector (importing sklearn and training it).
+    """
+    global fake_news_detector
+    if fake_news_detector is None:
+        with _detector_lock:
+            if fake_news_detector is None:
+                fake_news_detector = _load_compact_model() or FakeNewsDetector()
+    return fake_news_detector
+
+
+def publish_detector(detector):
+    """
+    Makes detector the shared one. A single reference assignment: requests
+    already predicting finish on the old model, later ones get the new one,
+    and the predict path takes no lock.
+    """
+    global fake_news_detector
+    fake_news_detector = detector
+
+
+def _load_compact_model():
+    from compact_model import COMPACT_MODEL_PATH, CompactModel
+
+    if not COMPACT_MODEL_PATH or not os.path.exists(COMPACT_MODEL_PATH):
+        return None
+    try:
+        return CompactModel(COMPACT_MODEL_PATH)
+    except (OSError, ValueError) as e:
+        logger.warning("Could not load compact model %s: %s", COMPACT_MODEL_PATH, e)
+        return None
+
+
+@metrics.timed("local_predict")
 def detect_fake_news(text):
     """
     Function to detect fake news using the trained model
     """
-    print(f"DEBUG: Starting fake news detection for text: {text[:100]}...")
-    result = fake_news_detector.predict(text)
-    print(f"DEBUG: Fake news detection result: {result}")
+    logger.debug("Starting fake news detection for text: %s...", text[:100])
+    result = get_fake_news_detector().predict(text)
+    logger.debug("Fake news detection result: %s", result)
     return result
 
 
+
+@metrics.timed("local_predict_batch")
+def detect_fake_news_batch(texts):
+    """
+    Batch version of detect_fake_news
+    """
+    return get_fake_news_detector().predict_batch(texts)
+
+
 def train_fake_news_detector():
     """
-    Function to train the fake news detector
+    Function to train the fake news detector; a loaded compact model cannot be
+    trained, so a FakeNewsDetector is trained and published in its place
     """
-    print("DEBUG: Training fake news detector...")
-    fake_news_detector.train()
-    print("DEBUG: Fake news detector training completed")
-    return fake_news_detector
+    logger.debug("Training fake news detector...")
+    detector = get_fake_news_detector()
+    if not isinstance(detector, FakeNewsDetector):
+        detector = FakeNewsDetector()
+    detector.train()
+    publish_detector(detector)
+    logger.debug("Fake news detector training completed")
+    return detector
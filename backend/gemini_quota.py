@@ -0,0 +1,329 @@
+"""
+Quota-aware scheduling of Gemini calls over a pool of API keys.
+
+Gemini enforces requests-per-minute and tokens-per-minute limits per API key
+and model, and we used to learn that a limit was reached only from a 429 /
+RESOURCE_EXHAUSTED reply. PooledModel has the SDK model's generate_content()
+API; before every call it reserves the request's estimated tokens (prompt +
+max output) against one key's budgets over the last 60 seconds:
+
+    budgets     GEMINI_LIMITS per model ("model=rpm/tpm,..."), else
+                GEMINI_RPM / GEMINI_TPM, of which only GEMINI_QUOTA_HEADROOM
+                is used so that concurrent callers never cross the real limit
+    keys        GEMINI_API_KEYS; the key with the most room takes the call
+    waiting     when no key has room, the caller waits up to
+                GEMINI_QUOTA_WAIT_MS (and never past its request deadline)
+                for the oldest reservation to age out
+    overflow    otherwise QuotaExhausted is raised without calling Gemini, and
+                the caller answers from GEMINI_OVERFLOW (the local model or
+                Ollama) instead
+
+Reservations live in SQLite (GEMINI_QUOTA_DB) so that every worker process
+draws from the same budgets; a reservation is corrected to the tokens Gemini
+reports once the reply is in. A 429 still puts its key on cooldown for the
+reply's retry delay, and the call moves on to the next key.
+
+Calls go to the REST API (GEMINI_API_BASE) with the reserved key: the SDK
+configures one key per process.
+"""
+import os
+import re
+import time
+import sqlite3
+import hashlib
+import threading
+
+import requests
+
+import compaction
+import deadline
+import debug_log
+import media_upload
+import metrics
+
+logger = debug_log.get_logger("gemini_quota")
+
+GEMINI_QUOTA_ENABLED = os.getenv("GEMINI_QUOTA_ENABLED", "1") != "0"
+GEMINI_QUOTA_DB = os.getenv("GEMINI_QUOTA_DB", "gemini_quota.db")
+GEMINI_RPM = float(os.getenv("GEMINI_RPM", "15"))
+GEMINI_TPM = float(os.getenv("GEMINI_TPM", "1000000"))
+GEMINI_LIMITS = os.getenv("GEMINI_LIMITS", "")
+GEMINI_QUOTA_HEADROOM = float(os.getenv("GEMINI_QUOTA_HEADROOM", "0.9"))
+GEMINI_QUOTA_WAIT_MS = float(os.getenv("GEMINI_QUOTA_WAIT_MS", "500"))
+# Where analyses go when no key has room: "local", "ollama" or "none"
+GEMINI_OVERFLOW = os.getenv("GEMINI_OVERFLOW", "local").lower()
+WINDOW_SECONDS = 60
+# Cooldown after a 429 that does not say how long to wait
+DEFAULT_COOLDOWN_SECONDS = 30
+# Gemini bills an inline image as a fixed number of tokens
+IMAGE_TOKENS = 258
+
+_local = threading.local()
+_RETRY_DELAY_RE = re.compile(r"^(\d+(?:\.\d+)?)s$")
+
+
+class QuotaExhausted(Exception):
+    """No key has room for the call; nothing was sent to Gemini."""
+
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def parse_limits(spec):
+    """{model: (rpm, tpm)} from "gemini-1.5-flash=15/1000000,gemini-1.5-pro=2/32000"."""
+    limits = {}
+    for entry in filter(None, (part.strip() for part in spec.split(","))):
+        model, _, budget = entry.partition("=")
+        rpm, _, tpm = budget.partition("/")
+        limits[model.strip()] = (float(rpm), float(tpm) if tpm else GEMINI_TPM)
+    return limits
+
+
+LIMITS = parse_limits(GEMINI_LIMITS)
+
+
+def budgets(model):
+    """(requests, tokens) this process may reserve per key and window for model."""
+    rpm, tpm = LIMITS.get(model, (GEMINI_RPM, GEMINI_TPM))
+    return max(1, int(rpm * GEMINI_QUOTA_HEADROOM)), tpm * GEMINI_QUOTA_HEADROOM
+
+
+def key_id(key):
+    """Stable, non-secret name of an API key."""
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()[:12]
+
+
+def estimate_tokens(contents, max_output_tokens):
+    """Tokens a call will be billed for at most: its prompt plus the output cap."""
+    tokens = max_output_tokens
+    for part in contents if isinstance(contents, list) else [contents]:
+        if isinstance(part, str):
+            tokens += compaction.estimate_tokens(part)
+        elif isinstance(part, dict) and "text" in part:
+            tokens += compaction.estimate_tokens(part["text"])
+        else:
+            tokens += IMAGE_TOKENS
+    return tokens
+
+
+def _connect():
+    conn = getattr(_local, "conn", None)
+    if conn is not None and _local.pid == os.getpid():
+        return conn
+    conn = sqlite3.connect(GEMINI_QUOTA_DB, timeout=5, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS reservations ("
+        " id INTEGER PRIMARY KEY AUTOINCREMENT, key_id TEXT NOT NULL, model TEXT NOT NULL,"
+        " reserved_at REAL NOT NULL, tokens REAL NOT NULL)"
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS reservations_window ON reservations (key_id, model, reserved_at)")
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS cooldowns ("
+        " key_id TEXT NOT NULL, model TEXT NOT NULL, until REAL NOT NULL, PRIMARY KEY (key_id, model))"
+    )
+    _local.conn = conn
+    _local.pid = os.getpid()
+    return conn
+
+
+def _wait_for_room(rows, tokens, max_requests, max_tokens, now):
+    """Seconds until a key whose window holds rows (oldest first) has room for one more call."""
+    used = sum(row_tokens for _, row_tokens in rows)
+    wait = 0.0
+    if len(rows) + 1 > max_requests:
+        wait = rows[len(rows) - max_requests][0] + WINDOW_SECONDS - now
+    if used + tokens > max_tokens:
+        for reserved_at, row_tokens in rows:
+            used -= row_tokens
+            if used + tokens <= max_tokens:
+                wait = max(wait, reserved_at + WINDOW_SECONDS - now)
+                break
+        else:
+            # Bigger than a whole window: it fits once the window is empty
+            wait = max(wait, rows[-1][0] + WINDOW_SECONDS - now if rows else 0.0)
+    return max(0.0, wait)
+
+
+def _try_reserve(keys, model, tokens):
+    """(key, reservation id, 0) for the key with the most room, or (None, None, seconds to wait)."""
+    max_requests, max_tokens = budgets(model)
+    tokens = min(tokens, max_tokens)
+    now = time.time()
+    conn = _connect()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        conn.execute("DELETE FROM reservations WHERE reserved_at < ?", (now - WINDOW_SECONDS,))
+        best = None
+        shortest_wait = None
+        for key in keys:
+            kid = key_id(key)
+            cooldown = conn.execute(
+                "SELECT until FROM cooldowns WHERE key_id = ? AND model = ?", (kid, model)
+            ).fetchone()
+            rows = conn.execute(
+                "SELECT reserved_at, tokens FROM reservations WHERE key_id = ? AND model = ? ORDER BY reserved_at",
+                (kid, model),
+            ).fetchall()
+            wait = max(cooldown[0] - now if cooldown else 0.0, _wait_for_room(rows, tokens, max_requests, max_tokens, now))
+            if wait > 0:
+                shortest_wait = wait if shortest_wait is None else min(shortest_wait, wait)
+                continue
+            load = max(len(rows) / max_requests, sum(row_tokens for _, row_tokens in rows) / max_tokens)
+            if best is None or load < best[0]:
+                best = (load, key, kid)
+        reservation = None
+        if best is not None:
+            reservation = conn.execute(
+                "INSERT INTO reservations (key_id, model, reserved_at, tokens) VALUES (?, ?, ?, ?)",
+                (best[2], model, now, tokens),
+            ).lastrowid
+        conn.execute("COMMIT")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    if best is None:
+        return None, None, shortest_wait if shortest_wait is not None else WINDOW_SECONDS
+    return best[1], reservation, 0.0
+
+
+def reserve(keys, model, tokens, exclude=()):
+    """
+    Reserves room for one call on the least loaded key; returns (key,
+    reservation id). Waits up to GEMINI_QUOTA_WAIT_MS for room, then raises
+    QuotaExhausted.
+    """
+    keys = [key for key in keys if key not in exclude]
+    if not keys:
+        metrics.inc("truevail_gemini_quota_total", model=model, outcome="overflow")
+        raise QuotaExhausted("every Gemini key is rate limited")
+    max_wait = GEMINI_QUOTA_WAIT_MS / 1000
+    left = deadline.remaining()
+    if left is not None:
+        max_wait = min(max_wait, max(0.0, left - deadline.MIN_HOP_SECONDS))
+    give_up_at = time.monotonic() + max_wait
+    waited = False
+    while True:
+        key, reservation, wait = _try_reserve(keys, model, tokens)
+        if key is not None:
+            metrics.inc("truevail_gemini_quota_total", model=model, outcome="waited" if waited else "reserved")
+            return key, reservation
+        if time.monotonic() + wait > give_up_at:
+            metrics.inc("truevail_gemini_quota_total", model=model, outcome="overflow")
+            raise QuotaExhausted(f"no Gemini key has room for {model} for {wait:.1f}s", retry_after=wait)
+        waited = True
+        time.sleep(wait)
+
+
+def settle(reservation, tokens):
+    """Replaces a reservation's estimate with the tokens Gemini billed."""
+    _connect().execute("UPDATE reservations SET tokens = ? WHERE id = ?", (tokens, reservation))
+
+
+def cool_down(key, model, seconds):
+    """Takes a key out of rotation for model after Gemini answered 429."""
+    _connect().execute(
+        "INSERT OR REPLACE INTO cooldowns (key_id, model, until) VALUES (?, ?, ?)",
+        (key_id(key), model, time.time() + seconds),
+    )
+    metrics.inc("truevail_gemini_quota_total", model=model, outcome="throttled")
+
+
+def _retry_delay(response):
+    retry_after = response.headers.get("Retry-After")
+    if retry_after:
+        try:
+            return float(retry_after)
+        except ValueError:
+            pass
+    try:
+        details = response.json().get("error", {}).get("details", [])
+    except ValueError:
+        details = []
+    for detail in details:
+        match = _RETRY_DELAY_RE.match(str(detail.get("retryDelay", ""))) if isinstance(detail, dict) else None
+        if match:
+            return float(match.group(1))
+    return DEFAULT_COOLDOWN_SECONDS
+
+
+class Response:
+    """The parts of the SDK's response the callers read."""
+
+    def __init__(self, text, usage_metadata):
+        self.text = text
+        self.usage_metadata = usage_metadata
+
+    def __repr__(self):
+        return f"Response(text={self.text!r})"
+
+
+def _is_media(part):
+    return isinstance(part, dict) and isinstance(part.get("inline_data"), dict) and hasattr(part["inline_data"].get("data"), "base64_chunks")
+
+
+def _part(part):
+    if isinstance(part, str):
+        return {"text": part}
+    if _is_media(part):
+        # Filled in by media_upload.streamed_json while the body is sent
+        return {"inline_data": dict(part["inline_data"], data=media_upload.media_placeholder())}
+    if isinstance(part, dict):
+        return part
+    raise TypeError(f"unsupported Gemini content part {type(part).__name__}")
+
+
+class PooledModel:
+    """generate_content() over the key pool, with quota reservations; stands in for the SDK model."""
+
+    def __init__(self, keys, model_name="gemini-1.5-flash", api_base="https://generativelanguage.googleapis.com"):
+        self.keys = list(keys)
+        self.model_name = model_name
+        self.url = f"{api_base.rstrip('/')}/v1beta/models/{model_name}:generateContent"
+        self.session = requests.Session()
+
+    def generate_content(self, contents, generation_config=None, request_options=None):
+        generation_config = generation_config or {}
+        max_output_tokens = generation_config.get("max_output_tokens", 1000)
+        contents = contents if isinstance(contents, list) else [contents]
+        media = [part["inline_data"]["data"] for part in contents if _is_media(part)]
+        if len(media) > 1:
+            raise ValueError("at most one streamed media part per call")
+        payload = {
+            "contents": [{"parts": [_part(part) for part in contents]}],
+            "generationConfig": {
+                "temperature": generation_config.get("temperature", 0.1),
+                "maxOutputTokens": max_output_tokens,
+            },
+        }
+        timeout = (request_options or {}).get("timeout") or 30
+        estimate = estimate_tokens(contents, max_output_tokens)
+        throttled = []
+        while True:
+            key, reservation = reserve(self.keys, self.model_name, estimate, exclude=throttled)
+            if media:
+                # A fresh body per attempt: it re-reads the upload from the start
+                response = self.session.post(
+                    self.url, data=media_upload.streamed_json(payload, media[0]),
+                    headers={"x-goog-api-key": key, "Content-Type": "application/json"}, timeout=timeout,
+                )
+            else:
+                response = self.session.post(self.url, json=payload, headers={"x-goog-api-key": key}, timeout=timeout)
+            if response.status_code != 429:
+                break
+            # The budgets were optimistic for this key: bench it and try another
+            logger.warning("Gemini key %s answered 429 for %s", key_id(key), self.model_name)
+            cool_down(key, self.model_name, _retry_delay(response))
+            throttled.append(key)
+        response.raise_for_status()
+        data = response.json()
+        usage = data.get("usageMetadata") or {}
+        if usage.get("totalTokenCount"):
+            settle(reservation, usage["totalTokenCount"])
+        try:
+            text = "".join(part.get("text", "") for part in data["candidates"][0]["content"]["parts"])
+        except (KeyError, IndexError, TypeError):
+            raise Exception(f"No text in response: {data}")
+        return Response(text, usage)
@@ -0,0 +1,250 @@
+"""
+HTTP caching semantics and response compression.
+
+Analysis results are stored by content hash: the SHA-256 of the analysis type
+and the submitted text. A repeated /analyze for the same text is answered from
+the store, and every stored result can also be fetched with
+GET /analysis/<content-hash> (the Content-Location of the /analyze response).
+That GET, like /trending-news, carries an ETag and Cache-Control, so browsers,
+Firebase hosting and reverse proxies can answer repeats themselves. An
+If-None-Match that still matches gets 304 with no body.
+
+Results live in SQLite (ANALYSIS_CACHE_DB), shared by every worker, for
+ANALYSIS_CACHE_TTL_SECONDS. Partial and failed results are not stored, nor are
+fallback answers (tagged with a "source": heuristics, local model, pre-screen),
+so a provider outage is not served from the cache after it ends. The
+trending payload is rendered once per process every TRENDING_MAX_AGE_SECONDS,
+so its ETag stays stable between refreshes.
+
+JSON bodies of at least HTTP_COMPRESS_MIN_BYTES are compressed for clients
+that accept it. Brotli is used when the brotli package is installed; gzip is
+the fallback. A compressed body gets its own ETag ("<tag>-br" or "<tag>-gzip")
+and is matched against If-None-Match without the suffix.
+"""
+import os
+import gzip
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+
+import debug_log
+import metrics
+
+logger = debug_log.get_logger("http_cache")
+
+ANALYSIS_CACHE_ENABLED = os.getenv("ANALYSIS_CACHE_ENABLED", "1") != "0"
+ANALYSIS_CACHE_DB = os.getenv("ANALYSIS_CACHE_DB", "analysis_cache.db")
+ANALYSIS_CACHE_TTL_SECONDS = float(os.getenv("ANALYSIS_CACHE_TTL_SECONDS", "1800"))
+TRENDING_MAX_AGE_SECONDS = float(os.getenv("TRENDING_MAX_AGE_SECONDS", "120"))
+HTTP_COMPRESS_MIN_BYTES = int(os.getenv("HTTP_COMPRESS_MIN_BYTES", "1024"))
+HTTP_GZIP_LEVEL = int(os.getenv("HTTP_GZIP_LEVEL", "6"))
+HTTP_BROTLI_QUALITY = int(os.getenv("HTTP_BROTLI_QUALITY", "5"))
+# Media analyses have their own key (the upload's SHA-256) and are not stored
+CACHEABLE_TYPES = ("news", "news_advanced", "privacy")
+PURGE_EVERY = 200
+
+_local = threading.local()
+_memo = {}
+_memo_lock = threading.Lock()
+_stores = 0
+_brotli = None
+
+
+def _import_brotli():
+    global _brotli
+    if _brotli is None:
+        try:
+            import brotli
+            _brotli = brotli
+        except ImportError:
+            _brotli = False
+    return _brotli
+
+
+def content_hash(text, analysis_type="news"):
+    """Key of an analysis: hex SHA-256 of its type and stripped text."""
+    return hashlib.sha256(f"{analysis_type}\n{text.strip()}".encode("utf-8")).hexdigest()
+
+
+def valid_hash(key):
+    return len(key) == 64 and all(c in "0123456789abcdef" for c in key)
+
+
+def cacheable(text, analysis_type, image_data=None):
+    return ANALYSIS_CACHE_ENABLED and bool(text) and not image_data and analysis_type in CACHEABLE_TYPES
+
+
+def encode(payload):
+    """Compact JSON body bytes; the same payload always gives the same bytes (and ETag)."""
+    return json.dumps(payload, separators=(",", ":")).encode("utf-8")
+
+
+def _connect():
+    conn = getattr(_local, "conn", None)
+    if conn is not None and _local.pid == os.getpid():
+        return conn
+    conn = sqlite3.connect(ANALYSIS_CACHE_DB, timeout=2, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("CREATE TABLE IF NOT EXISTS analyses (key TEXT PRIMARY KEY, body BLOB NOT NULL, stored_at REAL NOT NULL)")
+    _local.conn = conn
+    _local.pid = os.getpid()
+    return conn
+
+
+def lookup(key):
+    """(body, seconds left) of a stored analysis, or None when absent or expired."""
+    if not ANALYSIS_CACHE_ENABLED:
+        return None
+    now = time.time()
+    try:
+        row = _connect().execute(
+            "SELECT body, stored_at FROM analyses WHERE key = ? AND stored_at > ?",
+            (key, now - ANALYSIS_CACHE_TTL_SECONDS),
+        ).fetchone()
+    except sqlite3.Error as e:
+        logger.warning("Analysis cache lookup failed: %s", e)
+        return None
+    if row is None:
+        return None
+    return bytes(row[0]), row[1] + ANALYSIS_CACHE_TTL_SECONDS - now
+
+
+def store(key, result):
+    """
+    Stores a complete AI analysis result and returns its body bytes; None
+    (not stored) for partial, failed and fallback results.
+    """
+    global _stores
+    if not ANALYSIS_CACHE_ENABLED or not isinstance(result, dict):
+        return None
+    if result.get("partial") or str(result.get("status", "")).lower() == "error":
+        return None
+    # Fallback answers carry their source (analyzer.is_degraded)
+    if "source" in result:
+        return None
+    body = encode(result)
+    now = time.time()
+    try:
+        conn = _connect()
+        conn.execute("INSERT OR REPLACE INTO analyses (key, body, stored_at) VALUES (?, ?, ?)", (key, body, now))
+        _stores += 1
+        if _stores % PURGE_EVERY == 0:
+            conn.execute("DELETE FROM analyses WHERE stored_at < ?", (now - ANALYSIS_CACHE_TTL_SECONDS,))
+    except sqlite3.Error as e:
+        logger.warning("Analysis cache store failed: %s", e)
+        return None
+    return body
+
+
+def memoized(name, max_age, compute):
+    """
+    (body, seconds left) of compute()'s payload rendered at most once per
+    max_age in this process. Exceptions from compute() are not cached.
+    """
+    now = time.monotonic()
+    with _memo_lock:
+        entry = _memo.get(name)
+    if entry is not None and now - entry[1] < max_age:
+        return entry[0], max_age - (now - entry[1])
+    body = encode(compute())
+    with _memo_lock:
+        _memo[name] = (body, now)
+    return body, max_age
+
+
+def etag(body):
+    return '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+
+
+def encoded_etag(tag, encoding):
+    """ETag of the representation compressed with encoding: "<tag>-<encoding>"."""
+    return tag[:-1] + f'-{encoding}"' if encoding else tag
+
+
+def not_modified(if_none_match, tag):
+    """True when an If-None-Match header matches tag (weak comparison, any encoding suffix)."""
+    if not if_none_match:
+        return False
+    opaque = tag.strip('"')
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*":
+            return True
+        candidate = candidate[2:] if candidate.startswith("W/") else candidate
+        candidate = candidate.strip('"')
+        if candidate.rsplit("-", 1)[0] == opaque:
+            return True
+    return False
+
+
+def choose_encoding(accept_encoding):
+    """'br', 'gzip' or None: the preferred encoding accepted by the client that we can produce."""
+    accepted = {}
+    for part in (accept_encoding or "").split(","):
+        name, _, params = part.strip().partition(";")
+        name = name.strip().lower()
+        if not name:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        accepted[name] = q
+    wildcard = accepted.get("*", 0.0)
+    best, best_q = None, 0.0
+    for encoding in ("br", "gzip"):
+        if encoding == "br" and not _import_brotli():
+            continue
+        q = accepted.get(encoding, wildcard)
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+
+def compress(body, encoding):
+    if encoding == "br":
+        return _import_brotli().compress(body, quality=HTTP_BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=HTTP_GZIP_LEVEL, mtime=0)
+
+
+def compressible(content_type, content_encoding, length):
+    return (
+        not content_encoding
+        and (content_type or "").split(";")[0].strip() == "application/json"
+        and length is not None
+        and length >= HTTP_COMPRESS_MIN_BYTES
+    )
+
+
+def negotiate(body, accept_encoding):
+    """(body, encoding): body compressed for the client, encoding None when sent as is."""
+    encoding = choose_encoding(accept_encoding) if len(body) >= HTTP_COMPRESS_MIN_BYTES else None
+    return (compress(body, encoding), encoding) if encoding else (body, None)
+
+
+def conditional(body, if_none_match, accept_encoding, cache_control, endpoint):
+    """
+    (status, body, headers) for a cacheable JSON body: 304 with an empty body
+    when If-None-Match matches its ETag, else the body compressed for the client.
+    """
+    tag = etag(body)
+    headers = {"Cache-Control": cache_control, "Vary": "Accept-Encoding"}
+    encoding = choose_encoding(accept_encoding) if len(body) >= HTTP_COMPRESS_MIN_BYTES else None
+    headers["ETag"] = encoded_etag(tag, encoding)
+    if not_modified(if_none_match, tag):
+        metrics.inc("truevail_http_not_modified_total", endpoint=endpoint)
+        return 304, b"", headers
+    if encoding:
+        body = compress(body, encoding)
+        headers["Content-Encoding"] = encoding
+    return 200, body, headers
+
+
+def max_age(seconds):
+    return str(max(0, int(seconds)))
@@ -0,0 +1,396 @@
+"""
+Durable background jobs for long-running analyses.
+
+POST /analyze/async stores the request in a SQLite queue (JOBS_DB) and returns
+a job id straight away; a small pool of worker threads claims jobs by
+priority, runs them under their own, longer request budget and records the
+result, which clients read from GET /jobs/<id> or receive on a webhook.
+
+    - priority: higher runs first, ties in submission order
+    - retries: a failed run is retried up to JOB_MAX_ATTEMPTS times with
+      exponential backoff (JOB_RETRY_BASE_SECONDS * 2^(attempt-1), jittered)
+    - leases: a running job whose worker died is picked up again once its
+      lease (JOB_LEASE_SECONDS) runs out, and marked failed instead once that
+      was its last attempt, so a job that kills its worker cannot loop forever
+    - expiry: a job not started within JOB_EXPIRY_SECONDS is marked expired,
+      and finished jobs are deleted JOB_RESULT_TTL_SECONDS after completion
+    - webhooks: finished jobs are POSTed to their webhook_url by a separate
+      delivery thread, so a slow receiver never holds a job worker. Webhook
+      hosts must resolve to public addresses (or be listed in
+      JOB_WEBHOOK_ALLOWED_HOSTS), checked on submit and again on delivery
+
+Every web worker process runs JOB_WORKERS threads by default. To keep slow
+analyses completely away from interactive traffic, set JOB_WORKERS=0 for the
+web server and run dedicated worker processes against the same database:
+    python jobs.py
+"""
+import os
+import json
+import time
+import uuid
+import queue
+import random
+import socket
+import sqlite3
+import ipaddress
+import threading
+from urllib.parse import urlparse
+
+import requests
+
+import deadline
+import debug_log
+import metrics
+
+logger = debug_log.get_logger("jobs")
+
+JOBS_DB = os.getenv("JOBS_DB", "jobs.db")
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+JOB_BUDGET_SECONDS = float(os.getenv("JOB_BUDGET_SECONDS", "180"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+JOB_RETRY_BASE_SECONDS = float(os.getenv("JOB_RETRY_BASE_SECONDS", "5"))
+JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", "600"))
+JOB_EXPIRY_SECONDS = float(os.getenv("JOB_EXPIRY_SECONDS", "3600"))
+JOB_RESULT_TTL_SECONDS = float(os.getenv("JOB_RESULT_TTL_SECONDS", "86400"))
+JOB_POLL_SECONDS = float(os.getenv("JOB_POLL_SECONDS", "1"))
+# Hosts that may receive webhooks even on private addresses (e.g. an internal service)
+JOB_WEBHOOK_ALLOWED_HOSTS = {
+    host.strip().lower() for host in os.getenv("JOB_WEBHOOK_ALLOWED_HOSTS", "").split(",") if host.strip()
+}
+JOB_WEBHOOK_QUEUE_SIZE = int(os.getenv("JOB_WEBHOOK_QUEUE_SIZE", "1000"))
+WEBHOOK_TIMEOUT = 10
+WEBHOOK_ATTEMPTS = 3
+
+FINISHED = ("done", "failed", "expired")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    priority INTEGER NOT NULL DEFAULT 0,
+    payload TEXT NOT NULL,
+    result TEXT,
+    error TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL,
+    webhook_url TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    run_after REAL NOT NULL,
+    lease_until REAL,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_ready ON jobs (status, priority DESC, created_at);
+"""
+
+_local = threading.local()
+_wakeup = threading.Event()
+_workers_lock = threading.Lock()
+_workers_pid = None
+_webhooks = queue.Queue(maxsize=JOB_WEBHOOK_QUEUE_SIZE)
+_webhook_pid = None
+
+
+def _connect():
+    """One connection per thread (and per process: forked children reconnect)."""
+    conn = getattr(_local, "conn", None)
+    if conn is not None and _local.pid == os.getpid():
+        return conn
+    directory = os.path.dirname(os.path.abspath(JOBS_DB))
+    os.makedirs(directory, exist_ok=True)
+    conn = sqlite3.connect(JOBS_DB, timeout=30, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.executescript(_SCHEMA)
+    _local.conn = conn
+    _local.pid = os.getpid()
+    return conn
+
+
+def _public_address(address):
+    ip = ipaddress.ip_address(address.split("%")[0])
+    return not (ip.is_private or ip.is_loopback or ip.is_link_local or ip.is_multicast
+                or ip.is_reserved or ip.is_unspecified)
+
+
+def valid_webhook(url):
+    """
+    True for an http(s) URL whose host is allowlisted or resolves only to
+    public addresses, so webhooks cannot be pointed into our own network.
+    """
+    parsed = urlparse(url or "")
+    if parsed.scheme not in ("http", "https") or not parsed.hostname:
+        return False
+    if parsed.hostname.lower() in JOB_WEBHOOK_ALLOWED_HOSTS:
+        return True
+    try:
+        infos = socket.getaddrinfo(parsed.hostname, parsed.port or (443 if parsed.scheme == "https" else 80))
+    except (OSError, ValueError):
+        return False
+    return bool(infos) and all(_public_address(info[4][0]) for info in infos)
+
+
+def submit(payload, priority=0, webhook_url=None, max_attempts=None):
+    """Queues one analysis and returns its public job dict."""
+    now = time.time()
+    job_id = uuid.uuid4().hex
+    _connect().execute(
+        "INSERT INTO jobs (id, status, priority, payload, attempts, max_attempts, webhook_url,"
+        " created_at, updated_at, run_after) VALUES (?, 'queued', ?, ?, 0, ?, ?, ?, ?, ?)",
+        (job_id, int(priority), json.dumps(payload), max_attempts or JOB_MAX_ATTEMPTS,
+         webhook_url, now, now, now),
+    )
+    metrics.inc("truevail_jobs_total", event="submitted")
+    _wakeup.set()
+    return get(job_id)
+
+
+def _public(row):
+    job = {
+        "id": row["id"],
+        "status": row["status"],
+        "priority": row["priority"],
+        "attempts": row["attempts"],
+        "created_at": row["created_at"],
+        "updated_at": row["updated_at"],
+    }
+    if row["status"] == "queued" and row["attempts"]:
+        job["retry_at"] = row["run_after"]
+    if row["finished_at"]:
+        job["finished_at"] = row["finished_at"]
+    if row["result"] is not None:
+        job["result"] = json.loads(row["result"])
+    if row["error"]:
+        job["error"] = row["error"]
+    return job
+
+
+def get(job_id):
+    """Returns the public job dict, or None for unknown (or purged) ids."""
+    row = _connect().execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+    return _public(row) if row else None
+
+
+def expire_and_purge():
+    """Expires jobs that waited too long and deletes old finished jobs."""
+    now = time.time()
+    conn = _connect()
+    expired = conn.execute(
+        "UPDATE jobs SET status = 'expired', error = 'Job expired before it could run',"
+        " updated_at = ?, finished_at = ? WHERE status = 'queued' AND created_at < ?",
+        (now, now, now - JOB_EXPIRY_SECONDS),
+    ).rowcount
+    if expired:
+        metrics.inc("truevail_jobs_total", expired, event="expired")
+    conn.execute(
+        "DELETE FROM jobs WHERE status IN ('done', 'failed', 'expired') AND finished_at < ?",
+        (now - JOB_RESULT_TTL_SECONDS,),
+    )
+
+
+def claim():
+    """Atomically takes the next runnable job (or one with a lapsed lease); None when idle."""
+    now = time.time()
+    conn = _connect()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        # A lapsed lease on the last attempt means the job took its worker down
+        lost = conn.execute(
+            "SELECT id, webhook_url FROM jobs WHERE status = 'running' AND lease_until < ? AND attempts >= max_attempts",
+            (now,),
+        ).fetchall()
+        for lost_job in lost:
+            conn.execute(
+                "UPDATE jobs SET status = 'failed', error = 'Worker lost on the last attempt', lease_until = NULL,"
+                " updated_at = ?, finished_at = ? WHERE id = ?",
+                (now, now, lost_job["id"]),
+            )
+        row = conn.execute(
+            "SELECT * FROM jobs WHERE (status = 'queued' AND run_after <= ?)"
+            " OR (status = 'running' AND lease_until < ?)"
+            " ORDER BY priority DESC, created_at LIMIT 1",
+            (now, now),
+        ).fetchone()
+        if row is not None:
+            conn.execute(
+                "UPDATE jobs SET status = 'running', attempts = attempts + 1, lease_until = ?, updated_at = ?"
+                " WHERE id = ?",
+                (now + JOB_LEASE_SECONDS, now, row["id"]),
+            )
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    for lost_job in lost:
+        logger.warning("Job %s failed: its worker was lost on the last attempt", lost_job["id"])
+        metrics.inc("truevail_jobs_total", event="failed")
+        if lost_job["webhook_url"]:
+            queue_webhook(lost_job["webhook_url"], get(lost_job["id"]))
+    if row is None:
+        return None
+    return {
+        "id": row["id"],
+        "payload": json.loads(row["payload"]),
+        "attempts": row["attempts"] + 1,
+        "max_attempts": row["max_attempts"],
+        "webhook_url": row["webhook_url"],
+    }
+
+
+def complete(job_id, result):
+    now = time.time()
+    _connect().execute(
+        "UPDATE jobs SET status = 'done', result = ?, error = NULL, lease_until = NULL,"
+        " updated_at = ?, finished_at = ? WHERE id = ?",
+        (json.dumps(result), now, now, job_id),
+    )
+    metrics.inc("truevail_jobs_total", event="completed")
+
+
+def fail(job, error):
+    """Schedules a retry with backoff, or marks the job failed after its last attempt."""
+    now = time.time()
+    if job["attempts"] < job["max_attempts"]:
+        delay = JOB_RETRY_BASE_SECONDS * 2 ** (job["attempts"] - 1)
+        delay *= random.uniform(0.8, 1.2)
+        _connect().execute(
+            "UPDATE jobs SET status = 'queued', error = ?, run_after = ?, lease_until = NULL,"
+            " updated_at = ? WHERE id = ?",
+            (error, now + delay, now, job["id"]),
+        )
+        metrics.inc("truevail_jobs_total", event="retried")
+        return False
+    _connect().execute(
+        "UPDATE jobs SET status = 'failed', error = ?, lease_until = NULL, updated_at = ?,"
+        " finished_at = ? WHERE id = ?",
+        (error, now, now, job["id"]),
+    )
+    metrics.inc("truevail_jobs_total", event="failed")
+    return True
+
+
+def notify_webhook(url, job):
+    """POSTs the finished job to its webhook, retrying transient failures (on the delivery thread)."""
+    # Checked again here: the name may resolve differently than on submit
+    if not valid_webhook(url):
+        logger.warning("Webhook for job %s refused: %s is not a public address", job["id"], urlparse(url).hostname)
+        metrics.record_provider_error("webhook", "refused")
+        return False
+    for attempt in range(WEBHOOK_ATTEMPTS):
+        try:
+            response = requests.post(url, json=job, timeout=WEBHOOK_TIMEOUT, allow_redirects=False)
+            if response.status_code < 500:
+                return response.status_code < 400
+        except requests.RequestException as e:
+            logger.warning("Webhook for job %s failed (attempt %s): %s", job["id"], attempt + 1, e)
+        time.sleep(2 ** attempt)
+    metrics.record_provider_error("webhook", "delivery_failed")
+    return False
+
+
+def _webhook_loop():
+    while True:
+        url, job = _webhooks.get()
+        try:
+            notify_webhook(url, job)
+        except Exception as e:
+            logger.warning("Webhook delivery error for job %s: %s", job["id"], e)
+
+
+def queue_webhook(url, job):
+    """Hands a finished job to the delivery thread; never blocks a job worker."""
+    global _webhook_pid
+    if _webhook_pid != os.getpid():
+        with _workers_lock:
+            if _webhook_pid != os.getpid():
+                threading.Thread(target=_webhook_loop, name="job-webhooks", daemon=True).start()
+                _webhook_pid = os.getpid()
+    try:
+        _webhooks.put_nowait((url, job))
+    except queue.Full:
+        logger.warning("Webhook queue full; dropping notification for job %s", job["id"])
+        metrics.record_provider_error("webhook", "dropped")
+
+
+def run_analysis(payload):
+    """Default job handler: the same analysis /analyze runs, under the job budget."""
+    from analyzer import analyze_news
+
+    with deadline.request_deadline(JOB_BUDGET_SECONDS) as dl:
+        result = analyze_news(
+            payload.get("text"),
+            analysis_type=payload.get("type", "news"),
+            image_data=payload.get("image_data"),
+            mime_type=payload.get("mime_type"),
+        )
+    if dl.skipped and isinstance(result, dict):
+        result["partial"] = True
+        result["skipped_stages"] = dl.skipped
+    return result
+
+
+def run_one(handler=run_analysis):
+    """Claims and runs a single job; returns False when the queue had nothing ready."""
+    job = claim()
+    if job is None:
+        return False
+    logger.debug("Running job %s (attempt %s)", job["id"], job["attempts"])
+    finished = True
+    try:
+        with metrics.stage("job"):
+            result = handler(job["payload"])
+        complete(job["id"], result)
+    except Exception as e:
+        logger.warning("Job %s failed (attempt %s): %s", job["id"], job["attempts"], e)
+        finished = fail(job, f"{type(e).__name__}: {e}")
+    if finished and job["webhook_url"]:
+        queue_webhook(job["webhook_url"], get(job["id"]))
+    return True
+
+
+def _worker_loop(handler):
+    last_purge = 0.0
+    while True:
+        try:
+            if time.time() - last_purge > 60:
+                expire_and_purge()
+                last_purge = time.time()
+            if run_one(handler):
+                continue
+        except Exception as e:
+            logger.warning("Job worker error: %s", e)
+        _wakeup.wait(JOB_POLL_SECONDS)
+        _wakeup.clear()
+
+
+def start_workers(count=None, handler=run_analysis):
+    """Starts the worker threads once per process (safe to call on every request)."""
+    global _workers_pid
+    count = JOB_WORKERS if count is None else count
+    if count <= 0 or _workers_pid == os.getpid():
+        return
+    with _workers_lock:
+        if _workers_pid == os.getpid():
+            return
+        for i in range(count):
+            threading.Thread(target=_worker_loop, args=(handler,), name=f"job-worker-{i}", daemon=True).start()
+        _workers_pid = os.getpid()
+
+
+def main():
+    count = max(1, JOB_WORKERS)
+    logger.info("Processing jobs from %s with %s worker threads", JOBS_DB, count)
+    start_workers(count)
+    # Standalone workers learn from analyst feedback like the web workers do
+    import online_learning
+    online_learning.start()
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
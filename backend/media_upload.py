@@ -0,0 +1,182 @@
+"""
+Streaming media uploads for deepfake analysis.
+
+POST /analyze/media takes the image or video either as a raw body
+(Content-Type image/... or video/...) or as the "file" field of a
+multipart/form-data form, instead of base64 inside the /analyze JSON. The
+body is read in CHUNK_BYTES pieces into a SpooledTemporaryFile (in memory up
+to MEDIA_SPOOL_BYTES, on disk beyond) and hashed (SHA-256) on the way in;
+anything over MEDIA_MAX_BYTES is refused with 413 as soon as it is seen.
+
+Downstream, Ollama and Gemini still want base64 inside a JSON body, so the
+request body is streamed: streamed_json() yields the JSON around the media
+and base64-encodes the file chunk by chunk while requests sends it. Peak
+memory per upload is then a few chunks plus what the spool keeps in memory,
+not the several whole copies that decoding and re-encoding used to make.
+"""
+import os
+import json
+import base64
+import hashlib
+import tempfile
+
+MEDIA_MAX_BYTES = int(os.getenv("MEDIA_MAX_BYTES", str(50 * 1024 * 1024)))
+MEDIA_SPOOL_BYTES = int(os.getenv("MEDIA_SPOOL_BYTES", str(4 * 1024 * 1024)))
+# A multiple of 3, so base64 chunks concatenate without padding in between
+CHUNK_BYTES = 48 * 1024
+# Multipart boundaries, part headers and small fields on top of the file itself
+FORM_OVERHEAD_BYTES = 64 * 1024
+MEDIA_TYPES = ("image/", "video/")
+_PLACEHOLDER = "\x00media\x00"
+
+
+class UploadError(Exception):
+    """The upload is refused; status is the HTTP status to answer with."""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+class MediaUpload:
+    """A received upload: a readable file positioned anywhere, its size, SHA-256 and type."""
+
+    def __init__(self, file, size, sha256, mime_type, filename=None):
+        self.file = file
+        self.size = size
+        self.sha256 = sha256
+        self.mime_type = mime_type
+        self.filename = filename
+
+    def chunks(self, size=CHUNK_BYTES):
+        self.file.seek(0)
+        while True:
+            chunk = self.file.read(size)
+            if not chunk:
+                return
+            yield chunk
+
+    def base64_chunks(self):
+        for chunk in self.chunks():
+            yield base64.b64encode(chunk)
+
+    @property
+    def base64_length(self):
+        return 4 * -(-self.size // 3)
+
+    def read(self):
+        """The whole content as bytes (one copy); only for APIs that need it in memory."""
+        self.file.seek(0)
+        return self.file.read()
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def check_type(mime_type):
+    """The media type without parameters; raises UploadError(415) for anything but images and video."""
+    mime_type = (mime_type or "").split(";")[0].strip().lower()
+    if not mime_type.startswith(MEDIA_TYPES):
+        raise UploadError("Upload an image/* or video/* file", 415)
+    return mime_type
+
+
+def check_length(content_length, max_bytes=MEDIA_MAX_BYTES):
+    """Refuses a declared length over the limit before any of the body is read."""
+    if content_length is not None and content_length > max_bytes:
+        raise UploadError(f"Upload larger than {max_bytes} bytes", 413)
+
+
+class Receiver:
+    """Spools and hashes chunks as they arrive; feed() raises UploadError(413) past max_bytes."""
+
+    def __init__(self, mime_type, filename=None, max_bytes=MEDIA_MAX_BYTES):
+        self.mime_type = check_type(mime_type)
+        self.filename = filename
+        self.max_bytes = max_bytes
+        self.file = tempfile.SpooledTemporaryFile(max_size=MEDIA_SPOOL_BYTES)
+        self.hash = hashlib.sha256()
+        self.size = 0
+
+    def feed(self, chunk):
+        self.size += len(chunk)
+        if self.size > self.max_bytes:
+            self.file.close()
+            raise UploadError(f"Upload larger than {self.max_bytes} bytes", 413)
+        self.hash.update(chunk)
+        self.file.write(chunk)
+
+    def finish(self):
+        if not self.size:
+            self.file.close()
+            raise UploadError("Empty upload")
+        return MediaUpload(self.file, self.size, self.hash.hexdigest(), self.mime_type, self.filename)
+
+
+def receive(stream, mime_type, filename=None, max_bytes=MEDIA_MAX_BYTES):
+    """Reads a file-like stream to the end into a MediaUpload."""
+    receiver = Receiver(mime_type, filename, max_bytes)
+    while True:
+        chunk = stream.read(CHUNK_BYTES)
+        if not chunk:
+            return receiver.finish()
+        receiver.feed(chunk)
+
+
+async def receive_async(chunks, mime_type, filename=None, max_bytes=MEDIA_MAX_BYTES):
+    """receive() for an async iterator of byte chunks (Starlette's request.stream())."""
+    receiver = Receiver(mime_type, filename, max_bytes)
+    async for chunk in chunks:
+        if chunk:
+            receiver.feed(chunk)
+    return receiver.finish()
+
+
+async def limited(chunks, max_bytes):
+    """
+    Passes an async iterator of byte chunks through, raising UploadError(413)
+    once more than max_bytes came: chunked bodies declare no length up front.
+    """
+    size = 0
+    async for chunk in chunks:
+        size += len(chunk)
+        if size > max_bytes:
+            raise UploadError(f"Upload larger than {max_bytes} bytes", 413)
+        yield chunk
+
+
+def media_placeholder():
+    """Value to put in a payload where streamed_json() should insert the upload's base64."""
+    return _PLACEHOLDER
+
+
+class StreamedBody:
+    """Request body that base64-encodes the upload while it is sent; has a length, so no chunked encoding."""
+
+    def __init__(self, prefix, upload, suffix):
+        self.prefix = prefix
+        self.upload = upload
+        self.suffix = suffix
+
+    def __iter__(self):
+        yield self.prefix
+        yield from self.upload.base64_chunks()
+        yield self.suffix
+
+    def __len__(self):
+        return len(self.prefix) + self.upload.base64_length + len(self.suffix)
+
+
+def streamed_json(payload, upload):
+    """
+    payload as a StreamedBody of JSON, with the one media_placeholder() value
+    replaced by upload's base64.
+    """
+    prefix, suffix = json.dumps(payload).split(json.dumps(_PLACEHOLDER), 1)
+    return StreamedBody((prefix + '"').encode("utf-8"), upload, ('"' + suffix).encode("utf-8"))
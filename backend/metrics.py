@@ -0,0 +1,258 @@
+"""
+Prometheus-compatible instrumentation for the TrueVail backend.
+
+Counters, gauges and latency histograms are kept in process memory. When
+METRICS_DIR is set (recommended under gunicorn), every worker also snapshots
+its values to METRICS_DIR/metrics_<pid>.json a few times a minute and
+whichever worker serves /metrics merges all snapshots, so the endpoint
+reports totals for the whole server rather than for one random worker.
+Clear METRICS_DIR when the server starts, the same way you would for
+prometheus_client's multiprocess mode.
+"""
+import os
+import json
+import time
+import bisect
+import threading
+import functools
+from contextlib import contextmanager
+
+METRICS_DIR = os.getenv("METRICS_DIR", "")
+METRICS_FLUSH_SECONDS = float(os.getenv("METRICS_FLUSH_SECONDS", "5"))
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# name -> (type, help)
+_DEFINITIONS = {
+    "truevail_stage_duration_seconds": ("histogram", "Latency of each analysis stage."),
+    "truevail_stage_errors_total": ("counter", "Exceptions raised inside an analysis stage."),
+    "truevail_provider_errors_total": ("counter", "Upstream provider failures by error class."),
+    "truevail_fallbacks_total": ("counter", "Analyses answered by a fallback tier."),
+    "truevail_cache_requests_total": ("counter", "Cache lookups by cache and result."),
+    "truevail_http_requests_total": ("counter", "HTTP requests by endpoint and status."),
+    "truevail_http_request_duration_seconds": ("histogram", "HTTP request latency by endpoint."),
+    "truevail_http_requests_in_flight": ("gauge", "HTTP requests currently being served."),
+    "truevail_http_not_modified_total": ("counter", "Conditional GETs answered 304 Not Modified by endpoint."),
+    "truevail_jobs_total": ("counter", "Background analysis jobs by lifecycle event."),
+    "truevail_feedback_total": ("counter", "Analyst corrections received by label."),
+    "truevail_model_version": ("gauge", "Online model version (last learned feedback id) serving predictions."),
+    "truevail_model_publish_total": ("counter", "Online model candidates by outcome (published, rejected, rollback)."),
+    "truevail_llm_batch_items_total": ("counter", "Gemini analyses sent through the micro-batcher by outcome."),
+    "truevail_compaction_chars_total": ("counter", "Prompt text characters before (input) and after (output) compaction."),
+    "truevail_gemini_quota_total": ("counter", "Gemini quota reservations by model and outcome (reserved, waited, overflow, throttled)."),
+    "truevail_politeness_total": ("counter", "Outbound scraping requests by per-host politeness outcome (admitted, queued, busy, backoff, disallowed, throttled)."),
+    "truevail_rate_limit_total": ("counter", "Admission decisions on analysis requests (allowed, throttled, error)."),
+    "truevail_shadow_total": ("counter", "Shadow candidate evaluations by outcome (agree, disagree, error, dropped)."),
+}
+
+_lock = threading.Lock()
+# (name, labels) -> float for counters and gauges
+_values = {}
+# (name, labels) -> [bucket counts..., +Inf count, sum]
+_histograms = {}
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+def inc(name, amount=1.0, **labels):
+    key = _key(name, labels)
+    with _lock:
+        _values[key] = _values.get(key, 0.0) + amount
+
+
+def set_gauge(name, value, **labels):
+    key = _key(name, labels)
+    with _lock:
+        _values[key] = float(value)
+
+
+def observe(name, seconds, **labels):
+    key = _key(name, labels)
+    index = bisect.bisect_left(LATENCY_BUCKETS, seconds)
+    with _lock:
+        series = _histograms.get(key)
+        if series is None:
+            series = _histograms[key] = [0] * (len(LATENCY_BUCKETS) + 1) + [0.0]
+        series[index] += 1
+        series[-1] += seconds
+
+
+@contextmanager
+def stage(name):
+    """Times the block as one analysis stage and counts exceptions escaping it."""
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception as e:
+        inc("truevail_stage_errors_total", stage=name, error=type(e).__name__)
+        raise
+    finally:
+        observe("truevail_stage_duration_seconds", time.perf_counter() - started, stage=name)
+
+
+def timed(stage_name):
+    """Decorator form of stage()."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage(stage_name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def record_provider_error(provider, error):
+    """Counts an upstream failure; error may be an exception, a class or a short label."""
+    if isinstance(error, BaseException):
+        error = type(error).__name__
+    elif isinstance(error, type):
+        error = error.__name__
+    inc("truevail_provider_errors_total", provider=provider, error_class=str(error))
+
+
+def record_fallback(tier):
+    inc("truevail_fallbacks_total", tier=tier)
+
+
+def record_cache(cache, hit):
+    inc("truevail_cache_requests_total", cache=cache, result="hit" if hit else "miss")
+
+
+def _snapshot():
+    with _lock:
+        return {
+            "values": [[name, list(labels), value] for (name, labels), value in _values.items()],
+            "histograms": [[name, list(labels), list(series)] for (name, labels), series in _histograms.items()],
+        }
+
+
+def _snapshot_path(pid):
+    return os.path.join(METRICS_DIR, f"metrics_{pid}.json")
+
+
+def flush():
+    """Writes this process's snapshot atomically (no-op without METRICS_DIR)."""
+    if not METRICS_DIR:
+        return
+    try:
+        os.makedirs(METRICS_DIR, exist_ok=True)
+        path = _snapshot_path(os.getpid())
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(_snapshot(), f)
+        os.replace(tmp_path, path)
+    except OSError:
+        pass
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        return True
+    return True
+
+
+def _collect():
+    """Merged view of every worker's snapshot (or just this process)."""
+    if not METRICS_DIR:
+        return _snapshot()
+
+    flush()
+    merged_values = {}
+    merged_histograms = {}
+    try:
+        filenames = os.listdir(METRICS_DIR)
+    except OSError:
+        filenames = []
+    for filename in filenames:
+        if not (filename.startswith("metrics_") and filename.endswith(".json")):
+            continue
+        try:
+            pid = int(filename[len("metrics_"):-len(".json")])
+            with open(os.path.join(METRICS_DIR, filename), encoding="utf-8") as f:
+                snapshot = json.load(f)
+        except (ValueError, OSError):
+            continue
+        alive = _pid_alive(pid)
+        for name, labels, value in snapshot.get("values", []):
+            # Gauges describe live state, so dead workers must not contribute
+            if _DEFINITIONS.get(name, ("counter",))[0] == "gauge" and not alive:
+                continue
+            key = (name, tuple(tuple(pair) for pair in labels))
+            merged_values[key] = merged_values.get(key, 0.0) + value
+        for name, labels, series in snapshot.get("histograms", []):
+            key = (name, tuple(tuple(pair) for pair in labels))
+            current = merged_histograms.get(key)
+            if current is None:
+                merged_histograms[key] = list(series)
+            else:
+                merged_histograms[key] = [a + b for a, b in zip(current, series)]
+    return {
+        "values": [[name, list(labels), value] for (name, labels), value in merged_values.items()],
+        "histograms": [[name, list(labels), series] for (name, labels), series in merged_histograms.items()],
+    }
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value):
+    value = float(value)
+    return str(int(value)) if value.is_integer() else repr(value)
+
+
+def _format_labels(labels, extra=None):
+    pairs = list(labels) + ([extra] if extra else [])
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in pairs) + "}"
+
+
+def render():
+    """Returns all metrics in the Prometheus text exposition format (0.0.4)."""
+    data = _collect()
+    by_name = {}
+    for name, labels, value in data["values"]:
+        by_name.setdefault(name, []).append(("value", labels, value))
+    for name, labels, series in data["histograms"]:
+        by_name.setdefault(name, []).append(("histogram", labels, series))
+
+    lines = []
+    for name in sorted(by_name):
+        metric_type, help_text = _DEFINITIONS.get(name, ("untyped", name))
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {metric_type}")
+        for kind, labels, payload in sorted(by_name[name], key=lambda item: item[1]):
+            if kind == "value":
+                lines.append(f"{name}{_format_labels(labels)} {_format_value(payload)}")
+                continue
+            cumulative = 0
+            for bound, count in zip(LATENCY_BUCKETS + (float("inf"),), payload[:-1]):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else f"{bound:g}"
+                lines.append(f"{name}_bucket{_format_labels(labels, ('le', le))} {cumulative}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(payload[-1])}")
+            lines.append(f"{name}_count{_format_labels(labels)} {cumulative}")
+    return "\n".join(lines) + "\n"
+
+
+def _flush_loop():
+    while True:
+        time.sleep(METRICS_FLUSH_SECONDS)
+        flush()
+
+
+def _start_flusher():
+    threading.Thread(target=_flush_loop, name="metrics-flush", daemon=True).start()
+
+
+if METRICS_DIR:
+    _start_flusher()
+    if hasattr(os, "register_at_fork"):
+        os.register_at_fork(after_in_child=_start_flusher)
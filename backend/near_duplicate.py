@@ -0,0 +1,271 @@
+"""
+Near-duplicate index over analyzed texts (MinHash signatures + LSH banding).
+
+Viral claims come back with small edits - different emoji, a trimmed intro,
+an extra "BREAKING" - so an exact-text cache rarely hits. Each analyzed text
+is normalized, split into word shingles and summarized by a MinHash signature
+of NEAR_DUP_PERMUTATIONS values; the signature is cut into NEAR_DUP_BANDS
+bands whose hashes are bucketed, so a lookup only compares the handful of
+previous items that share at least one band. The best candidate whose
+estimated Jaccard similarity reaches NEAR_DUP_THRESHOLD is returned.
+
+Memory is bounded by NEAR_DUP_MAX_ITEMS (least recently used items are
+evicted) and entries expire after NEAR_DUP_TTL_SECONDS. Each process keeps
+its own index; every entry is also written to a SQLite file (NEAR_DUP_DB)
+shared by all workers, which the index is loaded from on first use and
+catches up with every NEAR_DUP_SYNC_SECONDS. Set NEAR_DUP_DB to "" to keep
+it in memory only.
+"""
+import os
+import re
+import json
+import time
+import zlib
+import sqlite3
+import threading
+from collections import OrderedDict
+
+import debug_log
+
+logger = debug_log.get_logger("near_duplicate")
+
+NEAR_DUP_ENABLED = os.getenv("NEAR_DUP_ENABLED", "1") != "0"
+NEAR_DUP_THRESHOLD = float(os.getenv("NEAR_DUP_THRESHOLD", "0.8"))
+NEAR_DUP_PERMUTATIONS = int(os.getenv("NEAR_DUP_PERMUTATIONS", "128"))
+NEAR_DUP_BANDS = int(os.getenv("NEAR_DUP_BANDS", "16"))
+NEAR_DUP_SHINGLE = int(os.getenv("NEAR_DUP_SHINGLE", "3"))
+NEAR_DUP_MIN_TOKENS = int(os.getenv("NEAR_DUP_MIN_TOKENS", "8"))
+NEAR_DUP_MAX_ITEMS = int(os.getenv("NEAR_DUP_MAX_ITEMS", "20000"))
+NEAR_DUP_TTL_SECONDS = float(os.getenv("NEAR_DUP_TTL_SECONDS", "86400"))
+NEAR_DUP_DB = os.getenv("NEAR_DUP_DB", "near_duplicates.db")
+NEAR_DUP_SYNC_SECONDS = float(os.getenv("NEAR_DUP_SYNC_SECONDS", "30"))
+PURGE_EVERY = 200
+
+# Largest prime below 2^32: the hash family is (a * x + b) mod PRIME over 32-bit
+# shingle hashes, so every signature value fits in a uint32
+PRIME = 4294967291
+SEED = 1
+
+_URL_RE = re.compile(r"https?://\S+|www\.\S+")
+_WORD_RE = re.compile(r"[a-z0-9]+")
+# Attention-grabbing prefixes that get added and removed as a claim spreads
+_NOISE_WORDS = frozenset(["breaking", "urgent", "alert", "just", "in", "update", "viral", "must", "read", "share"])
+
+
+def normalize_tokens(text):
+    """Lowercased word tokens without URLs, punctuation, emoji or leading noise words."""
+    tokens = _WORD_RE.findall(_URL_RE.sub(" ", text.lower()))
+    start = 0
+    while start < len(tokens) and tokens[start] in _NOISE_WORDS:
+        start += 1
+    return tokens[start:]
+
+
+def shingles(tokens, size=NEAR_DUP_SHINGLE):
+    if len(tokens) <= size:
+        return {" ".join(tokens)}
+    return {" ".join(tokens[i:i + size]) for i in range(len(tokens) - size + 1)}
+
+
+class MinHashIndex:
+    """MinHash signatures bucketed by LSH bands, with LRU eviction and TTL."""
+
+    def __init__(self, permutations=NEAR_DUP_PERMUTATIONS, bands=NEAR_DUP_BANDS,
+                 threshold=NEAR_DUP_THRESHOLD, max_items=NEAR_DUP_MAX_ITEMS, ttl=NEAR_DUP_TTL_SECONDS):
+        import numpy as np
+
+        if permutations % bands:
+            raise ValueError("NEAR_DUP_PERMUTATIONS must be a multiple of NEAR_DUP_BANDS")
+        self.np = np
+        self.permutations = permutations
+        self.bands = bands
+        self.rows = permutations // bands
+        self.threshold = threshold
+        self.max_items = max_items
+        self.ttl = ttl
+        rng = np.random.RandomState(SEED)
+        # a < 2^31 keeps a * x + b inside uint64 for 32-bit x
+        self._a = rng.randint(1, 2 ** 31, size=(permutations, 1)).astype(np.uint64)
+        self._b = rng.randint(0, 2 ** 31, size=(permutations, 1)).astype(np.uint64)
+        self._items = OrderedDict()  # key -> (signature, payload, stored_at)
+        self._buckets = [dict() for _ in range(bands)]  # band -> {band hash: set(keys)}
+        self._lock = threading.Lock()
+
+    def signature(self, tokens):
+        np = self.np
+        hashes = np.fromiter((zlib.crc32(s.encode("utf-8")) for s in shingles(tokens)), dtype=np.uint64)
+        return ((self._a * hashes + self._b) % np.uint64(PRIME)).min(axis=1).astype(np.uint32)
+
+    def _band_keys(self, signature):
+        data = signature.tobytes()
+        width = self.rows * signature.itemsize
+        return [hash(data[i * width:(i + 1) * width]) for i in range(self.bands)]
+
+    def _remove(self, key):
+        signature, _, _ = self._items.pop(key)
+        for band, band_key in enumerate(self._band_keys(signature)):
+            bucket = self._buckets[band].get(band_key)
+            if bucket is not None:
+                bucket.discard(key)
+                if not bucket:
+                    del self._buckets[band][band_key]
+
+    def add(self, key, signature, payload, stored_at=None):
+        with self._lock:
+            if key in self._items:
+                self._remove(key)
+            self._items[key] = (signature, payload, stored_at or time.time())
+            for band, band_key in enumerate(self._band_keys(signature)):
+                self._buckets[band].setdefault(band_key, set()).add(key)
+            while len(self._items) > self.max_items:
+                self._remove(next(iter(self._items)))
+
+    def stored_at(self, key):
+        with self._lock:
+            item = self._items.get(key)
+        return item[2] if item else None
+
+    def query(self, signature, analysis_type=None):
+        """(similarity, payload) of the best fresh match at or above the threshold, else None."""
+        now = time.time()
+        best = None
+        with self._lock:
+            candidates = set()
+            for band, band_key in enumerate(self._band_keys(signature)):
+                candidates.update(self._buckets[band].get(band_key, ()))
+            for key in candidates:
+                other, payload, stored_at = self._items[key]
+                if now - stored_at > self.ttl:
+                    self._remove(key)
+                    continue
+                if analysis_type is not None and payload.get("type") != analysis_type:
+                    continue
+                similarity = float((other == signature).mean())
+                if similarity >= self.threshold and (best is None or similarity > best[0]):
+                    best = (similarity, payload, key)
+            if best is None:
+                return None
+            self._items.move_to_end(best[2])
+        return best[0], best[1]
+
+
+_index = None
+_index_lock = threading.Lock()
+_local = threading.local()
+_synced_at = 0.0
+_writes = 0
+
+
+def _connect():
+    conn = getattr(_local, "conn", None)
+    if conn is not None and _local.pid == os.getpid():
+        return conn
+    conn = sqlite3.connect(NEAR_DUP_DB, timeout=2, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, signature BLOB NOT NULL, "
+        "payload TEXT NOT NULL, stored_at REAL NOT NULL)"
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS entries_stored_at ON entries (stored_at)")
+    _local.conn = conn
+    _local.pid = os.getpid()
+    return conn
+
+
+def _sync(index):
+    """Adds the entries stored by any process since the last sync (all fresh ones at first)."""
+    global _synced_at
+    now = time.time()
+    # Overlap the previous window: a row is stamped before it is committed
+    since = max(now - index.ttl, _synced_at - 5)
+    try:
+        rows = _connect().execute(
+            "SELECT key, signature, payload, stored_at FROM entries WHERE stored_at > ? "
+            "ORDER BY stored_at DESC LIMIT ?",
+            (since, index.max_items),
+        ).fetchall()
+    except sqlite3.Error as e:
+        logger.warning("Could not load near-duplicate entries: %s", e)
+        return 0
+    _synced_at = now
+    loaded = 0
+    for key, signature, payload, stored_at in reversed(rows):
+        if index.stored_at(key) == stored_at:
+            continue
+        index.add(key, index.np.frombuffer(signature, dtype=index.np.uint32), json.loads(payload), stored_at)
+        loaded += 1
+    return loaded
+
+
+def get_index():
+    """The process-wide index, created (and loaded from NEAR_DUP_DB) on first use."""
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                index = MinHashIndex()
+                if NEAR_DUP_DB:
+                    logger.debug("Loaded %s near-duplicate entries from %s", _sync(index), NEAR_DUP_DB)
+                _index = index
+    elif NEAR_DUP_DB and time.time() - _synced_at >= NEAR_DUP_SYNC_SECONDS:
+        with _index_lock:
+            if time.time() - _synced_at >= NEAR_DUP_SYNC_SECONDS:
+                _sync(_index)
+    return _index
+
+
+def _store(key, signature, payload):
+    """Writes one entry to NEAR_DUP_DB; a later write of the same key wins."""
+    global _writes
+    now = time.time()
+    try:
+        conn = _connect()
+        conn.execute(
+            "INSERT OR REPLACE INTO entries (key, signature, payload, stored_at) VALUES (?, ?, ?, ?)",
+            (key, signature.tobytes(), json.dumps(payload), now),
+        )
+        _writes += 1
+        if _writes % PURGE_EVERY == 0:
+            conn.execute("DELETE FROM entries WHERE stored_at < ?", (now - NEAR_DUP_TTL_SECONDS,))
+    except sqlite3.Error as e:
+        logger.warning("Could not store near-duplicate entry: %s", e)
+        return None
+    return now
+
+
+def _key(tokens, analysis_type):
+    return f"{analysis_type}:{zlib.crc32(' '.join(tokens).encode('utf-8')):08x}"
+
+
+def lookup(text, analysis_type="news"):
+    """
+    Returns (similarity, result) of the closest earlier analysis of a
+    near-identical text of the same type, or None.
+    """
+    if not NEAR_DUP_ENABLED or not text:
+        return None
+    tokens = normalize_tokens(text)
+    if len(tokens) < NEAR_DUP_MIN_TOKENS:
+        return None
+    index = get_index()
+    match = index.query(index.signature(tokens), analysis_type)
+    if match is None:
+        return None
+    similarity, payload = match
+    return similarity, payload["result"]
+
+
+def remember(text, analysis_type, result):
+    """Records the verdict for text so reworded copies can reuse it."""
+    if not NEAR_DUP_ENABLED or not text or not isinstance(result, dict):
+        return
+    tokens = normalize_tokens(text)
+    if len(tokens) < NEAR_DUP_MIN_TOKENS:
+        return
+    index = get_index()
+    key = _key(tokens, analysis_type)
+    signature = index.signature(tokens)
+    payload = {"type": analysis_type, "result": result}
+    stored_at = _store(key, signature, payload) if NEAR_DUP_DB else None
+    index.add(key, signature, payload, stored_at)
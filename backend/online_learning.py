@@ -0,0 +1,354 @@
+"""
+Online learning from analyst feedback.
+
+POST /feedback stores labelled corrections ({"text", "label": "real"|"fake"})
+in a SQLite table (FEEDBACK_DB) shared by all workers. Only analysts listed in
+FEEDBACK_TOKENS ("name=token,...") may submit, with their token in the
+X-Analyst-Token header; each row records its submitter. A learner thread in
+each process polls the table and trains an incrementally updatable model on
+what is new:
+
+    HashingVectorizer   stateless uni-/bigram features over the detector's
+                        preprocessed (stop-word filtered, stemmed) text, so
+                        new words need no refit
+    SGDClassifier       logistic loss, updated with partial_fit; corrections
+                        weigh FEEDBACK_WEIGHT times a seed example
+
+The classifier is first seeded with the base detector's training examples.
+Its features differ from the base TF-IDF model, so no candidate ships on
+trust:
+
+    - one submitter's corrections count for at most
+      FEEDBACK_SUBMITTER_MAX_WEIGHT in total; later ones are ignored
+    - every FEEDBACK_HOLDOUT_EVERY-th row is held out instead of learned
+    - every FEEDBACK_PUBLISH_SECONDS, if feedback arrived, the candidate is
+      scored against the base detector on the built-in examples and on the
+      held-out rows, and only published (fake_news_detection.publish_detector)
+      when it is at least as accurate on both
+
+Request threads pick a published model up on their next prediction, with no
+lock on the predict path and no restart; single texts are scored from the
+coefficients directly, without sklearn. POST /model/rollback (X-Admin-Token
+equal to FEEDBACK_ADMIN_TOKEN) puts the base detector back in every process
+on its next poll, and discards the feedback received so far from learning.
+
+Every process replays the same rows in id order with the same seed, so all
+workers converge on the same model; the version is the id of the last
+feedback row it has learned.
+"""
+import os
+import copy
+import hmac
+import time
+import sqlite3
+import threading
+
+import debug_log
+import metrics
+import fake_news_detection
+
+logger = debug_log.get_logger("online_learning")
+
+FEEDBACK_ENABLED = os.getenv("FEEDBACK_ENABLED", "1") != "0"
+FEEDBACK_DB = os.getenv("FEEDBACK_DB", "feedback.db")
+FEEDBACK_PUBLISH_SECONDS = float(os.getenv("FEEDBACK_PUBLISH_SECONDS", "30"))
+FEEDBACK_WEIGHT = float(os.getenv("FEEDBACK_WEIGHT", "3"))
+FEEDBACK_MAX_CHARS = int(os.getenv("FEEDBACK_MAX_CHARS", "20000"))
+FEEDBACK_SUBMITTER_MAX_WEIGHT = float(os.getenv("FEEDBACK_SUBMITTER_MAX_WEIGHT", "30"))
+FEEDBACK_HOLDOUT_EVERY = int(os.getenv("FEEDBACK_HOLDOUT_EVERY", "5"))
+FEEDBACK_ADMIN_TOKEN = os.getenv("FEEDBACK_ADMIN_TOKEN", "")
+HASH_FEATURES = 2 ** 18
+SEED_EPOCHS = 10
+FEEDBACK_EPOCHS = 3
+BATCH_ROWS = 1000
+MAX_HOLDOUT = 2000
+LABELS = {"real": 1, "fake": 0}
+
+
+def parse_tokens(spec):
+    """{token: analyst name} from "name=token,name=token"."""
+    tokens = {}
+    for part in (spec or "").split(","):
+        name, _, token = part.strip().partition("=")
+        if name.strip() and token.strip():
+            tokens[token.strip()] = name.strip()
+    return tokens
+
+
+FEEDBACK_TOKENS = parse_tokens(os.getenv("FEEDBACK_TOKENS", ""))
+
+_local = threading.local()
+_learner_lock = threading.Lock()
+_learner_pid = None
+_base = None
+
+
+def _connect():
+    conn = getattr(_local, "conn", None)
+    if conn is not None and _local.pid == os.getpid():
+        return conn
+    conn = sqlite3.connect(FEEDBACK_DB, timeout=10, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS feedback ("
+        " id INTEGER PRIMARY KEY AUTOINCREMENT, text TEXT NOT NULL, label INTEGER NOT NULL,"
+        " note TEXT, created_at REAL NOT NULL, submitter TEXT)"
+    )
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS rollbacks (id INTEGER PRIMARY KEY AUTOINCREMENT, after_id INTEGER NOT NULL,"
+        " created_at REAL NOT NULL)"
+    )
+    if "submitter" not in {row[1] for row in conn.execute("PRAGMA table_info(feedback)")}:
+        try:
+            conn.execute("ALTER TABLE feedback ADD COLUMN submitter TEXT")
+        except sqlite3.OperationalError:
+            pass  # added by another process meanwhile
+    _local.conn = conn
+    _local.pid = os.getpid()
+    return conn
+
+
+def parse_label(data):
+    """1 (real) or 0 (fake) from a feedback payload, or None when it has no usable label."""
+    label = data.get("label")
+    if isinstance(label, str) and label.strip().lower() in LABELS:
+        return LABELS[label.strip().lower()]
+    if isinstance(data.get("is_fake"), bool):
+        return 0 if data["is_fake"] else 1
+    return None
+
+
+def analyst(token):
+    """Name of the analyst whose FEEDBACK_TOKENS token this is, or None."""
+    if not token:
+        return None
+    for known, name in FEEDBACK_TOKENS.items():
+        if hmac.compare_digest(token.encode("utf-8"), known.encode("utf-8")):
+            return name
+    return None
+
+
+def is_admin(token):
+    return bool(FEEDBACK_ADMIN_TOKEN and token) and hmac.compare_digest(
+        token.encode("utf-8"), FEEDBACK_ADMIN_TOKEN.encode("utf-8")
+    )
+
+
+def record(text, label, note=None, submitter=None):
+    """Stores one correction; returns its id."""
+    cursor = _connect().execute(
+        "INSERT INTO feedback (text, label, note, created_at, submitter) VALUES (?, ?, ?, ?, ?)",
+        (text[:FEEDBACK_MAX_CHARS], label, note, time.time(), submitter),
+    )
+    metrics.inc("truevail_feedback_total", label="real" if label else "fake")
+    return cursor.lastrowid
+
+
+def request_rollback():
+    """
+    Asks every process to serve the base detector again and to learn only
+    from feedback received from now on; returns the last discarded feedback id.
+    """
+    conn = _connect()
+    after_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM feedback").fetchone()[0]
+    conn.execute("INSERT INTO rollbacks (after_id, created_at) VALUES (?, ?)", (after_id, time.time()))
+    logger.warning("Online model rollback requested; feedback up to id %s is discarded", after_id)
+    return after_id
+
+
+def _rollback_point():
+    return _connect().execute("SELECT COALESCE(MAX(after_id), 0) FROM rollbacks").fetchone()[0]
+
+
+def current_version():
+    """Version of the model serving predictions: the last learned feedback id, or "base"."""
+    return getattr(fake_news_detection.fake_news_detector, "version", "base")
+
+
+def base_detector():
+    """The detector this process served before any online model: the rollback target."""
+    global _base
+    if _base is None:
+        _base = fake_news_detection.get_fake_news_detector()
+    return _base
+
+
+class OnlineDetector:
+    """Frozen snapshot of the online model; same predict API as FakeNewsDetector."""
+
+    is_trained = True
+
+    def __init__(self, version, classifier, learner):
+        self.version = version
+        self.classifier = classifier
+        self._learner = learner
+        # Single-text scoring tables, as in fake_news_detection.CompiledModel
+        self.coef = classifier.coef_[0]
+        self.intercept = float(classifier.intercept_[0])
+        self.stop_words = learner.hasher.get_stop_words() or frozenset()
+        self.ngram_range = learner.hasher.ngram_range
+
+    def decision(self, processed):
+        """
+        Log-odds of real for preprocessed text: the hashed, l2-normalized term
+        counts dotted with the coefficients, as HashingVectorizer + SGD would.
+        """
+        from sklearn.utils import murmurhash3_32
+
+        tokens = [token for token in processed.split() if len(token) > 1 and token not in self.stop_words]
+        counts = {}
+        for term in fake_news_detection.ngram_terms(tokens, self.ngram_range):
+            column = abs(murmurhash3_32(term, seed=0)) % HASH_FEATURES
+            counts[column] = counts.get(column, 0) + 1
+        return fake_news_detection.linear_decision(counts, self.coef, self.intercept)
+
+    def predict(self, text):
+        decision = self.decision(self._learner.preprocessor.preprocess_text(text))
+        real = fake_news_detection.sigmoid(decision)
+        return fake_news_detection.prediction_result(1 if decision > 0 else 0, [1 - real, real])
+
+    def predict_batch(self, texts):
+        probabilities = self.classifier.predict_proba(self._learner.features(texts))
+        return [
+            fake_news_detection.prediction_result(1 if proba[1] > proba[0] else 0, proba)
+            for proba in probabilities
+        ]
+
+
+class Learner:
+    """Owns the mutable classifier; only the learner thread calls fit/publish."""
+
+    def __init__(self, after_id=0):
+        from sklearn.feature_extraction.text import HashingVectorizer
+        from sklearn.linear_model import SGDClassifier
+
+        # Preprocessing (and its stem cache) of the base detector's kind
+        self.preprocessor = fake_news_detection.FakeNewsDetector()
+        self.hasher = HashingVectorizer(
+            n_features=HASH_FEATURES, ngram_range=(1, 2), stop_words="english", alternate_sign=False, norm="l2"
+        )
+        self.classifier = SGDClassifier(loss="log_loss", alpha=1e-4, random_state=42)
+        # Feedback up to after_id was discarded by a rollback
+        self.after_id = after_id
+        self.last_id = after_id
+        # submitter -> weight of their corrections used so far (held out ones included)
+        self.used_weight = {}
+        # (text, label) rows kept out of training for the publish check
+        self.holdout = []
+        self._seed()
+
+    def features(self, texts):
+        return self.hasher.transform([self.preprocessor.preprocess_text(text) for text in texts])
+
+    def _seed(self):
+        # The base detector's training set when it is available, as in FakeNewsDetector.train
+        try:
+            texts, labels, _, _ = self.preprocessor.prepare_training_data()
+        except Exception:
+            texts = None
+        if not texts:
+            texts, labels = fake_news_detection.DEFAULT_TRAIN_TEXTS, fake_news_detection.DEFAULT_TRAIN_LABELS
+        X = self.features(texts)
+        for _ in range(SEED_EPOCHS):
+            self.classifier.partial_fit(X, labels, classes=[0, 1])
+
+    def fit(self, rows):
+        texts, labels, weights = [], [], []
+        for row_id, text, label, submitter in rows:
+            used = self.used_weight.get(submitter, 0.0)
+            weight = min(FEEDBACK_WEIGHT, FEEDBACK_SUBMITTER_MAX_WEIGHT - used)
+            if weight <= 0:
+                continue
+            self.used_weight[submitter] = used + weight
+            if FEEDBACK_HOLDOUT_EVERY > 0 and row_id % FEEDBACK_HOLDOUT_EVERY == 0:
+                self.holdout.append((text, label))
+                continue
+            texts.append(text)
+            labels.append(label)
+            weights.append(weight)
+        del self.holdout[:-MAX_HOLDOUT]
+        if texts:
+            X = self.features(texts)
+            for _ in range(FEEDBACK_EPOCHS):
+                self.classifier.partial_fit(X, labels, sample_weight=weights)
+        self.last_id = rows[-1][0]
+
+    def check_sets(self):
+        """Labelled example sets a candidate must do at least as well on as the base detector, each."""
+        sets = [list(zip(fake_news_detection.DEFAULT_TRAIN_TEXTS, fake_news_detection.DEFAULT_TRAIN_LABELS))]
+        if self.holdout:
+            sets.append(self.holdout)
+        return sets
+
+    def snapshot(self):
+        return OnlineDetector(self.last_id, copy.deepcopy(self.classifier), self)
+
+
+def accuracy(detector, examples):
+    results = detector.predict_batch([text for text, _ in examples])
+    return sum((0 if result["is_fake"] else 1) == label for result, (_, label) in zip(results, examples)) / len(examples)
+
+
+def _pending_rows(after_id):
+    return _connect().execute(
+        "SELECT id, text, label, submitter FROM feedback WHERE id > ? ORDER BY id LIMIT ?", (after_id, BATCH_ROWS)
+    ).fetchall()
+
+
+def learn_once(learner=None):
+    """
+    Trains on every feedback row not learned yet and publishes the result if
+    it passes the held-out check; returns the learner (created when there is
+    feedback and none was given, dropped after a rollback).
+    """
+    rollback_id = _rollback_point()
+    if learner is not None and learner.after_id != rollback_id:
+        fake_news_detection.publish_detector(base_detector())
+        metrics.set_gauge("truevail_model_version", 0)
+        metrics.inc("truevail_model_publish_total", outcome="rollback")
+        logger.warning("Rolled back to the base detector; learning from feedback after id %s", rollback_id)
+        learner = None
+    after_id = learner.last_id if learner else rollback_id
+    rows = _pending_rows(after_id)
+    if not rows:
+        return learner
+    base = base_detector()
+    if learner is None:
+        learner = Learner(rollback_id)
+    while rows:
+        with metrics.stage("online_learning_fit"):
+            learner.fit(rows)
+        rows = _pending_rows(learner.last_id)
+    candidate = learner.snapshot()
+    with metrics.stage("online_learning_check"):
+        scores = [(accuracy(candidate, examples), accuracy(base, examples)) for examples in learner.check_sets()]
+    if any(candidate_accuracy < base_accuracy for candidate_accuracy, base_accuracy in scores):
+        metrics.inc("truevail_model_publish_total", outcome="rejected")
+        logger.warning("Online model version %s not published: accuracy (candidate, base) %s", learner.last_id, scores)
+        return learner
+    fake_news_detection.publish_detector(candidate)
+    metrics.set_gauge("truevail_model_version", learner.last_id)
+    metrics.inc("truevail_model_publish_total", outcome="published")
+    logger.info("Published online model version %s: accuracy (candidate, base) %s", learner.last_id, scores)
+    return learner
+
+
+def _learn_loop():
+    learner = None
+    while True:
+        try:
+            learner = learn_once(learner)
+        except Exception as e:
+            logger.warning("Online learning step failed: %s", e)
+        time.sleep(FEEDBACK_PUBLISH_SECONDS)
+
+
+def start():
+    """Starts the learner thread once per process (safe to call on every request)."""
+    global _learner_pid
+    if not FEEDBACK_ENABLED or _learner_pid == os.getpid():
+        return
+    with _learner_lock:
+        if _learner_pid != os.getpid():
+            threading.Thread(target=_learn_loop, name="online-learner", daemon=True).start()
+            _learner_pid = os.getpid()
@@ -0,0 +1,91 @@
+"""
+Cache of extracted article text, keyed by URL.
+
+fetch_url_content consults it before going to the network, and the trending
+pre-screen (prescreen.py) fills it ahead of time. Entries live in a small
+in-process LRU and, unless PAGE_CACHE_DB is empty, in a SQLite file shared by
+every worker process, so a page prefetched by one gunicorn worker is warm for
+all of them. Entries older than PAGE_CACHE_TTL_SECONDS are treated as missing.
+"""
+import os
+import time
+import sqlite3
+import threading
+from collections import OrderedDict
+
+PAGE_CACHE_DB = os.getenv("PAGE_CACHE_DB", "page_cache.db")
+PAGE_CACHE_TTL_SECONDS = float(os.getenv("PAGE_CACHE_TTL_SECONDS", "1800"))
+PAGE_CACHE_SIZE = int(os.getenv("PAGE_CACHE_SIZE", "256"))
+# Longer texts are cut; prompts only ever use the first few thousand chars
+PAGE_CACHE_MAX_CHARS = int(os.getenv("PAGE_CACHE_MAX_CHARS", "50000"))
+PURGE_EVERY = 200
+
+_memory = OrderedDict()
+_lock = threading.Lock()
+_local = threading.local()
+_puts = 0
+
+
+def _connect():
+    conn = getattr(_local, "conn", None)
+    if conn is not None and _local.pid == os.getpid():
+        return conn
+    conn = sqlite3.connect(PAGE_CACHE_DB, timeout=5, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("CREATE TABLE IF NOT EXISTS pages (url TEXT PRIMARY KEY, content TEXT NOT NULL, fetched_at REAL NOT NULL)")
+    _local.conn = conn
+    _local.pid = os.getpid()
+    return conn
+
+
+def _remember(url, content, fetched_at):
+    with _lock:
+        _memory[url] = (content, fetched_at)
+        _memory.move_to_end(url)
+        while len(_memory) > PAGE_CACHE_SIZE:
+            _memory.popitem(last=False)
+
+
+def get(url):
+    """Cached text for url, or None when absent or stale."""
+    now = time.time()
+    with _lock:
+        entry = _memory.get(url)
+        if entry is not None:
+            if now - entry[1] <= PAGE_CACHE_TTL_SECONDS:
+                _memory.move_to_end(url)
+                return entry[0]
+            del _memory[url]
+    if not PAGE_CACHE_DB:
+        return None
+    try:
+        row = _connect().execute(
+            "SELECT content, fetched_at FROM pages WHERE url = ? AND fetched_at > ?",
+            (url, now - PAGE_CACHE_TTL_SECONDS),
+        ).fetchone()
+    except sqlite3.Error:
+        return None
+    if row is None:
+        return None
+    _remember(url, row[0], row[1])
+    return row[0]
+
+
+def put(url, content):
+    global _puts
+    if not content:
+        return
+    content = content[:PAGE_CACHE_MAX_CHARS]
+    now = time.time()
+    _remember(url, content, now)
+    if not PAGE_CACHE_DB:
+        return
+    try:
+        conn = _connect()
+        conn.execute("INSERT OR REPLACE INTO pages (url, content, fetched_at) VALUES (?, ?, ?)", (url, content, now))
+        _puts += 1
+        if _puts % PURGE_EVERY == 0:
+            conn.execute("DELETE FROM pages WHERE fetched_at < ?", (now - PAGE_CACHE_TTL_SECONDS,))
+    except sqlite3.Error:
+        pass
@@ -0,0 +1,357 @@
+"""
+Per-host politeness for outbound scraping (page fetches and DuckDuckGo).
+
+Every request to a host goes through acquire(), which hands out a Slot when
+the host allows it:
+
+    concurrency   at most POLITE_HOST_CONCURRENCY requests in flight per host
+    rate          a token bucket of POLITE_HOST_BURST tokens refilled at
+                  POLITE_HOST_RATE per second (slower when robots.txt sets a
+                  Crawl-delay); a failed request empties it, so a retry waits
+                  for the next token instead of sleeping, and until then
+                  the host's requests are refused at once
+    backoff       a 429 or 503 (or a status the caller names) closes the host
+                  for Retry-After seconds, else POLITE_BACKOFF_SECONDS doubled
+                  per consecutive throttle up to POLITE_MAX_BACKOFF_SECONDS
+    robots.txt    page fetches are refused when the host's robots.txt
+                  disallows the path for POLITE_ROBOTS_AGENT; policies are
+                  cached per host for POLITE_ROBOTS_TTL_SECONDS and a missing
+                  or unreachable robots.txt allows everything; the fetch
+                  takes at most POLITE_ROBOTS_TIMEOUT and the time left to
+                  the request deadline, and is skipped when none is left
+
+A request that cannot go now waits for a slot on a condition variable (or an
+asyncio sleep under asgi_app.py) for at most POLITE_MAX_WAIT_MS, bounded by the
+request deadline. When the wait would be longer (a host in backoff) it raises
+Refused at once, with retry_after, instead of holding a worker.
+
+State is per process, like the search cache's throttle cooldown, so with N
+workers a host sees at most N times these limits.
+
+    with politeness.acquire(url) as slot:
+        response = requests.get(url, timeout=timeout)
+        slot.record(response.status_code, response.headers.get("Retry-After"))
+"""
+import os
+import time
+import asyncio
+import datetime
+import contextvars
+import threading
+from collections import OrderedDict
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlparse
+from urllib.robotparser import RobotFileParser
+
+import deadline
+import debug_log
+import metrics
+
+logger = debug_log.get_logger("politeness")
+
+POLITENESS_ENABLED = os.getenv("POLITENESS_ENABLED", "1") != "0"
+POLITE_HOST_CONCURRENCY = int(os.getenv("POLITE_HOST_CONCURRENCY", "2"))
+POLITE_HOST_RATE = float(os.getenv("POLITE_HOST_RATE", "1"))
+POLITE_HOST_BURST = float(os.getenv("POLITE_HOST_BURST", "3"))
+POLITE_MAX_WAIT_MS = float(os.getenv("POLITE_MAX_WAIT_MS", "1000"))
+POLITE_BACKOFF_SECONDS = float(os.getenv("POLITE_BACKOFF_SECONDS", "30"))
+POLITE_MAX_BACKOFF_SECONDS = float(os.getenv("POLITE_MAX_BACKOFF_SECONDS", "600"))
+POLITE_ROBOTS_ENABLED = os.getenv("POLITE_ROBOTS_ENABLED", "1") != "0"
+POLITE_ROBOTS_AGENT = os.getenv("POLITE_ROBOTS_AGENT", "TrueVail")
+POLITE_ROBOTS_TTL_SECONDS = float(os.getenv("POLITE_ROBOTS_TTL_SECONDS", "3600"))
+POLITE_ROBOTS_TIMEOUT = float(os.getenv("POLITE_ROBOTS_TIMEOUT", "3"))
+# Unreachable robots.txt files are retried sooner than readable ones
+ROBOTS_ERROR_TTL_SECONDS = 300
+THROTTLE_STATUSES = (429, 503)
+MAX_HOSTS = 10000
+# How often an asyncio waiter re-checks a host that is at its concurrency cap
+ASYNC_POLL_SECONDS = 0.05
+
+_lock = threading.Lock()
+_released = threading.Condition(_lock)
+_hosts = OrderedDict()
+_robots = {}
+_robots_fetching = {}
+
+
+class Refused(Exception):
+    """The host cannot be asked now; retry_after is how long until it can, when known."""
+
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class _Host:
+    __slots__ = ("tokens", "updated", "active", "closed_until", "strikes", "rate", "burst", "failed")
+
+    def __init__(self, now):
+        self.tokens = POLITE_HOST_BURST
+        self.updated = now
+        self.active = 0
+        self.closed_until = 0.0
+        self.strikes = 0
+        self.rate = POLITE_HOST_RATE
+        self.burst = POLITE_HOST_BURST
+        self.failed = False
+
+
+def host_of(url):
+    return urlparse(url).netloc.lower()
+
+
+def _state(host, now):
+    """The host's state, created on first use. Holds _lock."""
+    state = _hosts.get(host)
+    if state is None:
+        state = _hosts[host] = _Host(now)
+        if len(_hosts) > MAX_HOSTS:
+            for name, old in list(_hosts.items())[:len(_hosts) - MAX_HOSTS]:
+                if not old.active:
+                    del _hosts[name]
+    else:
+        _hosts.move_to_end(host)
+    return state
+
+
+def _try_take(state, now):
+    """(True, 0) with a slot taken, else (False, seconds to wait or None when unknown). Holds _lock."""
+    if now < state.closed_until:
+        return False, state.closed_until - now
+    if state.active >= POLITE_HOST_CONCURRENCY:
+        return False, None
+    if state.rate > 0:
+        state.tokens = min(state.burst, state.tokens + (now - state.updated) * state.rate)
+    state.updated = now
+    if state.tokens < 1:
+        return False, (1 - state.tokens) / state.rate if state.rate > 0 else None
+    state.tokens -= 1
+    state.active += 1
+    return True, 0
+
+
+def _wait_limit():
+    limit = POLITE_MAX_WAIT_MS / 1000
+    left = deadline.remaining()
+    return limit if left is None else min(limit, left)
+
+
+def parse_retry_after(value):
+    """Seconds from a Retry-After header (delta-seconds or HTTP date), or None."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        pass
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=datetime.timezone.utc)
+    return max(0.0, (when - datetime.datetime.now(datetime.timezone.utc)).total_seconds())
+
+
+class Slot:
+    """One admitted request to a host; report its outcome with record() and leave the with block."""
+
+    def __init__(self, host):
+        self.host = host
+        self.throttled = False
+        self.failed = False
+
+    def record(self, status, retry_after=None, throttle_statuses=THROTTLE_STATUSES):
+        """Notes the response status; returns True when the host throttled us (and is now backed off)."""
+        if status in throttle_statuses or status in THROTTLE_STATUSES:
+            self.throttled = True
+            backoff(self.host, retry_after)
+        elif status >= 500:
+            self.failed = True
+        return self.throttled
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        release(self.host, failed=self.failed or exc_type is not None, throttled=self.throttled)
+
+
+def backoff(host, retry_after=None):
+    """Closes host for Retry-After, else an exponential backoff."""
+    pause = parse_retry_after(retry_after)
+    now = time.monotonic()
+    with _lock:
+        state = _state(host, now)
+        if pause is None:
+            pause = min(POLITE_MAX_BACKOFF_SECONDS, POLITE_BACKOFF_SECONDS * 2 ** state.strikes)
+        state.strikes += 1
+        state.closed_until = max(state.closed_until, now + pause)
+    metrics.inc("truevail_politeness_total", outcome="throttled")
+    logger.warning("%s is throttling; backing off for %.0fs", host, pause)
+
+
+def release(host, failed=False, throttled=False):
+    with _released:
+        state = _hosts.get(host)
+        if state is not None:
+            state.active = max(0, state.active - 1)
+            if failed:
+                # The retry waits for a fresh token rather than going out at once
+                state.tokens = min(state.tokens, 0.0)
+                state.failed = True
+            else:
+                state.failed = False
+                if not throttled:
+                    state.strikes = 0
+        _released.notify_all()
+
+
+def _refuse(host, wait, outcome):
+    metrics.inc("truevail_politeness_total", outcome=outcome)
+    message = f"{host} is backing off" if outcome == "backoff" else f"{host} is busy"
+    raise Refused(message, wait)
+
+
+def _admit(host, now, limit, waited):
+    """Slot, or (wait seconds or None) when the caller may wait; raises Refused. Holds _lock."""
+    state = _state(host, now)
+    taken, wait = _try_take(state, now)
+    if taken:
+        metrics.inc("truevail_politeness_total", outcome="queued" if waited else "admitted")
+        return Slot(host)
+    if state.closed_until > now and wait > limit:
+        _refuse(host, wait, "backoff")
+    # A host that just failed is not waited for: its next token is the retry's
+    if state.failed or (wait is not None and wait > limit):
+        _refuse(host, wait, "busy")
+    if limit <= 0:
+        _refuse(host, wait, "busy")
+    return wait
+
+
+def acquire(url, robots=True):
+    """
+    A Slot for a request to url, waiting up to POLITE_MAX_WAIT_MS for one.
+    Raises Refused when the host is backing off, stays busy, or (with robots)
+    its robots.txt disallows url.
+    """
+    host = host_of(url)
+    if not POLITENESS_ENABLED:
+        return Slot(host)
+    if robots and not robots_allowed(url):
+        metrics.inc("truevail_politeness_total", outcome="disallowed")
+        raise Refused(f"robots.txt of {host} disallows {urlparse(url).path or '/'}")
+    give_up = time.monotonic() + _wait_limit()
+    waited = False
+    with _released:
+        while True:
+            now = time.monotonic()
+            wait = _admit(host, now, give_up - now, waited)
+            if isinstance(wait, Slot):
+                return wait
+            waited = True
+            _released.wait(min(wait if wait is not None else give_up - now, give_up - now))
+
+
+async def acquire_async(url, robots=True):
+    """acquire() for the event loop: waits with asyncio.sleep, fetches robots.txt off the loop."""
+    host = host_of(url)
+    if not POLITENESS_ENABLED:
+        return Slot(host)
+    if robots:
+        allowed = _cached_robots(url)
+        if allowed is None:
+            # In the request's context, so the fetch sees its deadline
+            ctx = contextvars.copy_context()
+            allowed = await asyncio.get_running_loop().run_in_executor(None, ctx.run, robots_allowed, url)
+        if not allowed:
+            metrics.inc("truevail_politeness_total", outcome="disallowed")
+            raise Refused(f"robots.txt of {host} disallows {urlparse(url).path or '/'}")
+    give_up = time.monotonic() + _wait_limit()
+    waited = False
+    while True:
+        now = time.monotonic()
+        with _lock:
+            wait = _admit(host, now, give_up - now, waited)
+        if isinstance(wait, Slot):
+            return wait
+        waited = True
+        await asyncio.sleep(min(wait if wait is not None else ASYNC_POLL_SECONDS, give_up - now))
+
+
+def _robots_url(url):
+    parsed = urlparse(url)
+    return f"{parsed.scheme or 'https'}://{parsed.netloc}/robots.txt"
+
+
+def _fetch_robots(url, timeout=POLITE_ROBOTS_TIMEOUT):
+    """(RobotFileParser or None for allow-all, seconds to keep it)."""
+    import requests
+
+    try:
+        response = requests.get(_robots_url(url), headers={"User-Agent": POLITE_ROBOTS_AGENT}, timeout=timeout)
+    except Exception as e:
+        logger.debug("robots.txt unreachable for %s: %s", host_of(url), e)
+        # Cut short by the deadline it says nothing about the host: ask again next time
+        return None, ROBOTS_ERROR_TTL_SECONDS if timeout >= POLITE_ROBOTS_TIMEOUT else 0
+    if response.status_code >= 500:
+        return None, ROBOTS_ERROR_TTL_SECONDS
+    if response.status_code >= 400:
+        return None, POLITE_ROBOTS_TTL_SECONDS
+    parser = RobotFileParser()
+    parser.parse(response.text.splitlines())
+    return parser, POLITE_ROBOTS_TTL_SECONDS
+
+
+def _apply_crawl_delay(host, parser):
+    delay = parser.crawl_delay(POLITE_ROBOTS_AGENT) if parser is not None else None
+    with _lock:
+        state = _state(host, time.monotonic())
+        if delay:
+            state.rate = min(POLITE_HOST_RATE, 1 / float(delay))
+            state.burst = 1.0
+            state.tokens = min(state.tokens, state.burst)
+        else:
+            state.rate, state.burst = POLITE_HOST_RATE, POLITE_HOST_BURST
+
+
+def _cached_robots(url):
+    """True/False from a fresh cached policy, None when robots.txt has to be fetched."""
+    if not POLITE_ROBOTS_ENABLED:
+        return True
+    entry = _robots.get(host_of(url))
+    if entry is None or time.monotonic() >= entry[1]:
+        return None
+    return entry[0] is None or entry[0].can_fetch(POLITE_ROBOTS_AGENT, url)
+
+
+def robots_allowed(url):
+    """Whether the host's robots.txt lets POLITE_ROBOTS_AGENT fetch url (fetched and cached per host)."""
+    allowed = _cached_robots(url)
+    if allowed is not None:
+        return allowed
+    left = deadline.remaining()
+    if left is not None and left <= 0:
+        # No time to ask; the page fetch itself is skipped or cut short by the deadline too
+        return True
+    host = host_of(url)
+    with _lock:
+        fetching = _robots_fetching.setdefault(host, threading.Lock())
+    # One fetch per host; concurrent requests wait for it and use its result
+    with fetching:
+        allowed = _cached_robots(url)
+        if allowed is not None:
+            return allowed
+        left = deadline.remaining()
+        parser, ttl = _fetch_robots(url, POLITE_ROBOTS_TIMEOUT if left is None else min(POLITE_ROBOTS_TIMEOUT, left))
+        now = time.monotonic()
+        if len(_robots) >= MAX_HOSTS:
+            for name, entry in list(_robots.items()):
+                if now >= entry[1]:
+                    _robots.pop(name, None)
+        _robots[host] = (parser, now + ttl)
+        _apply_crawl_delay(host, parser)
+    with _lock:
+        _robots_fetching.pop(host, None)
+    return parser is None or parser.can_fetch(POLITE_ROBOTS_AGENT, url)
@@ -0,0 +1,155 @@
+"""
+Pre-screening of trending articles.
+
+The URLs in the trending feed are the ones users paste into /analyze a few
+minutes later, so every trending refresh is used to get ahead of them:
+
+    1. synchronously, the local detector scores all headlines (title +
+       description) in one batch and the domain heuristics run on each URL;
+       the resulting credibility (0-100) is attached to the trending payload
+    2. in the background, the articles are fetched and extracted into the
+       page cache (page_cache.py), then re-scored on their full text
+
+Because the page cache is shared between workers, a later /analyze of a
+trending URL skips the fetch and goes straight to analysis; the analysis
+itself still runs. Verdicts are kept per process for PRESCREEN_TTL_SECONDS; a
+content-based verdict replaces the headline-based one once it is available.
+/analyze only answers from one (analyzer.prescreen_result) when its request
+budget runs out before the AI call, and only in the process that screened the
+feed; elsewhere the heuristics answer as before.
+"""
+import os
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+import debug_log
+import metrics
+
+logger = debug_log.get_logger("prescreen")
+
+PRESCREEN_ENABLED = os.getenv("PRESCREEN_ENABLED", "1") != "0"
+PRESCREEN_TTL_SECONDS = float(os.getenv("PRESCREEN_TTL_SECONDS", "3600"))
+PRESCREEN_FETCH_WORKERS = int(os.getenv("PRESCREEN_FETCH_WORKERS", "4"))
+PRESCREEN_MAX_ARTICLES = int(os.getenv("PRESCREEN_MAX_ARTICLES", "60"))
+MAX_VERDICTS = 2000
+
+# How much the source's reputation weighs against the text-based score
+DOMAIN_WEIGHT = 0.3
+DOMAIN_SCORES = {"Trusted Source": 0.9, "Neutral Source": 0.5, "Suspicious Source": 0.2}
+
+_verdicts = {}
+_verdicts_lock = threading.Lock()
+_running = threading.Lock()
+
+
+def credibility(detection, domain_result):
+    """Combines a detector result and a domain verdict into a 0-100 score."""
+    real_probability = detection["confidence"] if detection["status"] == "Likely Real" else 1 - detection["confidence"]
+    domain_score = DOMAIN_SCORES.get(domain_result["status"], 0.5)
+    return round(100 * ((1 - DOMAIN_WEIGHT) * real_probability + DOMAIN_WEIGHT * domain_score))
+
+
+def get_verdict(url):
+    """The stored pre-screen verdict for url, or None when missing or stale."""
+    with _verdicts_lock:
+        verdict = _verdicts.get(url)
+    if verdict and time.time() - verdict["screened_at"] <= PRESCREEN_TTL_SECONDS:
+        return verdict
+    return None
+
+
+def _store(url, verdict):
+    with _verdicts_lock:
+        _verdicts[url] = verdict
+        if len(_verdicts) > MAX_VERDICTS:
+            # Drop the oldest verdicts first
+            for stale in sorted(_verdicts, key=lambda key: _verdicts[key]["screened_at"])[:len(_verdicts) - MAX_VERDICTS]:
+                del _verdicts[stale]
+
+
+def _score_batch(items, basis):
+    """items: [(url, text)]; scores them with one detector pass and stores the verdicts."""
+    from analyzer import analyze_url
+    from fake_news_detection import detect_fake_news_batch
+
+    detections = detect_fake_news_batch([text for _, text in items])
+    now = time.time()
+    for (url, _), detection in zip(items, detections):
+        domain_result = analyze_url(urlparse(url).netloc)
+        _store(url, {
+            "credibility": credibility(detection, domain_result),
+            "status": detection["status"],
+            "confidence": detection["confidence"],
+            "source_status": domain_result["status"],
+            "basis": basis,
+            "screened_at": now,
+        })
+
+
+def screen_headlines(articles):
+    """Scores the headlines of articles that have no fresh verdict yet."""
+    items = []
+    for article in articles[:PRESCREEN_MAX_ARTICLES]:
+        url = article.get("url")
+        if url and get_verdict(url) is None:
+            headline = f"{article.get('title', '')}. {article.get('description', '')}".strip()
+            items.append((url, headline))
+    if items:
+        with metrics.stage("prescreen_headlines"):
+            _score_batch(items, "headline")
+
+
+def prefetch_and_rescore(urls):
+    """Fetches articles into the page cache and re-scores them on their full text."""
+    from analyzer import fetch_url_content
+
+    pending = []
+    for url in urls:
+        verdict = get_verdict(url)
+        if verdict is None or verdict["basis"] != "content":
+            pending.append(url)
+    if not pending:
+        return
+    with metrics.stage("prescreen_prefetch"):
+        with ThreadPoolExecutor(max_workers=PRESCREEN_FETCH_WORKERS) as executor:
+            contents = list(executor.map(fetch_url_content, pending))
+    items = [(url, content) for url, content in zip(pending, contents) if content]
+    if items:
+        with metrics.stage("prescreen_content"):
+            _score_batch(items, "content")
+    logger.debug("Pre-screened %s of %s trending articles on full text", len(items), len(pending))
+
+
+def _background(urls):
+    try:
+        prefetch_and_rescore(urls)
+    except Exception as e:
+        logger.warning("Trending pre-screen failed: %s", e)
+    finally:
+        _running.release()
+
+
+def screen_trending(payload):
+    """
+    Attaches credibility to each trending article and starts the background
+    prefetch (skipped while a previous one is still running). Returns payload.
+    """
+    articles = payload.get("trending_news") if isinstance(payload, dict) else None
+    if not PRESCREEN_ENABLED or not articles:
+        return payload
+    try:
+        screen_headlines(articles)
+    except Exception as e:
+        logger.warning("Headline pre-screen failed: %s", e)
+    for article in articles:
+        verdict = get_verdict(article.get("url"))
+        if verdict:
+            article["credibility"] = verdict["credibility"]
+            article["credibility_basis"] = verdict["basis"]
+
+    if _running.acquire(blocking=False):
+        urls = [article["url"] for article in articles[:PRESCREEN_MAX_ARTICLES] if article.get("url")]
+        threading.Thread(target=_background, args=(urls,), name="trending-prescreen", daemon=True).start()
+    return payload
@@ -0,0 +1,118 @@
+"""
+On-demand statistical profiler for individual /analyze requests.
+
+When a request is selected for profiling, a sampler thread periodically
+captures the request thread's Python stack (sys._current_frames) and counts
+identical stacks. The result is written as a collapsed-stack file
+(PROFILE_DIR/<profile_id>.folded) that flamegraph.pl, speedscope or inferno
+can render directly. The profile id is generated here, never taken from the
+client, and it is the only thing the response reveals (X-Profile-Id).
+Requests that are not selected pay nothing beyond the selection check.
+
+A request is profiled when:
+    - it carries an X-Profile header equal to PROFILE_TOKEN (the header is
+      ignored while PROFILE_TOKEN is unset), or
+    - it is picked by PROFILE_SAMPLE_RATE (fraction of requests, default 0)
+"""
+import os
+import sys
+import time
+import uuid
+import random
+import threading
+from contextlib import contextmanager
+
+PROFILE_TOKEN = os.getenv("PROFILE_TOKEN", "")
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+PROFILE_MAX_DEPTH = 128
+
+
+def should_profile(header_value):
+    """Decides whether the current request gets profiled."""
+    if PROFILE_TOKEN and header_value and header_value == PROFILE_TOKEN:
+        return True
+    return PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE
+
+
+def _frame_label(frame):
+    code = frame.f_code
+    filename = os.path.basename(code.co_filename)
+    # ';' separates frames in the collapsed format, so keep it out of labels
+    return f"{code.co_name} ({filename}:{code.co_firstlineno})".replace(";", ":")
+
+
+class SamplingProfiler:
+    """Samples one thread's stack at a fixed interval until stopped."""
+
+    def __init__(self, thread_id, interval=PROFILE_INTERVAL_MS / 1000.0):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = {}
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="request-profiler", daemon=True)
+
+    def start(self):
+        self.started_at = time.perf_counter()
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self.duration = time.perf_counter() - self.started_at
+        return self
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            labels = []
+            while frame is not None and len(labels) < PROFILE_MAX_DEPTH:
+                labels.append(_frame_label(frame))
+                frame = frame.f_back
+            stack = ";".join(reversed(labels))
+            self.stacks[stack] = self.stacks.get(stack, 0) + 1
+            self.samples += 1
+
+    def collapsed(self):
+        """Stacks in Brendan Gregg's collapsed format, one 'a;b;c count' per line."""
+        return "\n".join(f"{stack} {count}" for stack, count in sorted(self.stacks.items())) + "\n"
+
+    def write(self, profile_id):
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        path = os.path.join(PROFILE_DIR, f"{profile_id}.folded")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(self.collapsed())
+        return path
+
+
+@contextmanager
+def profile_request(enabled):
+    """
+    Profiles the enclosed block on the current thread when enabled.
+
+    Yields a dict that receives the generated profile id, its path, the sample
+    count and the duration once the block finishes (left empty when profiling
+    is off).
+    """
+    info = {}
+    if not enabled:
+        yield info
+        return
+    profiler = SamplingProfiler(threading.get_ident()).start()
+    try:
+        yield info
+    finally:
+        profiler.stop()
+        profile_id = uuid.uuid4().hex
+        try:
+            info["path"] = profiler.write(profile_id)
+            info["id"] = profile_id
+        except OSError:
+            info["path"] = None
+        info["samples"] = profiler.samples
+        info["duration"] = round(profiler.duration, 4)
@@ -0,0 +1,160 @@
+"""
+Per-client admission control for the analysis endpoints.
+
+Every client has a token bucket per kind of request, stored in SQLite
+(RATE_LIMIT_DB) so that all gunicorn workers share it. The client is its
+X-API-Key when that key is one of RATE_LIMIT_API_KEYS, else its IP address:
+an unknown key is ignored, so minting keys does not mint buckets. A bucket
+holds up to RATE_LIMIT_BURST tokens and refills at RATE_LIMIT_PER_MINUTE; a
+request costs RATE_LIMIT_COSTS tokens by what it asks for:
+
+    text        a pasted claim or article (1)
+    url         a page we fetch, search around and send to the LLM (3)
+    deepfake    media sent to the vision model (10)
+
+A request the bucket cannot pay for is answered 429 with Retry-After (the
+seconds until enough tokens are back), without touching the analyzer, so one
+client cannot spend the Gemini quota or the workers of everyone else. When the
+database cannot be reached the request is let through.
+"""
+import os
+import math
+import time
+import sqlite3
+import hashlib
+import threading
+
+import debug_log
+import metrics
+
+logger = debug_log.get_logger("rate_limit")
+
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "1") != "0"
+RATE_LIMIT_DB = os.getenv("RATE_LIMIT_DB", "rate_limit.db")
+RATE_LIMIT_PER_MINUTE = float(os.getenv("RATE_LIMIT_PER_MINUTE", "30"))
+RATE_LIMIT_BURST = float(os.getenv("RATE_LIMIT_BURST", "60"))
+RATE_LIMIT_COSTS = os.getenv("RATE_LIMIT_COSTS", "text=1,url=3,deepfake=10")
+# Behind a reverse proxy the client is the first X-Forwarded-For hop
+RATE_LIMIT_TRUST_PROXY = os.getenv("RATE_LIMIT_TRUST_PROXY", "0") == "1"
+KINDS = ("text", "url", "deepfake")
+PURGE_EVERY = 1000
+
+_local = threading.local()
+_checks = 0
+
+
+def parse_costs(spec):
+    """{kind: cost} from "text=1,url=3,deepfake=10"."""
+    costs = {"text": 1.0, "url": 3.0, "deepfake": 10.0}
+    for entry in filter(None, (part.strip() for part in spec.split(","))):
+        kind, _, cost = entry.partition("=")
+        costs[kind.strip()] = float(cost)
+    return costs
+
+
+def _key_hash(api_key):
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()
+
+
+COSTS = parse_costs(RATE_LIMIT_COSTS)
+# Only hashes are kept, so membership checks compare digests, not keys
+API_KEYS = frozenset(_key_hash(key.strip()) for key in os.getenv("RATE_LIMIT_API_KEYS", "").split(",") if key.strip())
+
+
+def client_id(api_key=None, remote_addr=None, forwarded_for=None):
+    """Bucket owner: a hash of the API key when it is a known one, else the client IP."""
+    if api_key and _key_hash(api_key) in API_KEYS:
+        return "key:" + _key_hash(api_key)[:24]
+    if RATE_LIMIT_TRUST_PROXY and forwarded_for:
+        return "ip:" + forwarded_for.split(",")[0].strip()
+    return "ip:" + (remote_addr or "unknown")
+
+
+def request_kind(text, analysis_type, image_data=None):
+    """'deepfake', 'url' or 'text': what the request costs."""
+    if analysis_type == "deepfake" or image_data:
+        return "deepfake"
+    if text and text.strip().startswith(("http://", "https://")):
+        return "url"
+    return "text"
+
+
+def _connect():
+    conn = getattr(_local, "conn", None)
+    if conn is not None and _local.pid == os.getpid():
+        return conn
+    conn = sqlite3.connect(RATE_LIMIT_DB, timeout=2, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    if "analysis_type" in {row[1] for row in conn.execute("PRAGMA table_info(buckets)")}:
+        # Buckets used to be per analysis_type; they only hold transient state
+        conn.execute("DROP TABLE IF EXISTS buckets")
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS buckets ("
+        " client TEXT NOT NULL, kind TEXT NOT NULL, tokens REAL NOT NULL, updated_at REAL NOT NULL,"
+        " PRIMARY KEY (client, kind))"
+    )
+    _local.conn = conn
+    _local.pid = os.getpid()
+    return conn
+
+
+def _take(conn, client, kind, cost, now):
+    rate = RATE_LIMIT_PER_MINUTE / 60
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        row = conn.execute(
+            "SELECT tokens, updated_at FROM buckets WHERE client = ? AND kind = ?", (client, kind)
+        ).fetchone()
+        tokens = RATE_LIMIT_BURST if row is None else min(RATE_LIMIT_BURST, row[0] + max(0.0, now - row[1]) * rate)
+        allowed = tokens >= cost
+        if allowed:
+            tokens -= cost
+        conn.execute(
+            "INSERT OR REPLACE INTO buckets (client, kind, tokens, updated_at) VALUES (?, ?, ?, ?)",
+            (client, kind, tokens, now),
+        )
+        conn.execute("COMMIT")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    retry_after = 0.0 if allowed else (cost - tokens) / rate if rate > 0 else float("inf")
+    return allowed, retry_after
+
+
+def _purge(conn, now):
+    # A bucket idle long enough to have refilled completely is the same as no bucket
+    if RATE_LIMIT_PER_MINUTE > 0:
+        idle = RATE_LIMIT_BURST / (RATE_LIMIT_PER_MINUTE / 60)
+        conn.execute("DELETE FROM buckets WHERE updated_at < ?", (now - idle,))
+
+
+def admit(client, kind="text"):
+    """
+    Charges the client's bucket for one request of kind (see request_kind);
+    returns (allowed, retry_after seconds). retry_after is 0 when allowed.
+    """
+    global _checks
+    if not RATE_LIMIT_ENABLED:
+        return True, 0
+    kind = kind if kind in KINDS else "text"
+    # A request dearer than the whole bucket would never be admitted
+    cost = min(COSTS.get(kind, 1.0), RATE_LIMIT_BURST)
+    now = time.time()
+    try:
+        conn = _connect()
+        allowed, retry_after = _take(conn, client, kind, cost, now)
+        _checks += 1
+        if _checks % PURGE_EVERY == 0:
+            _purge(conn, now)
+    except sqlite3.Error as e:
+        logger.warning("Rate limit check failed, admitting: %s", e)
+        metrics.inc("truevail_rate_limit_total", kind=kind, decision="error")
+        return True, 0
+    metrics.inc("truevail_rate_limit_total", kind=kind, decision="allowed" if allowed else "throttled")
+    return allowed, retry_after
+
+
+def retry_after_header(retry_after):
+    """Retry-After value: whole seconds, at least 1."""
+    return str(max(1, math.ceil(retry_after))) if retry_after != float("inf") else "3600"
@@ -0,0 +1,272 @@
+"""
+Cache in front of the DuckDuckGo search used for real-time context.
+
+Queries are normalized before they are sent or looked up (lowercased; URLs,
+punctuation, leading "BREAKING"-style noise words and stop words removed;
+repeated words dropped; capped at SEARCH_QUERY_MAX_TERMS words), so
+"BREAKING: Countries agree to methane cuts!!" and "countries agree methane
+cuts" are one cache entry and one search.
+
+    - result lists are kept for SEARCH_CACHE_TTL_SECONDS
+    - searches that found nothing, and searches that failed, are remembered
+      for SEARCH_CACHE_NEGATIVE_TTL_SECONDS so they are not retried on every
+      request
+    - when a refresh fails, an expired result list younger than
+      SEARCH_CACHE_STALE_SECONDS is served instead
+    - when DuckDuckGo throttles (HTTP 202/403/429), no searches are sent for
+      Retry-After or SEARCH_THROTTLE_COOLDOWN_SECONDS; cached and stale lists
+      keep being served meanwhile
+    - concurrent requests for the same query share one search (single-flight)
+
+The cache is per process, bounded by SEARCH_CACHE_SIZE entries (least recently
+used first out), saved to SEARCH_CACHE_PATH in the background and at exit, and
+warm-loaded from it on first use. Set SEARCH_CACHE_PATH to "" to keep it in
+memory only.
+"""
+import os
+import json
+import time
+import atexit
+import asyncio
+import threading
+from collections import OrderedDict
+
+import debug_log
+import metrics
+from near_duplicate import normalize_tokens
+
+logger = debug_log.get_logger("search_cache")
+
+SEARCH_CACHE_ENABLED = os.getenv("SEARCH_CACHE_ENABLED", "1") != "0"
+SEARCH_CACHE_TTL_SECONDS = float(os.getenv("SEARCH_CACHE_TTL_SECONDS", "21600"))
+SEARCH_CACHE_NEGATIVE_TTL_SECONDS = float(os.getenv("SEARCH_CACHE_NEGATIVE_TTL_SECONDS", "300"))
+SEARCH_CACHE_STALE_SECONDS = float(os.getenv("SEARCH_CACHE_STALE_SECONDS", "86400"))
+SEARCH_CACHE_SIZE = int(os.getenv("SEARCH_CACHE_SIZE", "5000"))
+SEARCH_CACHE_PATH = os.getenv("SEARCH_CACHE_PATH", "search_cache.json")
+SEARCH_CACHE_SAVE_EVERY = int(os.getenv("SEARCH_CACHE_SAVE_EVERY", "50"))
+SEARCH_THROTTLE_COOLDOWN_SECONDS = float(os.getenv("SEARCH_THROTTLE_COOLDOWN_SECONDS", "60"))
+SEARCH_QUERY_MAX_TERMS = int(os.getenv("SEARCH_QUERY_MAX_TERMS", "12"))
+# Links kept per query, whatever max_results the caller asked for
+SEARCH_CACHE_RESULTS = 5
+# How long a request without a deadline waits for another thread's identical search
+SEARCH_WAIT_SECONDS = 15
+
+# DuckDuckGo answers rate-limited clients with an anomaly page (202) or 403/429
+THROTTLE_STATUSES = (202, 403, 429)
+
+# key -> {"links": list or None (failed), "stored_at": t, "expires": t}
+_entries = OrderedDict()
+_lock = threading.Lock()
+_inflight = {}
+_inflight_async = {}
+_loaded = False
+_saving = threading.Lock()
+_stored_since_save = 0
+_cooldown_until = 0.0
+
+
+def normalize_query(query):
+    """The query as sent to DuckDuckGo and used as the cache key."""
+    from fake_news_detection import load_stop_words
+
+    stop_words = load_stop_words()
+    words = []
+    for word in normalize_tokens(query or ""):
+        if word not in stop_words and word not in words:
+            words.append(word)
+            if len(words) >= SEARCH_QUERY_MAX_TERMS:
+                break
+    if not words:
+        return " ".join((query or "").lower().split())
+    return " ".join(words)
+
+
+def throttled(retry_after=None):
+    """Records a throttling response; searches pause for Retry-After or the default cooldown."""
+    global _cooldown_until
+    try:
+        pause = float(retry_after)
+    except (TypeError, ValueError):
+        pause = SEARCH_THROTTLE_COOLDOWN_SECONDS
+    _cooldown_until = max(_cooldown_until, time.time() + pause)
+    metrics.inc("truevail_stage_errors_total", stage="search", error="Throttled")
+    logger.warning("DuckDuckGo is throttling; pausing searches for %.0fs", pause)
+
+
+def cooling_down():
+    return time.time() < _cooldown_until
+
+
+def _load():
+    global _loaded
+    if _loaded:
+        return
+    _loaded = True
+    if not SEARCH_CACHE_PATH:
+        return
+    atexit.register(save)
+    if not os.path.exists(SEARCH_CACHE_PATH):
+        return
+    try:
+        with open(SEARCH_CACHE_PATH, encoding="utf-8") as f:
+            saved = json.load(f)
+    except (OSError, ValueError) as e:
+        logger.warning("Could not load search cache: %s", e)
+        return
+    now = time.time()
+    for key, links, stored_at in saved.get("entries", []):
+        if now - stored_at <= SEARCH_CACHE_STALE_SECONDS:
+            _entries[key] = {"links": links, "stored_at": stored_at, "expires": stored_at + SEARCH_CACHE_TTL_SECONDS}
+    logger.debug("Loaded %s search cache entries from %s", len(_entries), SEARCH_CACHE_PATH)
+
+
+def save():
+    """Writes the cached result lists atomically to SEARCH_CACHE_PATH."""
+    global _stored_since_save
+    if not SEARCH_CACHE_PATH:
+        return
+    with _saving:
+        with _lock:
+            entries = [[key, entry["links"], entry["stored_at"]] for key, entry in _entries.items() if entry["links"]]
+            _stored_since_save = 0
+        tmp_path = f"{SEARCH_CACHE_PATH}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"entries": entries}, f)
+            os.replace(tmp_path, SEARCH_CACHE_PATH)
+        except OSError as e:
+            logger.warning("Could not save search cache: %s", e)
+
+
+def _lookup(key, now):
+    """(True, links) for an entry that may be served without searching, else (False, None). Holds _lock."""
+    entry = _entries.get(key)
+    if entry is None:
+        return False, None
+    if now < entry["expires"]:
+        _entries.move_to_end(key)
+        return True, entry["links"]
+    if now - entry["stored_at"] > SEARCH_CACHE_STALE_SECONDS:
+        del _entries[key]
+    return False, None
+
+
+def _stale(key):
+    entry = _entries.get(key)
+    return entry["links"] if entry and entry["links"] else None
+
+
+def _store(key, links):
+    """Records a search outcome (links, [] or None) and returns the list to serve. Holds _lock."""
+    global _stored_since_save
+    now = time.time()
+    if links is None:
+        stale = _stale(key)
+        if stale:
+            # Keep serving the old list, and only retry once the negative TTL is over
+            _entries[key]["expires"] = now + SEARCH_CACHE_NEGATIVE_TTL_SECONDS
+            return stale
+        _entries[key] = {"links": None, "stored_at": now, "expires": now + SEARCH_CACHE_NEGATIVE_TTL_SECONDS}
+    elif not links:
+        _entries[key] = {"links": [], "stored_at": now, "expires": now + SEARCH_CACHE_NEGATIVE_TTL_SECONDS}
+    else:
+        _entries[key] = {"links": links[:SEARCH_CACHE_RESULTS], "stored_at": now, "expires": now + SEARCH_CACHE_TTL_SECONDS}
+        _stored_since_save += 1
+    _entries.move_to_end(key)
+    served = _entries[key]["links"]
+    while len(_entries) > SEARCH_CACHE_SIZE:
+        _entries.popitem(last=False)
+    return served
+
+
+def _maybe_save():
+    if SEARCH_CACHE_PATH and _stored_since_save >= SEARCH_CACHE_SAVE_EVERY and not _saving.locked():
+        threading.Thread(target=save, name="search-cache-save", daemon=True).start()
+
+
+def _serve(links, max_results):
+    return None if links is None else links[:max_results]
+
+
+def _begin(key):
+    """Cache check under the lock: ("hit", links), ("cooldown", links), ("lead", None) or ("wait", flight)."""
+    now = time.time()
+    with _lock:
+        _load()
+        found, links = _lookup(key, now)
+        if found:
+            return "hit", links
+        if cooling_down():
+            return "cooldown", _stale(key)
+        flight = _inflight.get(key)
+        if flight is not None:
+            return "wait", flight
+        _inflight[key] = threading.Event()
+        return "lead", None
+
+
+def _finish(key, links):
+    with _lock:
+        served = _store(key, links)
+        _inflight.pop(key).set()
+    _maybe_save()
+    return served
+
+
+def cached_search(query, max_results, search):
+    """
+    Results for query via the cache; search(normalized_query, count) does the
+    real lookup and returns a list of links, [] for none, or None on failure.
+    """
+    if not SEARCH_CACHE_ENABLED:
+        return search(normalize_query(query), max_results)
+    key = normalize_query(query)
+    state, value = _begin(key)
+    metrics.record_cache("search", state == "hit")
+    if state in ("hit", "cooldown"):
+        return _serve(value, max_results)
+    if state == "wait":
+        import deadline
+
+        remaining = deadline.remaining()
+        value.wait(remaining if remaining is not None else SEARCH_WAIT_SECONDS)
+        with _lock:
+            found, links = _lookup(key, time.time())
+            return _serve(links if found else _stale(key), max_results)
+    links = None
+    try:
+        links = search(key, max(max_results, SEARCH_CACHE_RESULTS))
+    finally:
+        served = _finish(key, links)
+    return _serve(served, max_results)
+
+
+async def cached_search_async(query, max_results, search):
+    """cached_search for the event loop; search is a coroutine function."""
+    if not SEARCH_CACHE_ENABLED:
+        return await search(normalize_query(query), max_results)
+    key = normalize_query(query)
+    now = time.time()
+    with _lock:
+        _load()
+        found, links = _lookup(key, now)
+        stale = _stale(key)
+    metrics.record_cache("search", found)
+    if found:
+        return _serve(links, max_results)
+    if cooling_down():
+        return _serve(stale, max_results)
+    flight = _inflight_async.get(key)
+    if flight is not None:
+        return _serve(await asyncio.shield(flight), max_results)
+    flight = _inflight_async[key] = asyncio.get_running_loop().create_future()
+    links = None
+    try:
+        links = await search(key, max(max_results, SEARCH_CACHE_RESULTS))
+    finally:
+        with _lock:
+            served = _store(key, links)
+        del _inflight_async[key]
+        flight.set_result(served)
+        _maybe_save()
+    return _serve(served, max_results)
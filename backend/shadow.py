@@ -0,0 +1,312 @@
+"""
+Shadow evaluation of candidate detectors and prompts on live traffic.
+
+A sample (SHADOW_SAMPLE_RATE) of text /analyze requests is mirrored to every
+candidate in SHADOW_CANDIDATES after the production answer has been computed.
+mirror() only draws a random number and does a non-blocking put on a queue
+bounded by SHADOW_QUEUE_SIZE; when the queue is full the sample is dropped,
+so shadow work never delays a user. SHADOW_WORKERS background threads run the
+candidates and store one comparison row per candidate in SQLite (SHADOW_DB),
+shared by all worker processes:
+
+    agreement   production vs candidate verdict (real / fake / uncertain)
+    latency     production request time vs candidate time
+    cost        estimated LLM tokens and CPU seconds spent by the candidate
+
+GET /shadow/report aggregates the last SHADOW_REPORT_HOURS per candidate. It
+quotes excerpts of user texts, so it is only served with an X-Admin-Token
+header equal to SHADOW_REPORT_TOKEN (never while that is unset).
+
+Candidates are "name=kind:path" entries separated by commas:
+
+    model:/srv/models/next.tvm            an exported compact model (compact_model.py)
+    model:/srv/models/next.joblib         a FakeNewsDetector saved with save_model()
+    ollama-prompt:/srv/prompts/terse.txt  a prompt template for Ollama, {content} is the text
+    gemini-prompt:/srv/prompts/terse.txt  the same for Gemini
+
+e.g. SHADOW_CANDIDATES="next=model:/srv/models/next.tvm,terse=ollama-prompt:prompts/terse.txt"
+"""
+import os
+import hmac
+import time
+import queue
+import random
+import sqlite3
+import threading
+
+import debug_log
+import metrics
+
+logger = debug_log.get_logger("shadow")
+
+SHADOW_CANDIDATES = os.getenv("SHADOW_CANDIDATES", "")
+SHADOW_SAMPLE_RATE = float(os.getenv("SHADOW_SAMPLE_RATE", "0.05"))
+SHADOW_QUEUE_SIZE = int(os.getenv("SHADOW_QUEUE_SIZE", "100"))
+SHADOW_WORKERS = int(os.getenv("SHADOW_WORKERS", "1"))
+SHADOW_TIMEOUT_SECONDS = float(os.getenv("SHADOW_TIMEOUT_SECONDS", "30"))
+SHADOW_DB = os.getenv("SHADOW_DB", "shadow.db")
+SHADOW_REPORT_HOURS = float(os.getenv("SHADOW_REPORT_HOURS", "24"))
+SHADOW_RETENTION_DAYS = float(os.getenv("SHADOW_RETENTION_DAYS", "7"))
+SHADOW_REPORT_TOKEN = os.getenv("SHADOW_REPORT_TOKEN", "")
+# Disagreements kept per candidate in the report
+REPORT_EXAMPLES = 5
+PURGE_EVERY = 500
+
+_queue = queue.Queue(maxsize=SHADOW_QUEUE_SIZE)
+_local = threading.local()
+_workers_lock = threading.Lock()
+_workers_pid = None
+_candidates = None
+_stored = 0
+
+
+def verdict_class(result):
+    """'real', 'fake' or 'uncertain' for an analysis result."""
+    status = str(result.get("status", "")).lower() if isinstance(result, dict) else ""
+    if "fake" in status:
+        return "fake"
+    if "real" in status:
+        return "real"
+    return "uncertain"
+
+
+def parse_candidates(spec):
+    """[(name, kind, path)] from a SHADOW_CANDIDATES string; raises ValueError on bad entries."""
+    candidates = []
+    for entry in filter(None, (part.strip() for part in spec.split(","))):
+        name, _, target = entry.partition("=")
+        kind, _, path = target.partition(":")
+        if not name or kind not in ("model", "ollama-prompt", "gemini-prompt") or not path:
+            raise ValueError(f"bad shadow candidate {entry!r}; expected name=model|ollama-prompt|gemini-prompt:path")
+        candidates.append((name.strip(), kind, path.strip()))
+    return candidates
+
+
+def _load_model(path):
+    import compact_model
+
+    with open(path, "rb") as f:
+        is_compact = f.read(len(compact_model.MAGIC)) == compact_model.MAGIC
+    if is_compact:
+        return compact_model.CompactModel(path)
+    from fake_news_detection import FakeNewsDetector
+
+    detector = FakeNewsDetector()
+    detector.load_model(path)
+    return detector
+
+
+def _model_runner(model):
+    def run(content):
+        return model.predict(content), 0
+    return run
+
+
+def _prompt_runner(kind, template):
+    import analyzer
+    from compaction import estimate_tokens
+
+    def run(content):
+        prompt = template.replace("{content}", content)
+        if kind == "ollama-prompt":
+            reply = analyzer.call_ollama(prompt, model=analyzer.OLLAMA_MODEL_TEXT, timeout=SHADOW_TIMEOUT_SECONDS)
+            if reply.startswith("Error"):
+                raise RuntimeError(reply)
+        else:
+            model = analyzer.get_gemini_model()
+            if model is None:
+                raise RuntimeError("Gemini is not configured")
+            response = model.generate_content(
+                prompt,
+                generation_config={"temperature": 0.1, "max_output_tokens": 250},
+                request_options={"timeout": SHADOW_TIMEOUT_SECONDS},
+            )
+            reply = response.text
+        return analyzer.parse_ai_response(reply), estimate_tokens(prompt) + estimate_tokens(reply)
+    return run
+
+
+def _load_candidates():
+    global _candidates
+    if _candidates is None:
+        candidates = {}
+        try:
+            specs = parse_candidates(SHADOW_CANDIDATES)
+        except ValueError as e:
+            logger.warning("Shadow evaluation disabled: %s", e)
+            specs = []
+        for name, kind, path in specs:
+            try:
+                if kind == "model":
+                    candidates[name] = _model_runner(_load_model(path))
+                else:
+                    with open(path, encoding="utf-8") as f:
+                        candidates[name] = _prompt_runner(kind, f.read())
+            except (OSError, ValueError) as e:
+                logger.warning("Shadow candidate %s not loaded: %s", name, e)
+        _candidates = candidates
+    return _candidates
+
+
+def _connect():
+    conn = getattr(_local, "conn", None)
+    if conn is not None and _local.pid == os.getpid():
+        return conn
+    conn = sqlite3.connect(SHADOW_DB, timeout=10, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS comparisons ("
+        " id INTEGER PRIMARY KEY AUTOINCREMENT, candidate TEXT NOT NULL, created_at REAL NOT NULL,"
+        " production TEXT NOT NULL, shadow TEXT, agree INTEGER, production_seconds REAL,"
+        " shadow_seconds REAL, tokens INTEGER, cpu_seconds REAL, error TEXT, excerpt TEXT)"
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS comparisons_time ON comparisons (candidate, created_at)")
+    _local.conn = conn
+    _local.pid = os.getpid()
+    return conn
+
+
+def _store(rows):
+    global _stored
+    conn = _connect()
+    conn.executemany(
+        "INSERT INTO comparisons (candidate, created_at, production, shadow, agree, production_seconds,"
+        " shadow_seconds, tokens, cpu_seconds, error, excerpt) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        rows,
+    )
+    _stored += len(rows)
+    if _stored % PURGE_EVERY < len(rows):
+        conn.execute("DELETE FROM comparisons WHERE created_at < ?", (time.time() - SHADOW_RETENTION_DAYS * 86400,))
+
+
+def run_sample(text, production_result, production_seconds):
+    """Runs every candidate on one mirrored request and stores the comparisons."""
+    content = text
+    if text.strip().startswith(("http://", "https://")):
+        from analyzer import fetch_url_content
+        # The production request has just fetched it, so this is a page cache hit
+        content = fetch_url_content(text.strip())
+        if not content:
+            return
+    production = verdict_class(production_result)
+    now = time.time()
+    rows = []
+    for name, run in _load_candidates().items():
+        started, cpu_started = time.perf_counter(), time.thread_time()
+        shadow = tokens = error = None
+        try:
+            result, tokens = run(content)
+            shadow = verdict_class(result)
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+        elapsed, cpu = time.perf_counter() - started, time.thread_time() - cpu_started
+        agree = None if shadow is None else int(shadow == production)
+        metrics.inc("truevail_shadow_total", candidate=name, outcome="error" if error else ("agree" if agree else "disagree"))
+        rows.append((name, now, production, shadow, agree, production_seconds, elapsed, tokens, cpu, error, content[:200]))
+    if rows:
+        _store(rows)
+
+
+def _worker_loop():
+    while True:
+        text, production_result, production_seconds = _queue.get()
+        try:
+            run_sample(text, production_result, production_seconds)
+        except Exception as e:
+            logger.warning("Shadow evaluation failed: %s", e)
+
+
+def _ensure_workers():
+    global _workers_pid
+    if _workers_pid == os.getpid():
+        return
+    with _workers_lock:
+        if _workers_pid != os.getpid():
+            for i in range(max(1, SHADOW_WORKERS)):
+                threading.Thread(target=_worker_loop, name=f"shadow-{i}", daemon=True).start()
+            _workers_pid = os.getpid()
+
+
+def enabled():
+    return bool(SHADOW_CANDIDATES) and SHADOW_SAMPLE_RATE > 0
+
+
+def mirror(text, analysis_type, production_result, production_seconds):
+    """Queues a sample of news analyses for the candidates; never blocks."""
+    if not enabled() or analysis_type != "news" or not text or random.random() >= SHADOW_SAMPLE_RATE:
+        return
+    if not isinstance(production_result, dict) or production_result.get("partial"):
+        return
+    _ensure_workers()
+    try:
+        _queue.put_nowait((text, production_result, production_seconds))
+    except queue.Full:
+        metrics.inc("truevail_shadow_total", candidate="*", outcome="dropped")
+
+
+def _percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return round(values[min(len(values) - 1, int(len(values) * q))], 4)
+
+
+def authorized(token):
+    """True when token grants access to the report (SHADOW_REPORT_TOKEN must be set)."""
+    return bool(SHADOW_REPORT_TOKEN and token) and hmac.compare_digest(
+        token.encode("utf-8"), SHADOW_REPORT_TOKEN.encode("utf-8")
+    )
+
+
+def report(hours=SHADOW_REPORT_HOURS):
+    """Per-candidate agreement, latency and cost over the last hours."""
+    candidates = {}
+    if os.path.exists(SHADOW_DB):
+        rows = _connect().execute(
+            "SELECT candidate, production, shadow, agree, production_seconds, shadow_seconds, tokens,"
+            " cpu_seconds, error, excerpt FROM comparisons WHERE created_at >= ? ORDER BY id",
+            (time.time() - hours * 3600,),
+        ).fetchall()
+    else:
+        rows = []
+    for name, production, shadow, agree, production_seconds, shadow_seconds, tokens, cpu, error, excerpt in rows:
+        stats = candidates.setdefault(name, {
+            "samples": 0, "errors": 0, "agreements": 0, "confusion": {},
+            "production_seconds": [], "shadow_seconds": [], "tokens": 0, "cpu_seconds": 0.0, "disagreements": [],
+        })
+        stats["samples"] += 1
+        if error:
+            stats["errors"] += 1
+            continue
+        stats["agreements"] += agree
+        pair = f"{production}->{shadow}"
+        stats["confusion"][pair] = stats["confusion"].get(pair, 0) + 1
+        stats["production_seconds"].append(production_seconds or 0.0)
+        stats["shadow_seconds"].append(shadow_seconds)
+        stats["tokens"] += tokens or 0
+        stats["cpu_seconds"] += cpu or 0.0
+        if not agree:
+            stats["disagreements"] = (stats["disagreements"] + [{"production": production, "shadow": shadow, "excerpt": excerpt}])[-REPORT_EXAMPLES:]
+
+    for stats in candidates.values():
+        compared = stats["samples"] - stats["errors"]
+        production_seconds = stats.pop("production_seconds")
+        shadow_seconds = stats.pop("shadow_seconds")
+        stats["agreement_rate"] = round(stats["agreements"] / compared, 4) if compared else None
+        stats["latency"] = {
+            "production_p50": _percentile(production_seconds, 0.5),
+            "production_p95": _percentile(production_seconds, 0.95),
+            "shadow_p50": _percentile(shadow_seconds, 0.5),
+            "shadow_p95": _percentile(shadow_seconds, 0.95),
+        }
+        stats["cost"] = {
+            "tokens_per_sample": round(stats.pop("tokens") / compared, 1) if compared else None,
+            "cpu_seconds_per_sample": round(stats.pop("cpu_seconds") / compared, 4) if compared else None,
+        }
+    return {
+        "enabled": enabled(),
+        "sample_rate": SHADOW_SAMPLE_RATE,
+        "window_hours": hours,
+        "queued": _queue.qsize(),
+        "candidates": candidates,
+    }